@@ -0,0 +1,52 @@
+import numpy as np
+
+from statevector import TOL, num_qubits, reduced_density_matrices
+
+# per-qubit analytics of batched pure states, entangled or not. everything comes from each
+# qubit's reduced density matrix (a partial trace over the others), so a product state and an
+# entangled one go through the same arithmetic: entanglement just shows up as a Bloch vector
+# inside the sphere, purity below 1 and entropy above 0
+
+
+def bloch_from_density(rhos):
+    # (B, 3) from (B, 2, 2)
+    return np.stack([2 * rhos[:, 1, 0].real, 2 * rhos[:, 1, 0].imag, (rhos[:, 0, 0] - rhos[:, 1, 1]).real], axis=-1)
+
+
+def purities(rhos):
+    # Tr(rho^2), 1 for a pure state down to 1/d when maximally mixed
+    return np.einsum('bij,bji->b', rhos, rhos).real
+
+
+def entropies(rhos):
+    # von Neumann entropy in bits
+    eigenvalues = np.clip(np.linalg.eigvalsh(rhos), 0.0, 1.0)
+    terms = np.where(eigenvalues > TOL, -eigenvalues * np.log2(np.where(eigenvalues > TOL, eigenvalues, 1.0)), 0.0)
+    return terms.sum(axis=-1)
+
+
+def concurrence(states):
+    # two-qubit pure states, 0 for product states up to 1 for Bell states
+    return 2 * np.abs(states[:, 0] * states[:, 3] - states[:, 1] * states[:, 2])
+
+
+def azimuths(bloch):
+    # azimuth of the Bloch vector, the phase of |1> relative to |0>. 0 with no XY component
+    xy = np.hypot(bloch[:, 0], bloch[:, 1])
+    return np.where(xy > TOL, np.arctan2(bloch[:, 1], bloch[:, 0]), 0.0)
+
+
+def qubit_analytics(states):
+    # one dict of (B, ...) arrays per qubit, q0 first. states should be normalized
+    results = []
+    for q in range(num_qubits(states)):
+        rhos = reduced_density_matrices(states, [q])
+        bloch = bloch_from_density(rhos)
+        results.append({
+            'density_matrix': rhos,
+            'bloch': bloch,
+            'purity': purities(rhos),
+            'entropy': entropies(rhos),
+            'relative_phase': azimuths(bloch)
+        })
+    return results
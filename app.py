@@ -1,112 +1,205 @@
-from flask import Flask, request, jsonify, send_from_directory
+import startup
+startup.install_import_timer()
+
+from flask import Flask, Response, g, has_request_context, request, jsonify, send_file, send_from_directory, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import numpy as np
-import re
+import logging
+import multiprocessing
 import os
-import random
+import select
+import socket
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import config
+import metrics
+import profiling
+import wire
+import workpool
+from expressions import evaluate_expression
+from parametric import compile_parametric, get_parametric
+from state_engine import states_from_json, gates_from_json, apply_gates, norms, normalize, measure, state_results, sample_shots, post_measurement_states
+from pipeline import cache_stats as process_cache_stats, merge_cache_stats, decompose_request, decompose_unitaries, decompose_chunk, simulate_noise_request, sweep_schedule_request
+
+class WorkbenchJSONProvider(DefaultJSONProvider):
+    # responses keep complex values as numpy, plain json writes them out as {'re', 'im'}
+    @staticmethod
+    def default(o):
+        if isinstance(o, (np.ndarray, np.generic, complex)):
+            return wire.plain_json(o)
+        return DefaultJSONProvider.default(o)
 
-from sympy import sympify, I, latex as sympy_latex, N, re as sym_re, im as sym_im
-from sympy.parsing.sympy_parser import parse_expr, standard_transformations, implicit_multiplication_application
 
 app = Flask(__name__, static_folder='.', static_url_path='')
+app.json = WorkbenchJSONProvider(app)
 
 CORS(app)
 
-def calculate_separable_state_info(state_vector):
-    c1, c2, c3, c4 = state_vector
-
-    # get magnitudes for qubit 1
-    alpha1_mag = np.sqrt(abs(c1)**2 + abs(c2)**2)
-    beta1_mag = np.sqrt(abs(c3)**2 + abs(c4)**2)
-    qubit1_norm = np.sqrt(alpha1_mag**2 + beta1_mag**2)
-    if qubit1_norm > 1e-10:
-        alpha1_norm = alpha1_mag / qubit1_norm
-        beta1_norm = beta1_mag / qubit1_norm
-    else:
-        alpha1_norm = 1.0
-        beta1_norm = 0.0
-
-    # phase for qubit 1 basis
-    if abs(c1) > 1e-10:
-        alpha1_phase = c1 / abs(c1)
-    elif abs(c2) > 1e-10:
-        alpha1_phase = c2 / abs(c2)
-    else:
-        alpha1_phase = 1.0 + 0.0j
-
-    if abs(c3) > 1e-10:
-        beta1_phase = c3 / abs(c3)
-    elif abs(c4) > 1e-10:
-        beta1_phase = c4 / abs(c4)
-    else:
-        beta1_phase = 1.0 + 0.0j
-
-    alpha_qubit1 = alpha1_norm * alpha1_phase
-    beta_qubit1 = beta1_norm * beta1_phase
-
-    # relative phase between alpha and beta (q1)
-    if abs(alpha_qubit1) > 1e-10 and abs(beta_qubit1) > 1e-10:
-        q1current_relative_phase = np.angle(beta_qubit1 / alpha_qubit1)
-    else:
-        q1current_relative_phase = 0.0
-
-    # qubit 0 now
-    gamma0_mag = np.sqrt(abs(c1)**2 + abs(c3)**2)
-    delta0_mag = np.sqrt(abs(c2)**2 + abs(c4)**2)
-    qubit0_norm = np.sqrt(gamma0_mag**2 + delta0_mag**2)
-    if qubit0_norm > 1e-10:
-        gamma0_norm = gamma0_mag / qubit0_norm
-        delta0_norm = delta0_mag / qubit0_norm
-    else:
-        gamma0_norm = 1.0
-        delta0_norm = 0.0
-
-    if abs(c1) > 1e-10:
-        gamma0_phase = c1 / abs(c1)
-    elif abs(c3) > 1e-10:
-        gamma0_phase = c3 / abs(c3)
-    else:
-        gamma0_phase = 1.0 + 0.0j
-    if abs(c2) > 1e-10:
-        delta0_phase = c2 / abs(c2)
-    elif abs(c4) > 1e-10:
-        delta0_phase = c4 / abs(c4)
-    else:
-        delta0_phase = 1.0 + 0.0j
-
-    gamma_qubit0 = gamma0_norm * gamma0_phase
-    delta_qubit0 = delta0_norm * delta0_phase
-
-    # relative for q0
-    if abs(gamma_qubit0) > 1e-10 and abs(delta_qubit0) > 1e-10:
-        q0current_relative_phase = np.angle(delta_qubit0 / gamma_qubit0)
-    else:
-        q0current_relative_phase = 0.0
-
-    def qubit_to_bloch(alpha, beta):
-        alpha_conj = np.conj(alpha)
-        x = 2 * (alpha_conj * beta).real
-        y = 2 * (alpha_conj * beta).imag
-        z = abs(alpha)**2 - abs(beta)**2
-        return [float(x), float(y), float(z)]
-
-    bloch_qubit1 = qubit_to_bloch(alpha_qubit1, beta_qubit1)
-    bloch_qubit0 = qubit_to_bloch(gamma_qubit0, delta_qubit0)
-
-    return {
-        'bloch_qubit1': bloch_qubit1,
-        'bloch_qubit0': bloch_qubit0,
-        'qubit1_state': {
-            'alpha': {'re': float(alpha_qubit1.real), 'im': float(alpha_qubit1.imag)},
-            'beta': {'re': float(beta_qubit1.real), 'im': float(beta_qubit1.imag)}
-        },
-        'qubit0_state': {
-            'gamma': {'re': float(gamma_qubit0.real), 'im': float(gamma_qubit0.imag)},
-            'delta': {'re': float(delta_qubit0.real), 'im': float(delta_qubit0.imag)}
-        },
-        'q0current_relative_phase': float(q0current_relative_phase),
-        'q1current_relative_phase': float(q1current_relative_phase)
-    }
+# the workbench.* loggers (slow requests, trace events) go to stderr at LOG_LEVEL
+logging.basicConfig(format='%(asctime)s %(name)s %(levelname)s %(message)s')
+logging.getLogger('workbench').setLevel(config.LOG_LEVEL)
+
+# routes that need sympy/qiskit, refused by state-only workers
+DECOMPOSITION_ENDPOINTS = {'decompose', 'decompose_batch', 'compile_parametric_gate', 'evaluate_parametric_gate', 'simulate_noise', 'sweep_schedule', 'gate_library_index'}
+
+@app.before_request
+def start_request_metrics():
+    metrics.begin_request(request.endpoint or 'unknown')
+
+
+@app.after_request
+def record_request_metrics(response):
+    # streamed responses (/decompose_batch) are timed up to the first byte
+    metrics.end_request(response.status_code)
+    return response
+
+
+@app.teardown_request
+def drop_request_metrics(exc):
+    # after_request doesn't run when a route raises
+    if metrics.active():
+        metrics.end_request(500)
+
+
+@app.before_request
+def start_profiling():
+    # X-Profile: 1 (or ?profile=1) from an allowlisted client profiles this one request
+    g.request_id = profiling.request_id(request.headers.get('X-Request-ID'))
+    wanted = request.headers.get('X-Profile') or request.args.get('profile')
+    if wanted and wanted != '0' and profiling.allowed(request.remote_addr):
+        profiling.begin(g.request_id)
+
+
+@app.after_request
+def finish_profiling(response):
+    # registered after the metrics hook so it runs first, while the stage timings are still there
+    response.headers['X-Request-ID'] = g.get('request_id', '')
+    if profiling.active():
+        response.headers['X-Profile-Id'] = profiling.end(request.endpoint, response.status_code, metrics.current_stages())
+    return response
+
+
+@app.teardown_request
+def drop_profiling(exc):
+    if profiling.active():
+        profiling.end(request.endpoint, 500, metrics.current_stages())
+
+
+@app.before_request
+def start_request_budget():
+    # every pool task of a request shares one deadline, a client can ask for less than the limit
+    budget = config.REQUEST_BUDGET_SECONDS
+    asked = request.headers.get('X-Request-Budget', type=float)
+    if asked is not None and asked > 0:
+        budget = min(budget, asked)
+    g.deadline = time.monotonic() + budget
+
+
+@app.before_request
+def check_worker_role():
+    if config.WORKER_ROLE == 'state' and request.endpoint in DECOMPOSITION_ENDPOINTS:
+        return jsonify({'success': False, 'error': 'This worker only serves state endpoints'}), 503
+
+measurement_rng = np.random.default_rng()
+
+
+def request_data():
+    # json bodies may carry packed arrays, msgpack bodies always do
+    if request.mimetype == wire.MSGPACK:
+        return wire.loads(request.get_data(), wire.MSGPACK)
+    return request.json
+
+
+def response_format():
+    # plain json unless the client asks for a packed format in Accept
+    return request.accept_mimetypes.best_match(wire.formats(), default=wire.JSON)
+
+
+def respond(result):
+    fmt = response_format()
+    if fmt == wire.JSON:
+        return jsonify(result)
+    return Response(wire.dumps(result, fmt), mimetype=fmt)
+
+
+_batch_pool = None
+_batch_pool_lock = threading.Lock()
+
+def get_batch_pool():
+    global _batch_pool
+    with _batch_pool_lock:
+        if _batch_pool is None:
+            # forkserver rather than fork, forking a threaded server can copy held locks
+            _batch_pool = ProcessPoolExecutor(max_workers=config.BATCH_WORKERS,
+                                              mp_context=multiprocessing.get_context('forkserver'),
+                                              initializer=startup.warm_up)
+        return _batch_pool
+
+_work_pool = None
+_work_pool_lock = threading.Lock()
+
+def get_work_pool():
+    global _work_pool
+    with _work_pool_lock:
+        if _work_pool is None:
+            # workers warm up like this process did and report their cache stats after every task
+            _work_pool = workpool.WorkPool(config.WORK_POOL_WORKERS, config.WORK_QUEUE_SIZE, config.WORK_QUEUE_TIMEOUT,
+                                           initializer=startup.warm_up, reporter=process_cache_stats)
+            metrics.register_collector(_work_pool.collect)
+        return _work_pool
+
+
+def client_disconnected():
+    # only the werkzeug dev server hands out the socket, elsewhere a disconnect goes unnoticed
+    sock = request.environ.get('werkzeug.socket')
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b''
+    except ValueError:
+        # tls sockets can't peek
+        return False
+    except OSError:
+        return True
+
+
+def offload(fn, *args):
+    # run fn(*args) in the work pool under the request's budget. outside a request (pool and
+    # batch workers) or with the pool disabled it just runs here
+    if not config.WORK_POOL_WORKERS or not has_request_context():
+        return fn(*args)
+    pool = get_work_pool()
+    if profiling.active():
+        # the worker profiles its part and sends it back to be merged into this request's profile
+        result, stats, traces = pool.run(profiling.run_profiled, fn, *args, deadline=g.deadline, cancelled=client_disconnected)
+        profiling.merge_worker(stats, traces)
+        return result
+    return pool.run(fn, *args, deadline=g.deadline, cancelled=client_disconnected)
+
+
+if not config.WORK_POOL_WORKERS:
+    # requests run inline in this process, so it does the warm-up itself
+    startup.warm_up()
+elif __name__ != '__mp_main__':
+    # started now so the workers are warm by the first request rather than starting with it. the
+    # workers do the warm-up, this process doesn't import what only they use. not in pool workers,
+    # which import this module again as __mp_main__ when it's run as `python app.py`
+    with startup.phase('work_pool'):
+        get_work_pool()
+
+
+def error_response(e):
+    # pool rejections carry their own status, anything else is a bad request
+    response = jsonify({'success': False, 'error': str(e)})
+    if not isinstance(e, workpool.PoolError):
+        return response, 400
+    if e.status == 429:
+        response.headers['Retry-After'] = '1'
+    return response, e.status
 
 
 @app.route('/')
@@ -119,150 +212,114 @@ def evaluate_complex():
     try:
         data = request.json
 
-        expr_str = data.get('expression', '0').strip()
-        # some light parsing and symbol stuff
-        expr_str = re.sub(r'\be\b', 'E', expr_str)
-        expr_str = re.sub(r'(\d)i\b', r'\1*I', expr_str)
-        expr_str = re.sub(r'\bi(pi|theta|phi)\b', r'I*\1', expr_str)   # i*pi etc fixes
-        expr_str = re.sub(r'(^|[\+\-\*/\(\)\^])\s*i\s*(?=[\+\-\*/\)\^]|$)', r'\1I', expr_str)
-        expr_str = re.sub(r'\bi\b', 'I', expr_str)
-        expr_str = expr_str.replace('^', '**')   # python exponent
-        transformations = standard_transformations + (implicit_multiplication_application,)
-        expr = parse_expr(expr_str, transformations=transformations)
-
-        latex_output = sympy_latex(expr)
-        from sympy import simplify
-
-        simplified = simplify(expr)
-        real_part, imag_part = simplified.as_real_imag()
-        real_float = float(real_part)
-        imag_float = float(imag_part)
-        return jsonify({
-            'success': True,
-            'real': real_float,
-            'imag': imag_float,
-            'latex': latex_output
-        })
+        with metrics.stage('evaluate'):
+            parsed = evaluate_expression(data.get('expression', '0'), offload)
+        with metrics.stage('latex'):
+            latex_output = parsed.latex(offload)
+        real_float = parsed.value.real
+        imag_float = parsed.value.imag
+        with metrics.stage('serialize'):
+            return jsonify({
+                'success': True,
+                'real': real_float,
+                'imag': imag_float,
+                'latex': latex_output
+            })
     except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 400
+        return error_response(e)
 
 
 
 @app.route('/decompose', methods=['POST'])
 def decompose():
     try:
-        data = request.json
-        # parse matrix expressions
-        matrix_expressions = data['matrix']
-        matrix = []
-        for row in matrix_expressions:
-            matrix_row = []
-            for expr_str in row:
-                expr_str = expr_str.strip()
-                expr_str = re.sub(r'\be\b', 'E', expr_str)
-                expr_str = re.sub(r'(\d)i\b', r'\1*I', expr_str)
-                expr_str = re.sub(r'\bi(pi|theta|phi)\b', r'I*\1', expr_str)
-                expr_str = re.sub(r'(^|[\+\-\*/\(\)\^])\s*i\s*(?=[\+\-\*/\)\^]|$)', r'\1I', expr_str)
-                expr_str = re.sub(r'\bi\b', 'I', expr_str)
-                expr_str = expr_str.replace('^', '**')
-                transformations = standard_transformations + (implicit_multiplication_application,)
-                expr = parse_expr(expr_str, transformations=transformations)
-                from sympy import simplify
-                simplified = simplify(expr)
-                real_part, imag_part = simplified.as_real_imag()
-                real_float = float(real_part)
-                imag_float = float(imag_part)
-                complex_val = complex(real_float, imag_float)
-                matrix_row.append(complex_val)
-            matrix.append(matrix_row)
-        matrix = np.array(matrix, dtype=complex)
-
-        # print
-        print(matrix)
-
-        is_unitary = np.allclose(matrix @ matrix.conj().T, np.identity(matrix.shape[0]), atol=1e-10)
-        if not is_unitary:
-            return jsonify({'success': False, 'error': 'Matrix is not unitary', 'is_unitary': False}), 400
-
-        from decomposition import decompose_gate, relevant_parameters, InstructionSet
-
-        rabi_frequency = float(data.get('rabi_frequency', 20e6))
-        q0drive_freq = float(data.get('q0drive_freq', 5.3e9))
-        q1drive_freq = float(data.get('q1drive_freq', 5e9))
-
-        # phases, sometimes set from state
-        q0current_relative_phase = 0.0
-        q1current_relative_phase = 0.0
-        if 'state_vector' in data:
-            state_vector_dict = data['state_vector']
-            state_vector = [complex(c['re'], c['im']) for c in state_vector_dict]
-            c1, c2, c3, c4 = state_vector
-            c1c4 = c1 * c4
-            c2c3 = c2 * c3
-            is_separable = abs(c1c4 - c2c3) < 1e-10
-            if is_separable:
-                alpha1_mag = np.sqrt(abs(c1)**2 + abs(c2)**2)
-                beta1_mag = np.sqrt(abs(c3)**2 + abs(c4)**2)
-                if alpha1_mag > 1e-10 and beta1_mag > 1e-10:
-                    alpha1 = c1 / alpha1_mag if abs(c1) > 1e-10 else c2 / alpha1_mag if abs(c2) > 1e-10 else 1.0
-                    beta1 = c3 / beta1_mag if abs(c3) > 1e-10 else c4 / beta1_mag if abs(c4) > 1e-10 else 0.0
-                    q1current_relative_phase = np.angle(beta1 / alpha1) if abs(alpha1) > 1e-10 else 0.0
-                gamma0_mag = np.sqrt(abs(c1)**2 + abs(c3)**2)
-                delta0_mag = np.sqrt(abs(c2)**2 + abs(c4)**2)
-                if gamma0_mag > 1e-10 and delta0_mag > 1e-10:
-                    gamma0 = c1 / gamma0_mag if abs(c1) > 1e-10 else c3 / gamma0_mag if abs(c3) > 1e-10 else 1.0
-                    delta0 = c2 / delta0_mag if abs(c2) > 1e-10 else c4 / delta0_mag if abs(c4) > 1e-10 else 0.0
-                    q0current_relative_phase = np.angle(delta0 / gamma0) if abs(gamma0) > 1e-10 else 0.0
-
-        rparams = relevant_parameters(
-            rabi_frequency=rabi_frequency,
-            q0drive_freq=q0drive_freq,
-            q1drive_freq=q1drive_freq,
-            q0current_relative_phase=q0current_relative_phase,
-            q1current_relative_phase=q1current_relative_phase
-        )
-
-
-        mode = "iSwap"
-        RM, tags, qcircuit = decompose_gate(matrix, mode)
-        instructionset, final_rparams = InstructionSet(RM, tags, mode, rparams)
-
-        instructions_json = []
-
-        for instr in instructionset:
-            gate_matrix = []
-            if hasattr(instr.underlying_gate, 'tolist'):
-                gate_array = instr.underlying_gate
-            else:
-                gate_array = np.array(instr.underlying_gate)
-            for row in gate_array:
-                gate_row = []
-                for elem in row:
-                    gate_row.append({'re': float(elem.real), 'im': float(elem.imag)})
-                gate_matrix.append(gate_row)
-            instructions_json.append({
-                'code': instr.code,
-                'title': instr.title,
-                'tag': instr.tag,
-                'instruction_string': instr.instruction_string,
-                'details': instr.details,
-                'angle': float(instr.angle) if instr.angle is not None else None,
-                'underlying_gate': gate_matrix
-            })
+        data = request_data()
+        # parsing, synthesis and the instruction set run in the work pool, their stage timings come back with the result
+        result = offload(decompose_request, data)
+        if not result['success']:
+            return jsonify(result), 400
+
+        with metrics.stage('serialize'):
+            return respond(result)
+    except Exception as e:
+        return error_response(e)
 
 
-        return jsonify({
-            'success': True, 
-            'message': 'Matrix is unitary', 
-            'is_unitary': True,
-            'instructions': instructions_json
-        })
+
+@app.route('/simulate_noise', methods=['POST'])
+def simulate_noise():
+    try:
+        data = request_data()
+        # decomposition and the noisy replay both run in the work pool
+        result = offload(simulate_noise_request, data)
+        if not result['success']:
+            return jsonify(result), 400
+
+        with metrics.stage('serialize'):
+            return respond(result)
+    except Exception as e:
+        return error_response(e)
+
+
+
+@app.route('/sweep_schedule', methods=['POST'])
+def sweep_schedule():
+    try:
+        data = request_data()
+        # one decomposition, then the schedule over every grid point, in the work pool
+        result = offload(sweep_schedule_request, data)
+        if not result['success']:
+            return jsonify(result), 400
+
+        with metrics.stage('serialize'):
+            return respond(result)
+    except Exception as e:
+        return error_response(e)
+
+
+
+@app.route('/decompose_batch', methods=['POST'])
+def decompose_batch():
+    try:
+        data = request_data()
+        items = data['items']
+        if not isinstance(items, list):
+            raise ValueError("items must be a list")
+        # top level rabi_frequency / drive freqs / state_vector act as defaults for every item
+        defaults = {k: v for k, v in data.items() if k != 'items'}
+        items = [{**defaults, **item} for item in items]
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
+    pool = get_batch_pool()
+    futures = {}
+    for start in range(0, len(items), config.BATCH_CHUNK_SIZE):
+        chunk = items[start:start + config.BATCH_CHUNK_SIZE]
+        futures[pool.submit(decompose_chunk, start, chunk)] = (start, len(chunk))
+
+    # ndjson in either json format, back-to-back objects for msgpack
+    fmt = response_format()
+    separator = b'' if fmt == wire.MSGPACK else b'\n'
+
+    def generate():
+        # one object per result, in completion order, each tagged with its item index
+        try:
+            for future in as_completed(futures):
+                try:
+                    results = future.result()
+                except Exception as e:
+                    # the worker itself failed, report every item of its chunk
+                    start, count = futures[future]
+                    results = [{'index': start + k, 'success': False, 'error': str(e)} for k in range(count)]
+                for result in results:
+                    yield wire.dumps(result, fmt) + separator
+        finally:
+            # also runs when the client disconnects, drop the chunks that haven't started
+            for future in futures:
+                future.cancel()
+
+    return Response(stream_with_context(generate()), mimetype=wire.MSGPACK if fmt == wire.MSGPACK else 'application/x-ndjson')
+
 
 
 @app.route('/decompose_gate', methods=['POST'])
@@ -278,167 +335,227 @@ def decompose_state():
             expr_str = expr_str.strip()
             if not expr_str:
                 return 0.0 + 0.0j
-            expr_str = re.sub(r'\be\b', 'E', expr_str)
-            expr_str = re.sub(r'(\d)i\b', r'\1*I', expr_str)
-            expr_str = re.sub(r'\bi(pi|theta|phi)\b', r'I*\1', expr_str)
-            expr_str = re.sub(r'(^|[\+\-\*/\(\)\^])\s*i\s*(?=[\+\-\*/\)\^]|$)', r'\1I', expr_str)
-            expr_str = re.sub(r'\bi\b', 'I', expr_str)
-            expr_str = expr_str.replace('^', '**')
-            transformations = standard_transformations + (implicit_multiplication_application,)
-            expr = parse_expr(expr_str, transformations=transformations)
-            from sympy import simplify
-
-            simplified = simplify(expr)
-            real_part, imag_part = simplified.as_real_imag()
-            real_float = float(real_part)
-            imag_float = float(imag_part)
-            return complex(real_float, imag_float)
-
-        # two ways to interpret inputs
-        if mode == 'vector':
-            c1 = parse_complex_expr(expressions[0] if len(expressions) > 0 else '0')
-            c2 = parse_complex_expr(expressions[1] if len(expressions) > 1 else '0')
-            c3 = parse_complex_expr(expressions[2] if len(expressions) > 2 else '0')
-            c4 = parse_complex_expr(expressions[3] if len(expressions) > 3 else '0')
-        else:
-            alpha = parse_complex_expr(expressions[0] if len(expressions) > 0 else '1')
-            beta = parse_complex_expr(expressions[1] if len(expressions) > 1 else '0')
-            gamma = parse_complex_expr(expressions[2] if len(expressions) > 2 else '1')
-            delta = parse_complex_expr(expressions[3] if len(expressions) > 3 else '0')
-            norm1 = np.sqrt(abs(alpha)**2 + abs(beta)**2)
-            if norm1 > 1e-10:
-                alpha = alpha / norm1
-                beta = beta / norm1
-            else:
-                alpha = 1.0 + 0.0j
-                beta = 0.0 + 0.0j
-            norm0 = np.sqrt(abs(gamma)**2 + abs(delta)**2)
-            if norm0 > 1e-10:
-                gamma = gamma / norm0
-                delta = delta / norm0
+            return evaluate_expression(expr_str, offload).value
+
+        with metrics.stage('parse'):
+            # two ways to interpret inputs
+            if mode == 'vector':
+                c1 = parse_complex_expr(expressions[0] if len(expressions) > 0 else '0')
+                c2 = parse_complex_expr(expressions[1] if len(expressions) > 1 else '0')
+                c3 = parse_complex_expr(expressions[2] if len(expressions) > 2 else '0')
+                c4 = parse_complex_expr(expressions[3] if len(expressions) > 3 else '0')
             else:
-                gamma = 1.0 + 0.0j
-                delta = 0.0 + 0.0j
-            c1 = alpha * gamma
-            c2 = alpha * delta
-            c3 = beta * gamma
-            c4 = beta * delta
-
-        state_vector = [c1, c2, c3, c4]
+                alpha = parse_complex_expr(expressions[0] if len(expressions) > 0 else '1')
+                beta = parse_complex_expr(expressions[1] if len(expressions) > 1 else '0')
+                gamma = parse_complex_expr(expressions[2] if len(expressions) > 2 else '1')
+                delta = parse_complex_expr(expressions[3] if len(expressions) > 3 else '0')
+                norm1 = np.sqrt(abs(alpha)**2 + abs(beta)**2)
+                if norm1 > 1e-10:
+                    alpha = alpha / norm1
+                    beta = beta / norm1
+                else:
+                    alpha = 1.0 + 0.0j
+                    beta = 0.0 + 0.0j
+                norm0 = np.sqrt(abs(gamma)**2 + abs(delta)**2)
+                if norm0 > 1e-10:
+                    gamma = gamma / norm0
+                    delta = delta / norm0
+                else:
+                    gamma = 1.0 + 0.0j
+                    delta = 0.0 + 0.0j
+                c1 = alpha * gamma
+                c2 = alpha * delta
+                c3 = beta * gamma
+                c4 = beta * delta
+
+            states = np.array([[c1, c2, c3, c4]], dtype=complex)
 
         # normalize
-        norm = np.sqrt(sum(abs(c)**2 for c in state_vector))
-        if norm > 1e-10:
-            state_vector = [c / norm for c in state_vector]
-        else:
+        if norms(states)[0] <= 1e-10:
             return jsonify({'success': False, 'error': 'State vector is zero'}), 400
 
-        probabilities = [abs(c)**2 for c in state_vector]
+        result = {'success': True}
+        with metrics.stage('state_analysis'):
+            result.update(state_results(normalize(states))[0])
+        with metrics.stage('serialize'):
+            return respond(result)
+    except Exception as e:
+        return error_response(e)
+
+
+
+@app.route('/compile_parametric', methods=['POST'])
+def compile_parametric_gate():
+    try:
+        data = request.json
+        gate = compile_parametric(data['matrix'], offload)
+        return jsonify({
+            'success': True,
+            'handle': gate.handle,
+            'parameters': gate.parameters
+        })
+    except Exception as e:
+        return error_response(e)
+
+
+
+@app.route('/evaluate_parametric', methods=['POST'])
+def evaluate_parametric_gate():
+    try:
+        data = request_data()
+        gate = get_parametric(data.get('handle'))
+        if gate is None:
+            return jsonify({'success': False, 'error': 'Unknown or expired handle, compile the matrix again'}), 404
 
-        c1c4 = state_vector[0] * state_vector[3]
-        c2c3 = state_vector[1] * state_vector[2]
-        is_separable = abs(c1c4 - c2c3) < 1e-10
+        # each value is a scalar or a list, lists broadcast against each other
+        unitaries = gate.evaluate(data.get('values', {}))
+        flat = unitaries.reshape(-1, 4, 4)
+        products = flat @ flat.conj().transpose(0, 2, 1)
+        is_unitary = np.all(np.isclose(products, np.identity(4), atol=1e-10), axis=(1, 2))
 
         result = {
             'success': True,
-            'coefficients': [
-                {'re': float(c.real), 'im': float(c.imag)} for c in state_vector
-            ],
-            'probabilities': probabilities,
-            'is_separable': is_separable
+            'parameters': gate.parameters,
+            'shape': list(unitaries.shape[:-2]),
+            'unitaries': flat,
+            'is_unitary': is_unitary.tolist()
         }
 
-        if is_separable:
-            separable_info = calculate_separable_state_info(state_vector)
-            result.update(separable_info)
-        else:
-            result['q0current_relative_phase'] = 0.0
-            result['q1current_relative_phase'] = 0.0
+        if data.get('decompose', False):
+            result['decompositions'] = offload(decompose_unitaries, flat, is_unitary, data)
 
-        return jsonify(result)
+        return respond(result)
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 400
+        return error_response(e)
+
+
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    # this process plus the work pool workers, as of the last task each one ran. decompositions are
+    # mostly cached in the workers, compiled parametric gates only ever in this process
+    reports = [process_cache_stats()]
+    if config.WORK_POOL_WORKERS:
+        reports.extend(get_work_pool().reports())
+    return jsonify({'success': True, **merge_cache_stats(reports)})
+
+
+
+def measure_results(states, qubit_index, rng):
+    outcomes, probs, total, collapsed = measure(states, qubit_index, rng)
+    collapsed_norms = norms(collapsed)
+    results = state_results(normalize(collapsed))
+    for b in range(len(states)):
+        if total[b] < 1e-10:
+            results[b] = {'success': False, 'error': 'State vector is zero'}
+        elif collapsed_norms[b] <= 1e-10:
+            results[b] = {'success': False, 'error': 'Collapsed state is zero'}
+        else:
+            results[b].update({
+                'success': True,
+                'measurement_result': int(outcomes[b]),
+                'prob_0': float(probs[b, 0]),
+                'prob_1': float(probs[b, 1])
+            })
+    return results
 
 
 
 @app.route('/measure_qubit', methods=['POST'])
 def measure_qubit():
     try:
-        data = request.json
-        qubit_index = data.get('qubit_index', 0)
+        data = request_data()
+        qubit_index = 0 if data.get('qubit_index', 0) == 0 else 1
         state_vector_dict = data.get('state_vector')
         if not state_vector_dict:
             return jsonify({'success': False, 'error': 'No state vector provided'}), 400
 
+        rng = np.random.default_rng(data['seed']) if 'seed' in data else measurement_rng
+        with metrics.stage('parse'):
+            states = states_from_json([state_vector_dict])
+        with metrics.stage('measure'):
+            result = measure_results(states, qubit_index, rng)[0]
+        if not result['success']:
+            return jsonify(result), 400
+        with metrics.stage('serialize'):
+            return respond(result)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
 
-        state_vector = [complex(c['re'], c['im']) for c in state_vector_dict]
-
-        # choose which qubit to collapse
-        if qubit_index == 0:
-            prob_0 = abs(state_vector[0])**2 + abs(state_vector[2])**2
-            prob_1 = abs(state_vector[1])**2 + abs(state_vector[3])**2
-        else:
-            prob_0 = abs(state_vector[0])**2 + abs(state_vector[1])**2
-            prob_1 = abs(state_vector[2])**2 + abs(state_vector[3])**2
 
-        total_prob = prob_0 + prob_1
-        if total_prob < 1e-10:
-            return jsonify({'success': False, 'error': 'State vector is zero'}), 400
 
-        prob_0 = prob_0 / total_prob
-        prob_1 = prob_1 / total_prob  # (not really used below)
+@app.route('/measure_qubit_batch', methods=['POST'])
+def measure_qubit_batch():
+    try:
+        data = request_data()
+        qubit_index = 0 if data.get('qubit_index', 0) == 0 else 1
+        state_vectors = data.get('state_vectors')
+        if not state_vectors:
+            return jsonify({'success': False, 'error': 'No state vectors provided'}), 400
+
+        # zero states fail individually, the rest of the batch is still measured
+        rng = np.random.default_rng(data['seed']) if 'seed' in data else measurement_rng
+        results = measure_results(states_from_json(state_vectors), qubit_index, rng)
+        return respond({'success': True, 'results': results})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
 
-        measurement_result = 0 if random.random() < prob_0 else 1
 
-        # collapse the state
-        collapsed_state = [0.0 + 0.0j, 0.0 + 0.0j, 0.0 + 0.0j, 0.0 + 0.0j]
-        if qubit_index == 0:
-            if measurement_result == 0:
-                collapsed_state[0] = state_vector[0]
-                collapsed_state[2] = state_vector[2]
-            else:
-                collapsed_state[1] = state_vector[1]
-                collapsed_state[3] = state_vector[3]
-        else:
-            if measurement_result == 0:
-                collapsed_state[0] = state_vector[0]
-                collapsed_state[1] = state_vector[1]
-            else:
-                collapsed_state[2] = state_vector[2]
-                collapsed_state[3] = state_vector[3]
 
-        norm = np.sqrt(sum(abs(c)**2 for c in collapsed_state))
-        if norm > 1e-10:
-            collapsed_state = [c / norm for c in collapsed_state]
+@app.route('/measure_shots', methods=['POST'])
+def measure_shots():
+    try:
+        data = request_data()
+        if 'state_vectors' in data:
+            state_vectors = data['state_vectors']
+        elif data.get('state_vector'):
+            state_vectors = [data['state_vector']]
         else:
-            return jsonify({'success': False, 'error': 'Collapsed state is zero'}), 400
+            return jsonify({'success': False, 'error': 'No state vector provided'}), 400
 
-        probabilities = [abs(c)**2 for c in collapsed_state]
+        shots = int(data.get('shots', 1024))
+        if shots < 1:
+            return jsonify({'success': False, 'error': 'shots must be positive'}), 400
 
-        c1c4 = collapsed_state[0] * collapsed_state[3]
-        c2c3 = collapsed_state[1] * collapsed_state[2]
-        is_separable = abs(c1c4 - c2c3) < 1e-10
+        # a qubit index, 'both' (q1 then q0, so labels read like the |q1 q0> kets) or a sequence
+        measure_spec = data.get('measure', 'both')
+        if measure_spec == 'both':
+            qubits = [1, 0]
+        elif isinstance(measure_spec, list):
+            qubits = [int(q) for q in measure_spec]
+        else:
+            qubits = [int(measure_spec)]
+        if not qubits or any(q not in (0, 1) for q in qubits):
+            return jsonify({'success': False, 'error': 'measure must be 0, 1, both or a list of qubit indices'}), 400
 
-        result = {
-            'success': True,
-            'measurement_result': measurement_result,
-            'prob_0': prob_0,
-            'prob_1': prob_1,
-            'coefficients': [
-                {'re': float(c.real), 'im': float(c.imag)} for c in collapsed_state
-            ],
-            'probabilities': probabilities,
-            'is_separable': is_separable
-        }
+        states = states_from_json(state_vectors)
+        if np.any(norms(states) <= 1e-10):
+            return jsonify({'success': False, 'error': 'State vector is zero'}), 400
 
-        if is_separable:
-            separable_info = calculate_separable_state_info(collapsed_state)
-            result.update(separable_info)
+        # hand back the seed actually used so any run can be replayed
+        seed = data['seed'] if data.get('seed') is not None else int(np.random.SeedSequence().entropy % 2**63)
+        labels, probs, counts = sample_shots(states, qubits, shots, np.random.default_rng(seed))
+        if data.get('include_states', False):
+            collapsed = post_measurement_states(states, qubits, labels)
+
+        results = []
+        for b in range(len(states)):
+            result = {
+                'counts': dict(zip(labels, counts[b].tolist())),
+                'probabilities': dict(zip(labels, probs[b].tolist()))
+            }
+            if data.get('include_states', False):
+                reachable = [k for k in range(len(labels)) if probs[b, k] > 1e-10]
+                post_states = state_results(collapsed[b, reachable])
+                result['post_measurement_states'] = {labels[k]: post for k, post in zip(reachable, post_states)}
+            results.append(result)
+
+        response = {'success': True, 'seed': seed, 'shots': shots, 'qubits': qubits, 'labels': labels}
+        if 'state_vectors' in data:
+            response['results'] = results
         else:
-            result['q0current_relative_phase'] = 0.0
-            result['q1current_relative_phase'] = 0.0
-
-        return jsonify(result)
+            response.update(results[0])
+        return respond(response)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
@@ -447,54 +564,111 @@ def measure_qubit():
 @app.route('/apply_gate', methods=['POST'])
 def apply_gate():
     try:
-        data = request.json
+        data = request_data()
         state_vector_dict = data.get('state_vector')
         gate_matrix_dict = data.get('gate_matrix')
         if not state_vector_dict or not gate_matrix_dict:
             return jsonify({'success': False, 'error': 'Missing state_vector or gate_matrix'}), 400
 
-        state_vector = [complex(c['re'], c['im']) for c in state_vector_dict]
-        gate_matrix = []
-        for row in gate_matrix_dict:
-            gate_row = [complex(elem['re'], elem['im']) for elem in row]
-            gate_matrix.append(gate_row)
-        gate_matrix = np.array(gate_matrix, dtype=complex)
+        with metrics.stage('parse'):
+            states = states_from_json([state_vector_dict])
+            gates = gates_from_json([gate_matrix_dict])
+        with metrics.stage('apply'):
+            new_states = apply_gates(states, gates)
 
-        state_vector_array = np.array(state_vector)
-        new_state = gate_matrix @ state_vector_array
-        new_state_list = [complex(c) for c in new_state]
+        result = {'success': True}
+        with metrics.stage('state_analysis'):
+            result.update(state_results(new_states)[0])
 
-        probabilities = [abs(c)**2 for c in new_state_list]
+        profiling.trace('apply_gate', is_separable=result['is_separable'])
 
-        c1, c2, c3, c4 = new_state_list
-        c1c4 = c1 * c4
-        c2c3 = c2 * c3
-        is_separable = abs(c1c4 - c2c3) < 1e-10
+        with metrics.stage('serialize'):
+            return respond(result)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
 
-        print(is_separable)
-        print("LOOK ABOVE THIS")
 
-        result = {
-            'success': True,
-            'coefficients': [
-                {'re': float(c.real), 'im': float(c.imag)} for c in new_state_list
-            ],
-            'probabilities': probabilities,
-            'is_separable': is_separable
-        }
 
-        if is_separable:
-            separable_info = calculate_separable_state_info(new_state_list)
-            result.update(separable_info)
+@app.route('/apply_gate_batch', methods=['POST'])
+def apply_gate_batch():
+    try:
+        data = request_data()
+        state_vectors = data.get('state_vectors')
+        # one gate_matrix for the whole ensemble, or gate_matrices with one per state
+        if 'gate_matrices' in data:
+            gates = gates_from_json(data['gate_matrices'])
+        elif 'gate_matrix' in data:
+            gates = gates_from_json([data['gate_matrix']])[0]
         else:
-            result['q0current_relative_phase'] = 0.0
-            result['q1current_relative_phase'] = 0.0
-        
-        return jsonify(result)
+            gates = None
+        if not state_vectors or gates is None:
+            return jsonify({'success': False, 'error': 'Missing state_vectors or gate_matrix'}), 400
+
+        states = states_from_json(state_vectors)
+        if gates.ndim == 3 and len(gates) != len(states):
+            return jsonify({'success': False, 'error': 'gate_matrices and state_vectors differ in length'}), 400
+
+        results = state_results(apply_gates(states, gates))
+        return respond({'success': True, 'results': results})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
 
 
+@app.route('/startup_report', methods=['GET'])
+def startup_report():
+    return jsonify(startup.report())
+
+
+
+@app.route('/gate_library', methods=['GET'])
+def gate_library_index():
+    # names /decompose and friends accept as 'gate' in place of a matrix, and the bases each is ready for
+    import gate_library
+    library = gate_library.get()
+    if library is None:
+        return jsonify({'success': False, 'error': 'The gate library is disabled'}), 404
+    return jsonify({
+        'success': True,
+        'gates': library.names,
+        'modes': {mode: [name for name, entry in zip(library.names, entries) if entry is not None]
+                  for mode, entries in library.decompositions.items()}
+    })
+
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+
+@app.route('/profiles', methods=['GET'])
+def profiles_index():
+    if not profiling.allowed(request.remote_addr):
+        return jsonify({'success': False, 'error': 'Profiling is not enabled for this client'}), 403
+    return jsonify({'success': True, 'profiles': profiling.list_profiles()})
+
+
+
+@app.route('/profiles/<profile_id>', methods=['GET'])
+def profile_download(profile_id):
+    # the raw pstats file, or ?format=summary for the timings, traces and top functions as json
+    if not profiling.allowed(request.remote_addr):
+        return jsonify({'success': False, 'error': 'Profiling is not enabled for this client'}), 403
+    if request.args.get('format') == 'summary':
+        summary = profiling.summary(profile_id)
+        if summary is None:
+            return jsonify({'success': False, 'error': 'No such profile'}), 404
+        return jsonify({'success': True, **summary})
+    path = profiling.profile_path(profile_id)
+    if path is None:
+        return jsonify({'success': False, 'error': 'No such profile'}), 404
+    return send_file(path, mimetype='application/octet-stream', as_attachment=True, download_name=profile_id + '.prof')
+
+
+
+startup.mark_ready()
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5001)
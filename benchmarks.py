@@ -0,0 +1,271 @@
+import argparse
+import fnmatch
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+
+# local benchmark and regression suite, no network needed. every benchmark builds its workloads
+# up front from a seeded rng (Haar-random unitaries from scipy plus the fixed corpora below) and
+# times each call on its own, so the report has real p50/p99 latencies and not just a mean.
+#
+#   python benchmarks.py --list
+#   python benchmarks.py 'route:*' -n 50
+#   python benchmarks.py --save baseline.json
+#   python benchmarks.py --compare baseline.json --threshold 0.25
+#
+# --compare exits with status 1 when any benchmark's p50 is more than threshold slower than the
+# baseline. p99 and throughput are reported but not gated, they're too noisy on a laptop.
+# routes go through the flask test client, so with WORK_POOL_WORKERS > 0 the pool hop is
+# included, the same as in production
+
+# named two-qubit gates as the UI would type them, entries in the |q1 q0> basis
+NAMED_GATES = {
+    'identity': [["1", "0", "0", "0"], ["0", "1", "0", "0"], ["0", "0", "1", "0"], ["0", "0", "0", "1"]],
+    'cnot': [["1", "0", "0", "0"], ["0", "1", "0", "0"], ["0", "0", "0", "1"], ["0", "0", "1", "0"]],
+    'cz': [["1", "0", "0", "0"], ["0", "1", "0", "0"], ["0", "0", "1", "0"], ["0", "0", "0", "-1"]],
+    'swap': [["1", "0", "0", "0"], ["0", "0", "1", "0"], ["0", "1", "0", "0"], ["0", "0", "0", "1"]],
+    'iswap': [["1", "0", "0", "0"], ["0", "0", "i", "0"], ["0", "i", "0", "0"], ["0", "0", "0", "1"]],
+    'sqrt_iswap': [["1", "0", "0", "0"], ["0", "1/sqrt(2)", "i/sqrt(2)", "0"], ["0", "i/sqrt(2)", "1/sqrt(2)", "0"], ["0", "0", "0", "1"]],
+    'hadamard_q0': [["1/sqrt(2)", "1/sqrt(2)", "0", "0"], ["1/sqrt(2)", "-1/sqrt(2)", "0", "0"],
+                    ["0", "0", "1/sqrt(2)", "1/sqrt(2)"], ["0", "0", "1/sqrt(2)", "-1/sqrt(2)"]],
+    'controlled_phase': [["1", "0", "0", "0"], ["0", "1", "0", "0"], ["0", "0", "1", "0"], ["0", "0", "0", "e^(i*pi/4)"]],
+}
+
+# inputs that have tripped the parser up before: implicit multiplication, e and i next to digits,
+# right-associative powers, float noise that should snap to zero, and ones only sympy can do
+TRICKY_EXPRESSIONS = [
+    "1/sqrt(2)", "-1/sqrt(2)", "e^(i*pi/4)", "2i", "ipi", "3 pi/4", "cos(pi/2)", "2^3^2", "-2^2",
+    "(1+i)/2", "exp(-i*pi/8)*cos(pi/8)", "sqrt(-1)", "1e-3 + 2.5e2i", "sin(pi/7)^2 + cos(pi/7)^2",
+    "ln(e)", "tanh(1)+i*sinh(1)", "acos(1/2)", "Abs(3+4*I)"
+]
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    # setup(rng, count) returns count zero-argument callables, one per timed call
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def haar_unitaries(rng, count):
+    from scipy.stats import unitary_group
+
+    return [unitary_group.rvs(4, random_state=rng) for _ in range(count)]
+
+
+def corpus_unitaries(rng, count):
+    # the named gates first, Haar-random ones after
+    from pipeline import parse_matrix
+
+    named = [parse_matrix(m) for m in NAMED_GATES.values()]
+    return (named + haar_unitaries(rng, max(count - len(named), 0)))[:count]
+
+
+def random_states(rng, count):
+    states = rng.normal(size=(count, 4)) + 1j * rng.normal(size=(count, 4))
+    return states / np.linalg.norm(states, axis=1, keepdims=True)
+
+
+def matrix_json(U):
+    return [[{'re': float(e.real), 'im': float(e.imag)} for e in row] for row in U]
+
+
+def state_json(state):
+    return [{'re': float(c.real), 'im': float(c.imag)} for c in state]
+
+
+@benchmark('decompose_gate')
+def bench_decompose_gate(rng, count):
+    from decomposition import decompose_gate
+
+    return [lambda U=U: decompose_gate(U, "iSwap") for U in corpus_unitaries(rng, count)]
+
+
+@benchmark('instruction_set')
+def bench_instruction_set(rng, count):
+    from decomposition import decompose_gate, InstructionSet
+    from pipeline import rparams_from_request
+
+    decomposed = [decompose_gate(U, "iSwap") for U in corpus_unitaries(rng, count)]
+    return [lambda RM=RM, tags=tags: InstructionSet(RM, tags, "iSwap", rparams_from_request({}))
+            for RM, tags, qcircuit in decomposed]
+
+
+@benchmark('library_gate')
+def bench_library_gate(rng, count):
+    # a named gate from matrix to instructions, answered by the gate library rather than the LRU
+    from decomposition import decompose_gate_cached, InstructionSet, decomposition_cache
+    from gate_library import get
+    from pipeline import rparams_from_request
+
+    library = get()
+
+    def decompose(U):
+        decomposition_cache.clear()
+        RM, tags, qcircuit = decompose_gate_cached(U, "iSwap")
+        return InstructionSet(RM, tags, "iSwap", rparams_from_request({}), qcircuit)
+
+    return [lambda U=library.unitaries[k]: decompose(U) for k in rng.integers(len(library.names), size=count)]
+
+
+@benchmark('expressions')
+def bench_expressions(rng, count):
+    # cold cache every call, this is the parse path and not the LRU
+    from expressions import evaluate_expression, expression_cache
+
+    def evaluate(expr):
+        expression_cache.clear()
+        return evaluate_expression(expr)
+
+    return [lambda expr=TRICKY_EXPRESSIONS[k % len(TRICKY_EXPRESSIONS)]: evaluate(expr) for k in range(count)]
+
+
+@benchmark('state_results')
+def bench_state_results(rng, count):
+    # the per-state analysis behind every state route, 64 states a call
+    from state_engine import state_results
+
+    return [lambda states=random_states(rng, 64): state_results(states) for _ in range(count)]
+
+
+def _parametric_handle(client):
+    response = client.post('/compile_parametric', json={'matrix': [
+        ["cos(theta/2)", "-i*sin(theta/2)", "0", "0"], ["-i*sin(theta/2)", "cos(theta/2)", "0", "0"],
+        ["0", "0", "cos(theta/2)", "-i*sin(theta/2)"], ["0", "0", "-i*sin(theta/2)", "cos(theta/2)"]]})
+    return response.get_json()['handle']
+
+
+# method and payload(rng, context) per route. context holds what has to be set up once per run
+ROUTES = {
+    '/evaluate_complex': ('POST', lambda rng, ctx: {'expression': TRICKY_EXPRESSIONS[rng.integers(len(TRICKY_EXPRESSIONS))]}),
+    '/decompose': ('POST', lambda rng, ctx: {'matrix': matrix_json(haar_unitaries(rng, 1)[0]), 'execute': True}),
+    '/decompose_batch': ('POST', lambda rng, ctx: {'items': [{'matrix': matrix_json(U)} for U in haar_unitaries(rng, 8)]}),
+    '/decompose_state': ('POST', lambda rng, ctx: {'expressions': [TRICKY_EXPRESSIONS[k] for k in rng.integers(len(TRICKY_EXPRESSIONS) - 2, size=4)]}),
+    '/simulate_noise': ('POST', lambda rng, ctx: {'matrix': matrix_json(haar_unitaries(rng, 1)[0]), 'trajectories': 200, 'seed': int(rng.integers(2**32))}),
+    '/sweep_schedule': ('POST', lambda rng, ctx: {'matrix': matrix_json(haar_unitaries(rng, 1)[0]), 'rabi_frequency': np.linspace(5e6, 50e6, 100).tolist(),
+                                                  'q0drive_freq': np.linspace(5.2e9, 5.4e9, 100).tolist()}),
+    '/compile_parametric': ('POST', lambda rng, ctx: {'matrix': [[f"exp(i*theta*{rng.integers(1, 9)})", "0", "0", "0"], ["0", "1", "0", "0"], ["0", "0", "1", "0"], ["0", "0", "0", "1"]]}),
+    '/evaluate_parametric': ('POST', lambda rng, ctx: {'handle': ctx['handle'], 'values': {'theta': rng.uniform(0, np.pi, 64).tolist()}}),
+    '/apply_gate': ('POST', lambda rng, ctx: {'state_vector': state_json(random_states(rng, 1)[0]), 'gate_matrix': matrix_json(haar_unitaries(rng, 1)[0])}),
+    '/apply_gate_batch': ('POST', lambda rng, ctx: {'state_vectors': [state_json(s) for s in random_states(rng, 256)], 'gate_matrix': matrix_json(haar_unitaries(rng, 1)[0])}),
+    '/measure_qubit': ('POST', lambda rng, ctx: {'state_vector': state_json(random_states(rng, 1)[0]), 'qubit_index': int(rng.integers(2))}),
+    '/measure_qubit_batch': ('POST', lambda rng, ctx: {'state_vectors': [state_json(s) for s in random_states(rng, 256)], 'qubit_index': int(rng.integers(2))}),
+    '/measure_shots': ('POST', lambda rng, ctx: {'state_vector': state_json(random_states(rng, 1)[0]), 'shots': 4096, 'seed': int(rng.integers(2**32))}),
+    '/gate_library': ('GET', None),
+    '/cache_stats': ('GET', None),
+    '/startup_report': ('GET', None),
+    '/metrics': ('GET', None),
+}
+
+
+def _route_setup(path, method, payload):
+    def setup(rng, count):
+        from app import app
+
+        client = app.test_client()
+        context = {'handle': _parametric_handle(client)} if path == '/evaluate_parametric' else {}
+
+        def call(body):
+            response = client.get(path) if method == 'GET' else client.post(path, json=body)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{path} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+
+        return [lambda body=payload(rng, context) if payload else None: call(body) for _ in range(count)]
+    return setup
+
+
+for _path, (_method, _payload) in ROUTES.items():
+    benchmark('route:' + _path)(_route_setup(_path, _method, _payload))
+
+
+def run_benchmark(name, iterations, warmup, seed):
+    rng = np.random.default_rng(seed)
+    calls = BENCHMARKS[name](rng, iterations + warmup)
+    for call in calls[:warmup]:
+        call()
+    latencies = np.empty(iterations)
+    for k, call in enumerate(calls[warmup:]):
+        start = time.perf_counter()
+        call()
+        latencies[k] = time.perf_counter() - start
+    return {
+        'iterations': iterations,
+        'throughput': float(iterations / latencies.sum()),
+        'p50_ms': float(np.percentile(latencies, 50) * 1e3),
+        'p99_ms': float(np.percentile(latencies, 99) * 1e3)
+    }
+
+
+def compare(results, baseline, threshold):
+    # (name, ratio) of every benchmark whose p50 regressed past the threshold
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        ratio = result['p50_ms'] / before['p50_ms']
+        result['p50_vs_baseline'] = ratio
+        if ratio > 1 + threshold:
+            regressions.append((name, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the workbench and check for regressions")
+    parser.add_argument('patterns', nargs='*', default=['*'], help="benchmark names or globs (default: all)")
+    parser.add_argument('-n', '--iterations', type=int, default=30, help="timed calls per benchmark")
+    parser.add_argument('--warmup', type=int, default=3, help="untimed calls first")
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--save', help="write the results as a JSON baseline")
+    parser.add_argument('--compare', help="baseline JSON to check against")
+    parser.add_argument('--threshold', type=float, default=0.25, help="allowed p50 slowdown, 0.25 = 25%%")
+    parser.add_argument('--list', action='store_true', help="list the benchmarks and exit")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        print('\n'.join(BENCHMARKS))
+        return 0
+    names = [name for name in BENCHMARKS if any(fnmatch.fnmatchcase(name, p) for p in args.patterns)]
+    if not names:
+        parser.error(f"no benchmark matches {args.patterns}")
+
+    results = {}
+    print(f"{'benchmark':32} {'ops/s':>10} {'p50 ms':>10} {'p99 ms':>10}")
+    for name in names:
+        results[name] = run_benchmark(name, args.iterations, args.warmup, args.seed)
+        r = results[name]
+        print(f"{name:32} {r['throughput']:10.1f} {r['p50_ms']:10.3f} {r['p99_ms']:10.3f}", flush=True)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f)['results'], args.threshold)
+        for name, ratio in regressions:
+            print(f"REGRESSION {name}: p50 is {ratio:.2f}x the baseline (threshold {1 + args.threshold:.2f}x)")
+        if not regressions:
+            print(f"no p50 regressions beyond {args.threshold:.0%} against {args.compare}")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'meta': {
+                    'python': platform.python_version(),
+                    'numpy': np.__version__,
+                    'machine': platform.machine(),
+                    'iterations': args.iterations,
+                    'seed': args.seed
+                },
+                'results': results
+            }, f, indent=2)
+        print(f"saved {len(results)} results to {args.save}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,80 @@
+import os
+import tempfile
+
+# in-process cache sizes
+EXPRESSION_CACHE_SIZE = int(os.environ.get('EXPRESSION_CACHE_SIZE', 1024))
+PARAMETRIC_CACHE_SIZE = int(os.environ.get('PARAMETRIC_CACHE_SIZE', 256))
+DECOMPOSITION_CACHE_SIZE = int(os.environ.get('DECOMPOSITION_CACHE_SIZE', 512))
+
+# seconds, 0 disables expiry
+DECOMPOSITION_CACHE_TTL = float(os.environ.get('DECOMPOSITION_CACHE_TTL', 3600)) or None
+# unitaries are rounded to this many decimals (after removing global phase) before hashing
+DECOMPOSITION_CACHE_DECIMALS = int(os.environ.get('DECOMPOSITION_CACHE_DECIMALS', 8))
+
+# named-gate library written by `python gate_library.py build` and loaded at startup, inputs that
+# match one of its gates skip synthesis. without the file (or with one built for another
+# DECOMPOSITION_ENGINE) it's built in memory for the native bases, about 150 ms per process.
+# empty turns the library off
+GATE_LIBRARY_PATH = os.environ.get('GATE_LIBRARY_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gate_library.npz'))
+# how close (Frobenius norm, global phase removed) an input has to be to count as a library gate
+GATE_LIBRARY_ATOL = float(os.environ.get('GATE_LIBRARY_ATOL', 1e-6))
+
+# two-qubit synthesis: 'native' runs the iSwap basis through the numpy KAK engine in kak.py,
+# 'qiskit' always uses qiskit's TwoQubitBasisDecomposer, 'check' runs native and cross-checks
+# every result against qiskit (slow, for validating the engine)
+DECOMPOSITION_ENGINE = os.environ.get('DECOMPOSITION_ENGINE', 'native')
+if DECOMPOSITION_ENGINE not in ('native', 'qiskit', 'check'):
+    raise ValueError(f"Unknown DECOMPOSITION_ENGINE: {DECOMPOSITION_ENGINE}")
+
+# 'all' serves every route. 'state' workers only serve the state routes (/apply_gate,
+# /measure_qubit, ...), never warm decomposers and so never import qiskit
+WORKER_ROLE = os.environ.get('WORKER_ROLE', 'all')
+
+# two-qubit bases whose decomposers are built and warmed at startup, empty to skip
+PRELOAD_BASES = [b.strip() for b in os.environ.get('PRELOAD_BASES', 'iSwap').split(',') if b.strip()]
+# other heavy modules imported at startup rather than by the first request that needs them
+PRELOAD_MODULES = [m.strip() for m in os.environ.get('PRELOAD_MODULES', 'sympy').split(',') if m.strip()]
+if WORKER_ROLE == 'state':
+    PRELOAD_BASES = []
+    PRELOAD_MODULES = []
+
+# requests slower than this many seconds are logged with their stage breakdown, 0 disables
+SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', 0)) or None
+
+# worker pool for the CPU-heavy stages of a request (sympy, /decompose, parametric decompositions),
+# 0 runs them inline in the request thread with no budget
+WORK_POOL_WORKERS = int(os.environ.get('WORK_POOL_WORKERS', 2))
+# requests allowed to wait for a busy pool before new ones get a 429
+WORK_QUEUE_SIZE = int(os.environ.get('WORK_QUEUE_SIZE', 16))
+# seconds a request waits for a free worker before giving up with a 503
+WORK_QUEUE_TIMEOUT = float(os.environ.get('WORK_QUEUE_TIMEOUT', 10))
+# seconds of pool work a request may use before it's killed (503). clients can ask for less
+# with an X-Request-Budget header
+REQUEST_BUDGET_SECONDS = float(os.environ.get('REQUEST_BUDGET_SECONDS', 30))
+
+# per-request profiling (profiling.py): client addresses or networks allowed to ask for a profile
+# with X-Profile / ?profile=1 and to read /profiles, '*' for anyone. empty turns profiling off
+PROFILE_ALLOWLIST = [a.strip() for a in os.environ.get('PROFILE_ALLOWLIST', '').split(',') if a.strip()]
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'workbench-profiles'))
+# profiles kept on disk, the oldest are deleted past this
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 50))
+# level of the workbench.* loggers, DEBUG shows the trace events (matrices, circuits, ...)
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'WARNING').upper()
+
+# upper limit on the grid points of one /sweep_schedule request. a grid over both pulse rates
+# returns the per-step timings at every point, ~20 numbers a point, so keep it serializable
+SWEEP_MAX_POINTS = int(os.environ.get('SWEEP_MAX_POINTS', 100000))
+
+# upper limit on the points one /evaluate_parametric request can broadcast its values to. each
+# point is a 4x4 unitary evaluated in the web process, 32 numbers in the response
+PARAMETRIC_MAX_POINTS = int(os.environ.get('PARAMETRIC_MAX_POINTS', 10000))
+
+# upper limit on the trajectories one /simulate_noise request can ask for
+NOISE_MAX_TRAJECTORIES = int(os.environ.get('NOISE_MAX_TRAJECTORIES', 100000))
+
+# upper limit on trajectory_samples, the pulse-level samples taken per instruction
+PULSE_MAX_SAMPLES = int(os.environ.get('PULSE_MAX_SAMPLES', 1000))
+
+# /decompose_batch process pool, 0 sizes it to the machine
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', 0)) or os.cpu_count()
+BATCH_CHUNK_SIZE = int(os.environ.get('BATCH_CHUNK_SIZE', 8))
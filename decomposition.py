@@ -1,26 +1,165 @@
 from typing import Any
+import hashlib
+import threading
 import numpy as np
-from scipy.stats import unitary_group
-from qiskit.synthesis import TwoQubitBasisDecomposer
-from qiskit.circuit.library import iSwapGate, CZGate
-from qiskit.quantum_info import Operator
-import numpy as np
-from scipy.stats import unitary_group
-
-from qiskit.synthesis import OneQubitEulerDecomposer
-
-def decompose_gate(U,mode): 
-    iSwap = iSwapGate()
-    CZ = CZGate()
-
-    decomposer = TwoQubitBasisDecomposer(iSwap)
-    if mode=="CZ":
-        relevant = CZ
-    elif mode=="iSwap":
-        relevant = iSwap
-    decomposer = TwoQubitBasisDecomposer(relevant)
-    circuit = decomposer(Operator(U))
-    print(circuit.draw())
+
+import config
+import gate_library
+import kak
+import metrics
+import profiling
+import statevector
+import zyz
+from cache import LRUCache
+
+# per-process decomposer instances, built once and shared by every request. qiskit is only
+# imported once one of its decomposers is needed
+BASIS_GATES = ("iSwap", "CZ")
+# bases kak.py synthesizes natively, the others always go through qiskit
+NATIVE_BASES = ("iSwap",)
+_decomposers = {}
+_decomposers_lock = threading.Lock()
+
+# SWAP needs all three entangling gates, so warming on it touches the whole synthesis path
+WARMUP_UNITARY = np.array([[1, 0, 0, 0], [0, 0, 1, 0], [0, 1, 0, 0], [0, 0, 0, 1]], dtype=complex)
+
+def _get_decomposer(key, build):
+    decomposer = _decomposers.get(key)
+    if decomposer is None:
+        with _decomposers_lock:
+            decomposer = _decomposers.get(key)
+            if decomposer is None:
+                decomposer = build()
+                _decomposers[key] = decomposer
+    return decomposer
+
+def _basis_gate(mode):
+    from qiskit.circuit.library import iSwapGate, CZGate
+    return {"iSwap": iSwapGate, "CZ": CZGate}[mode]()
+
+def get_two_qubit_decomposer(mode, **options):
+    if mode not in BASIS_GATES:
+        raise ValueError(f"Unknown decomposition mode: {mode}")
+    from qiskit.synthesis import TwoQubitBasisDecomposer
+    key = ("two_qubit", mode, tuple(sorted(options.items())))
+    return _get_decomposer(key, lambda: TwoQubitBasisDecomposer(_basis_gate(mode), **options))
+
+def uses_native_engine(mode):
+    return config.DECOMPOSITION_ENGINE != 'qiskit' and mode in NATIVE_BASES
+
+def warm_decomposers(modes):
+    # run one dummy decomposition per basis so the first real request doesn't pay for setup
+    for mode in modes:
+        RM, tags, circuit = decompose_gate(WARMUP_UNITARY, mode)
+        gate_steps(RM, tags)
+
+# decompose_gate results keyed on the canonical form of the unitary, so repeats skip synthesis
+decomposition_cache = LRUCache(config.DECOMPOSITION_CACHE_SIZE, ttl=config.DECOMPOSITION_CACHE_TTL)
+
+def canonical_unitary(U, decimals=config.DECOMPOSITION_CACHE_DECIMALS):
+    U = np.asarray(U, dtype=complex)
+    flat = U.ravel()
+    # strip global phase by making the first large entry real positive (a 4x4 unitary always has one >= 0.5)
+    magnitudes = np.abs(flat)
+    pivot = flat[np.argmax(magnitudes >= 0.5 * magnitudes.max())]
+    canonical = U * (abs(pivot) / pivot)
+    # + 0.0 folds -0.0 into 0.0 so they hash the same
+    return np.round(canonical, decimals) + 0.0
+
+def unitary_key(U, mode, approximation=None):
+    canonical = canonical_unitary(U)
+    digest = hashlib.sha1(np.ascontiguousarray(canonical).tobytes()).hexdigest()
+    if approximation is None:
+        return f"{mode}:{digest}"
+    return f"{mode}:{approximation[0]}:{approximation[1]}:{digest}"
+
+def decompose_gate_cached(U, mode, approximation=None):
+    # the cached result is the decomposition of the first unitary seen with this key, which
+    # matches U up to global phase and rounding. InstructionSet only needs the local gates.
+    # library gates don't go through the cache at all
+    if approximation is None:
+        known = gate_library.lookup(U, mode)
+        if known is not None:
+            return known
+    return decomposition_cache.get_or_compute(unitary_key(U, mode, approximation), lambda: decompose_gate(U, mode, approximation))
+
+def decompose_gates_cached(Us, mode, approximation=None):
+    # batch version of decompose_gate_cached, the misses are synthesized in one vectorized call
+    keys = [unitary_key(U, mode, approximation) for U in Us]
+    missing = object()
+    results = [gate_library.lookup(U, mode) if approximation is None else None for U in Us]
+    results = [decomposition_cache.get(key, missing) if result is None else result for key, result in zip(keys, results)]
+    todo = [i for i, result in enumerate(results) if result is missing]
+    if todo:
+        if uses_native_engine(mode):
+            computed = decompose_gates([Us[i] for i in todo], mode, approximation)
+        else:
+            computed = [decompose_gate(Us[i], mode, approximation) for i in todo]
+        for i, result in zip(todo, computed):
+            decomposition_cache.put(keys[i], result)
+            results[i] = result
+    return results
+
+class DecompositionError(RuntimeError):
+    # a synthesized circuit that doesn't do what it was built to do
+    pass
+
+def synthesis_fidelities(Us, synthesized):
+    # (N,) average gate fidelities of synthesized circuits to the unitaries they were built for
+    Us = np.asarray(Us, dtype=complex).reshape(-1, 4, 4)
+    synthesized = np.asarray(synthesized, dtype=complex).reshape(-1, 4, 4)
+    return kak.trace_fidelity(np.einsum('nij,nij->n', Us.conj(), synthesized))
+
+def check_fidelities(Us, synthesized, required=1.0):
+    # exact synthesis has to be exact up to rounding, approximate synthesis as good as it promised.
+    # required is one value or one per unitary
+    fidelities = synthesis_fidelities(Us, synthesized)
+    short = np.flatnonzero(fidelities < np.asarray(required) - 1e-9)
+    if len(short):
+        n = short[0]
+        raise DecompositionError(f"Decomposition is incorrect: fidelity {fidelities[n]} < {np.broadcast_to(required, fidelities.shape)[n]}")
+
+def decompose_gate(U,mode, approximation=None):
+    # approximation is None for exact synthesis, or (basis_fidelity, target_fidelity) with either
+    # one None, see kak.choose_basis_counts
+    if mode not in BASIS_GATES:
+        raise ValueError(f"Unknown decomposition mode: {mode}")
+    if np.shape(U) != (4, 4):
+        raise ValueError("Matrix must be 4x4")
+    if uses_native_engine(mode):
+        return decompose_gates([U], mode, approximation)[0]
+    if approximation is not None:
+        raise ValueError("Approximate synthesis needs the native iSwap engine")
+    return decompose_gate_qiskit(U, mode)
+
+def decompose_gates(Us, mode, approximation=None):
+    # native KAK synthesis, (RM, tags, synthesis) per unitary in the same format as the qiskit path
+    Us = np.asarray(Us, dtype=complex)
+    # reshaping alone would take a 2x8 matrix as a 4x4 one
+    if Us.ndim < 2 or Us.shape[-2:] != (4, 4):
+        raise ValueError("Matrix must be 4x4")
+    Us = Us.reshape(-1, 4, 4)
+    with metrics.stage('kak_synthesis'):
+        results = kak.synthesize(Us, basis_fidelity=approximation[0], target_fidelity=approximation[1]) if approximation else kak.synthesize(Us)
+    # every circuit is rebuilt and checked against its unitary, approximate ones against the
+    # fidelity they were promised
+    with metrics.stage('fidelity_check'):
+        check_fidelities(Us, kak.circuit_unitaries(results), [result.fidelity for result in results])
+    if config.DECOMPOSITION_ENGINE == 'check' and approximation is None:
+        with metrics.stage('cross_check'):
+            problems = kak.cross_check(Us, results)
+        if problems:
+            raise DecompositionError("Decomposition disagrees with qiskit: " + "; ".join(problems))
+    return [(result.matrices, result.tags, result) for result in results]
+
+def decompose_gate_qiskit(U,mode):
+    from qiskit.quantum_info import Operator
+
+    decomposer = get_two_qubit_decomposer(mode)
+    with metrics.stage('qiskit_synthesis'):
+        circuit = decomposer(Operator(U))
+    if profiling.tracing():
+        profiling.trace('qiskit_circuit', circuit=circuit.draw())
     
 
     relevant_matrices = []
@@ -34,12 +173,9 @@ def decompose_gate(U,mode):
         tag = None
         if gate_matrix.shape == (2,2):
             qubit_idx = qubit_indices[0]
-            if qubit_idx == 0:
-                tag = 0
-                Ug= np.kron(np.eye(2), gate_matrix)
-            elif qubit_idx == 1:
-                tag = 1
-                Ug = np.kron(gate_matrix, np.eye(2))
+            if qubit_idx in (0, 1):
+                tag = qubit_idx
+                Ug = statevector.embed(gate_matrix, [qubit_idx], 2)
             else:
                 assert False, f"Invalid qubit index: {qubit_idx}"
         else:
@@ -61,7 +197,7 @@ def decompose_gate(U,mode):
     # FIX 4: Apply global phase
     start = np.exp(1j * circuit.global_phase) * start
 
-    assert np.allclose(start, U), "Decomposition is incorrect"
+    check_fidelities(U, start)
 
     return relevant_matrices,tags,circuit
 
@@ -78,148 +214,153 @@ class physical_instruction:
     instruction_string: str
     details: str
     angle: float = None
+    # seconds the instruction takes on hardware, virtual Z rotations take none
+    duration: float = 0.0
     
 
 
-from qiskit.synthesis import OneQubitEulerDecomposer
-from qiskit.circuit.library import iSwapGate, CZGate
-
 def round3(x):
     return np.round(x,3)
-def InstructionSet(RM,tags, mode, rparams):
+def gate_steps(RM, tags):
+    # the (code, tag, angle) sequence a decomposition turns into, independent of the drive parameters.
+    # every single-qubit gate goes through the ZYZ engine in one batch
+    single = [i for i in range(len(RM)) if tags[i] != 2]
+    if single:
+        lam, theta, phi, _, on = zyz.zyz_angles(np.array([RM[i] for i in single]))
+    steps = []
+    for i in range(len(RM)):
+        if tags[i] == 2:
+            steps.append(("ENTANGLE", 2, None))
+            continue
+        j = single.index(i)
+        #rotations qiskit would simplify away are skipped, so a gate can be just Z, just Y, ZY, YZ or nothing
+        for on_j, code, angle in zip(on[j], ("RZ", "RY", "RZ"), (lam[j], theta[j], phi[j])):
+            if on_j:
+                steps.append((code, tags[i], float(angle)))
+    return steps
+
+def schedule_arrays(steps, rabi_frequency, q0drive_freq, q1drive_freq, q0current_relative_phase, q1current_relative_phase, coupling_strength):
+    # InstructionSet's timing and phase bookkeeping for one gate_steps() sequence, with every
+    # parameter an array broadcast over a grid. per-step arrays are (grid..., N), 0 where a step
+    # has no drive. iSwap basis only. nothing is broadcast further than its own parameters: with
+    # open-grid inputs (np.meshgrid(..., sparse=True)) every array has length 1 on the axes it
+    # doesn't depend on, so drive frequencies don't get repeated over a rabi sweep
+    tags = np.array([tag for code, tag, angle in steps], dtype=int)
+    angles = np.array([angle if angle is not None else 0.0 for code, tag, angle in steps])
+    drive = np.array([code == "RY" for code, tag, angle in steps], dtype=bool)
+    entangle = np.array([code == "ENTANGLE" for code, tag, angle in steps], dtype=bool)
+    virtual = np.array([code == "RZ" for code, tag, angle in steps], dtype=bool)
+    shape = np.broadcast(rabi_frequency, q0drive_freq, q1drive_freq, q0current_relative_phase, q1current_relative_phase, coupling_strength).shape
+
+    def per_step(value):
+        return np.asarray(value, dtype=float)[..., None]
+
+    def on_grid(array, trailing):
+        # leading length-1 axes up to the grid's dimensions plus the trailing ones
+        return array.reshape((1,) * (len(shape) + trailing - array.ndim) + array.shape)
+
+    pulse_times = on_grid(np.where(drive, np.abs(angles) / per_step(rabi_frequency), 0.0)
+                          + np.where(entangle, np.pi / (4 * per_step(coupling_strength)), 0.0), 1)
+
+    # each qubit's frame phase going into every step: its starting phase plus the virtual Z angles so far
+    frames = []
+    final_relative_phases = []
+    for q, start in ((0, q0current_relative_phase), (1, q1current_relative_phase)):
+        rotations = np.where(virtual & (tags == q), angles, 0.0)
+        frames.append(per_step(start) + np.cumsum(rotations) - rotations)
+        final_relative_phases.append(np.asarray(start, dtype=float) + rotations.sum())
+    drive_phases = np.where(drive, np.pi / 2 + np.where(tags == 0, frames[0], frames[1]), 0.0)
+    drive_frequencies = np.where(drive, np.where(tags == 0, per_step(q0drive_freq), per_step(q1drive_freq)), 0.0)
+    return {
+        'pulse_times': pulse_times,
+        'start_times': np.cumsum(pulse_times, axis=-1) - pulse_times,
+        'drive_frequencies': on_grid(drive_frequencies, 1),
+        'drive_phases': on_grid(drive_phases, 1),
+        'total_duration': pulse_times.sum(axis=-1),
+        'final_relative_phases': on_grid(np.stack(np.broadcast_arrays(*final_relative_phases), axis=-1), 1)
+    }
+
+def decomposition_steps(RM, tags, qcircuit=None):
+    # gate_steps, or the ones stored with a library gate
+    if isinstance(qcircuit, gate_library.library_gate):
+        return qcircuit.steps
+    return gate_steps(RM, tags)
+
+def InstructionSet(RM,tags, mode, rparams, qcircuit=None):
+    # qcircuit is the third thing decompose_gate_cached returns, for library gates it saves the ZYZ pass
+    return instructions_from_steps(decomposition_steps(RM, tags, qcircuit), mode, rparams)
+
+def instructions_from_steps(steps, mode, rparams):
+    # the physical instructions for a (code, tag, angle) sequence, rparams' phases are advanced
+    # by the virtual Z rotations as they go
 
-    decomposer_zyz = OneQubitEulerDecomposer(basis='ZYZ')
     InstructionSet = []
     
-    for i in range(len(RM)):
+    for code, tag, angle in steps:
 
-        if tags[i] == 2:
+        if code == "ENTANGLE":
             if mode=="iSwap":
                 code = "ISWAP"
                 title = "iSwap Gate"
-                underlying_gate = iSwapGate()
+                underlying_gate = kak.ISWAP
                 instruction_string = f"Tune Qubit 1 to the frequency of Qubit 0 for pi/(4g) seconds, constant g. "
                 details = f"This is a physical operation that realizes the iSwap gate. Apply a DC flux pulse over the transmon's SQUID loop to modify the flux through the loop and change the qubits drive frequency. By placing the two qubits in resonance, the natural entangling interaction between the two qubits is activated and realizes the iSwap gate over time. The time is given by pi/(4g), where g is the coupling strength between the two qubits. g is computed directly from the interaction Hamiltonian of the system based on the capacitance of each qubit and the coupling capacitance."
                 #param format: [time, time_label]
                
-                InstructionSet.append(physical_instruction(code,title,tags[i], underlying_gate, instruction_string, details,angle=None))
+                duration = np.pi/(4*rparams.coupling_strength)
+                InstructionSet.append(physical_instruction(code,title,tag, underlying_gate, instruction_string, details,angle=None,duration=duration))
                
             elif mode=="CZ":
                 assert False, "CZ gate is not implemented yet."
-            
+
+        elif code == "RZ":
+            #virtual Z rotation, tracked in the qubit's relative phase
+            instruction,angle = genZInstruction(angle,rparams,tag)
+            if tag == 0:
+                rparams.q0current_relative_phase += angle
+            else:
+                rparams.q1current_relative_phase += angle
+            InstructionSet.append(instruction)
+
         else:
-           
-            ZYZ = decomposer_zyz(RM[i])
-            #sometimes ZYZ is in format YZ or ZY or just Z or just Y . we must check for this
-            one_on = True
-            two_on = True
-            three_on = True
-            if(len(ZYZ.data) == 0):
-                one_on = False
-                two_on = False
-                three_on = False
-            if(len(ZYZ.data) == 1):
-                if(ZYZ.data[0].operation.name == "rz"):
-                    #gate is just a virtual Z rotation
-                    one_on = True
-                    two_on = False
-                    three_on = False
-                else:
-                    one_on = False
-                    two_on = True
-                    three_on = False
-            if(len(ZYZ.data) == 2):
-                if(ZYZ.data[0].operation.name == "rz"):
-                    one_on = True
-                    two_on = True
-                    three_on = False
-                else:
-                    one_on = False
-                    two_on = True
-                    three_on = True
-
-            if tags[i] == 0:
-                count = 0 
-                #gate 1 (virtual Z rotation)
-                if(one_on):
-                    instruction,angle1 = genZInstruction(ZYZ.data[count],rparams,0)
-                    rparams.q0current_relative_phase += angle1
-                    InstructionSet.append(instruction)
-                    count += 1
-                #gate 2 (Y gate)
-                if(two_on):
-                    instruction2 = genYInstruction(ZYZ.data[count],rparams,0)
-                    InstructionSet.append(instruction2)
-                    count += 1
-                #gate 3 (virtual Z rotation)
-                if(three_on):
-                    instruction3,angle3= genZInstruction(ZYZ.data[count],rparams,0)
-                    rparams.q0current_relative_phase += angle3
-                    InstructionSet.append(instruction3)
-                    count += 1
-
-            elif tags[i] == 1:
-                #gate 1 (virtual Z rotation)
-                count = 0 
-                if(one_on):
-                    instruction,angle3 = genZInstruction(ZYZ.data[count],rparams,1)
-                    rparams.q1current_relative_phase += angle3
-                    InstructionSet.append(instruction)
-                    count += 1
-                #gate 2 (Y gate)
-                if(two_on):
-                    instruction2 = genYInstruction(ZYZ.data[count],rparams,1)
-                    InstructionSet.append(instruction2)
-                    count += 1
-                #gate 3 (virtual Z rotation)
-                if(three_on):
-                    instruction3,angle3 = genZInstruction(ZYZ.data[count],rparams,1)
-                    rparams.q1current_relative_phase += angle3
-                    InstructionSet.append(instruction3)
-                    count += 1
+            #Y gate
+            InstructionSet.append(genYInstruction(angle,rparams,tag))
      
     return InstructionSet,rparams
 
-def genZInstruction(circuitinstruction,rparams,tag):
-    g = circuitinstruction.operation
-    angle = g.params[0]
-    gatem = Operator(g).data
+def genZInstruction(angle,rparams,tag):
+    gatem = zyz.rz_matrix(angle)
     code = "RZ"
     title = f"Z-axis rotation of ~{round3(angle)} radians on Qubit {tag}"
-    if tag == 0:
-        underlying_gate = np.kron(np.eye(2), gatem)
-    elif tag == 1:
-        underlying_gate = np.kron(gatem, np.eye(2))
+    if tag in (0, 1):
+        underlying_gate = statevector.embed(gatem, [tag], 2)
     else:
         assert False, f"Invalid qubit index: {tag}"
     instruction_string = f"Virtual (bookkeeping) Z-axis phase rotation"
     details = f"Phase rotations do not need to be applied physically. By shifting the phase our computational basis, we can effectively apply a Z rotation on Qubit 0 in 0 time. All future applied radiation will be prepared with a phase shift that matches how much we virtually rotated around the Z-axis."
     return physical_instruction(code,title,tag, underlying_gate, instruction_string, details,angle),angle
-def genYInstruction(circuitinstruction,rparams,tag):
-    g = circuitinstruction.operation
+def genYInstruction(angle,rparams,tag):
     
-    gatem = Operator(g).data
+    gatem = zyz.ry_matrix(angle)
     code = "RY"
-    angle = g.params[0]
     title = f"Y-axis rotation of ~{round3(angle)} radians on Qubit {tag}"
  
     if tag == 0:
         qdrive_freq = rparams.q0drive_freq
-        underlying_gate = np.kron(np.eye(2), gatem)
         usephase = rparams.q0current_relative_phase
     elif tag == 1:
         qdrive_freq = rparams.q1drive_freq
-        underlying_gate = np.kron(gatem, np.eye(2))
         usephase = rparams.q1current_relative_phase
     else:
         assert False, f"Invalid qubit index: {tag}"
+    underlying_gate = statevector.embed(gatem, [tag], 2)
     time = angle/rparams.rabi_frequency
     instruction_string = f"Apply electromagnetic radiation to qubit {tag} through it's Drive capacitor "
     details = f"""Drive Frequency: {round3(qdrive_freq*(1e-9))} GHz 
 Phase: PI/2 + Current Relative Phase: {round3(np.pi/2 + usephase)} radians 
 Amplitude: k* {round3(rparams.rabi_frequency*(1e-6))} MHz 
 Time: {round3(time*1e9)} ns<split>Applying a rotation around the Y axis is via phase = PI/2, since this phase produces a pure Pauli Y rotation in the drive hamiltonian. The amplitude of the drive is k*rabi_frequency, where k is a constant must be calibrated on a real system. We must also factor in our current relative phase (so that the virtual Z rotations are considered). The speed of this rotation is dictated by the Rabi Frequency (time =theta/rabi)"""
-    return physical_instruction(code,title, tag, underlying_gate, instruction_string, details,angle)
+    return physical_instruction(code,title, tag, underlying_gate, instruction_string, details,angle,duration=abs(time))
 @dataclass
 class relevant_parameters:
     rabi_frequency: float 
@@ -227,5 +368,7 @@ class relevant_parameters:
     q1drive_freq: float
     q0current_relative_phase: float
     q1current_relative_phase: float
+    # g of the iSwap interaction, same units as rabi_frequency
+    coupling_strength: float = 10e6
 
 
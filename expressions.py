@@ -0,0 +1,83 @@
+import re
+from dataclasses import dataclass
+
+import config
+import metrics
+from cache import LRUCache
+from numeric_eval import evaluate_numeric, UnsupportedExpression
+
+# shared by /evaluate_complex, /decompose and /decompose_state, keyed on the normalized string
+expression_cache = LRUCache(config.EXPRESSION_CACHE_SIZE)
+
+
+def run_inline(fn, *args):
+    return fn(*args)
+
+
+def run_sympy(runner, fn, *args):
+    # the sympy fallbacks run as runner(fn, *args) with fn a module level function. app.py passes
+    # its work pool offload so a runaway parse or simplify() can be killed, everything else runs
+    # them inline
+    with metrics.stage('sympy'):
+        return runner(fn, *args)
+
+
+@dataclass
+class parsed_expression:
+    normalized: str
+    value: complex
+    _latex: str = None
+
+    def latex(self, runner=run_inline):
+        # only /evaluate_complex needs this, so the sympy parse is deferred until asked
+        if self._latex is None:
+            self._latex = run_sympy(runner, sympy_latex, self.normalized)
+        return self._latex
+
+
+def normalize_expression(expr_str):
+    # some light parsing and symbol stuff
+    expr_str = expr_str.strip()
+    expr_str = re.sub(r'\be\b', 'E', expr_str)
+    expr_str = re.sub(r'(\d)i\b', r'\1*I', expr_str)
+    expr_str = re.sub(r'\bi(pi|theta|phi)\b', r'I*\1', expr_str)   # i*pi etc fixes
+    expr_str = re.sub(r'(^|[\+\-\*/\(\)\^])\s*i\s*(?=[\+\-\*/\)\^]|$)', r'\1I', expr_str)
+    expr_str = re.sub(r'\bi\b', 'I', expr_str)
+    expr_str = expr_str.replace('^', '**')   # python exponent
+    return expr_str
+
+
+def sympy_parse(normalized):
+    # sympy is only imported once an input actually needs it
+    from sympy.parsing.sympy_parser import parse_expr, standard_transformations, implicit_multiplication_application
+
+    transformations = standard_transformations + (implicit_multiplication_application,)
+    return parse_expr(normalized, transformations=transformations)
+
+
+def sympy_latex(normalized):
+    from sympy import latex
+
+    return latex(sympy_parse(normalized))
+
+
+def sympy_value(normalized):
+    from sympy import simplify
+
+    simplified = simplify(sympy_parse(normalized))
+    real_part, imag_part = simplified.as_real_imag()
+    return complex(float(real_part), float(imag_part))
+
+
+def compile_expression(normalized, runner=run_inline):
+    try:
+        return parsed_expression(normalized, evaluate_numeric(normalized))
+    except UnsupportedExpression:
+        pass
+    return parsed_expression(normalized, run_sympy(runner, sympy_value, normalized))
+
+
+def evaluate_expression(expr_str, runner=run_inline):
+    # failures raise out of compile_expression and are never cached
+    normalized = normalize_expression(expr_str)
+    return expression_cache.get_or_compute(normalized, lambda: compile_expression(normalized, runner))
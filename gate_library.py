@@ -0,0 +1,311 @@
+import argparse
+import logging
+import os
+from dataclasses import dataclass
+
+import numpy as np
+
+import config
+import statevector
+import zyz
+
+# the gates people actually pick (CNOT, CZ, SWAP, iSwap, sqrt(iSwap), products of Cliffords and T,
+# controlled rotations at the usual angles) with their decompositions worked out ahead of time.
+# `python gate_library.py build` decomposes every gate in every basis and writes GATE_LIBRARY_PATH,
+# an .npz with the unitaries, each gate's decompose_gate matrices and tags, and its gate_steps()
+# sequence (the ZYZ angles, which don't depend on the drive parameters). an input that matches a
+# library gate by name or by unitary skips synthesis and ZYZ, only InstructionSet's phase
+# bookkeeping is left to do.
+#
+# the file is loaded once per process (pool workers load it in their initializer) and every entry
+# is checked on the way in: its matrices and its steps both have to reproduce the unitary, entries
+# that don't are dropped. the file records the engine it was built with and is ignored when that
+# doesn't match DECOMPOSITION_ENGINE ('check' builds the same circuits as 'native'). in 'check'
+# mode the library isn't used for decompositions at all, every input goes through synthesis and
+# the qiskit cross-check.
+#
+# without a usable file the library is built in memory for the native bases, which costs about
+# 150 ms per process, so deployments should run `python gate_library.py build` after installing
+
+FORMAT_VERSION = 2
+STEP_CODES = ("RZ", "RY", "ENTANGLE")
+
+logger = logging.getLogger('workbench.gate_library')
+
+_SQ2 = 1 / np.sqrt(2)
+SINGLE_QUBIT_GATES = {
+    'h': np.array([[_SQ2, _SQ2], [_SQ2, -_SQ2]], dtype=complex),
+    'x': np.array([[0, 1], [1, 0]], dtype=complex),
+    'y': np.array([[0, -1j], [1j, 0]], dtype=complex),
+    'z': np.array([[1, 0], [0, -1]], dtype=complex),
+    's': np.diag([1, 1j]),
+    'sdg': np.diag([1, -1j]),
+    't': np.diag([1, np.exp(1j * np.pi / 4)]),
+    'tdg': np.diag([1, np.exp(-1j * np.pi / 4)]),
+    'sx': np.array([[1 + 1j, 1 - 1j], [1 - 1j, 1 + 1j]], dtype=complex) / 2,
+}
+ANGLES = {'pi': np.pi, 'pi/2': np.pi / 2, 'pi/4': np.pi / 4, 'pi/8': np.pi / 8, '-pi/2': -np.pi / 2, '-pi/4': -np.pi / 4}
+
+
+def _rotation(axis, angle):
+    pauli = SINGLE_QUBIT_GATES[axis]
+    return np.cos(angle / 2) * np.identity(2) - 1j * np.sin(angle / 2) * pauli
+
+
+def _controlled(u):
+    # control on q1, target q0, like the CNOT the frontend shows
+    U = np.identity(4, dtype=complex)
+    U[2:, 2:] = u
+    return U
+
+
+def library_unitaries():
+    # {name: (4, 4) unitary}. single-qubit gates are named by qubit ('h_q0'), products as
+    # 'h_q1,x_q0'; controlled gates have the control on q1 unless they're '_reversed'
+    swap = np.identity(4, dtype=complex)[[0, 2, 1, 3]]
+    gates = {
+        'identity': np.identity(4, dtype=complex),
+        'cnot': _controlled(SINGLE_QUBIT_GATES['x']),
+        'cnot_reversed': swap @ _controlled(SINGLE_QUBIT_GATES['x']) @ swap,
+        'cz': np.diag([1, 1, 1, -1]).astype(complex),
+        'cy': _controlled(SINGLE_QUBIT_GATES['y']),
+        'swap': swap,
+        'iswap': np.array([[1, 0, 0, 0], [0, 0, 1j, 0], [0, 1j, 0, 0], [0, 0, 0, 1]], dtype=complex),
+        'iswap_dagger': np.array([[1, 0, 0, 0], [0, 0, -1j, 0], [0, -1j, 0, 0], [0, 0, 0, 1]], dtype=complex),
+        'sqrt_iswap': np.array([[1, 0, 0, 0], [0, _SQ2, 1j * _SQ2, 0], [0, 1j * _SQ2, _SQ2, 0], [0, 0, 0, 1]], dtype=complex),
+        'sqrt_iswap_dagger': np.array([[1, 0, 0, 0], [0, _SQ2, -1j * _SQ2, 0], [0, -1j * _SQ2, _SQ2, 0], [0, 0, 0, 1]], dtype=complex),
+        'sqrt_swap': np.array([[1, 0, 0, 0], [0, (1 + 1j) / 2, (1 - 1j) / 2, 0], [0, (1 - 1j) / 2, (1 + 1j) / 2, 0], [0, 0, 0, 1]], dtype=complex),
+    }
+    for label, angle in ANGLES.items():
+        gates[f'crx({label})'] = _controlled(_rotation('x', angle))
+        gates[f'cry({label})'] = _controlled(_rotation('y', angle))
+        gates[f'crz({label})'] = _controlled(_rotation('z', angle))
+        gates[f'cphase({label})'] = np.diag([1, 1, 1, np.exp(1j * angle)])
+    one_qubit = {'i': np.identity(2, dtype=complex), **SINGLE_QUBIT_GATES}
+    for left, a in one_qubit.items():
+        for right, b in one_qubit.items():
+            if left == right == 'i':
+                continue
+            name = ','.join(f'{g}_q{q}' for g, q in ((left, 1), (right, 0)) if g != 'i')
+            gates[name] = np.kron(a, b)
+    return gates
+
+
+@dataclass
+class library_gate:
+    # stands in for the synthesis result when a decomposition comes out of the library
+    name: str
+    steps: list
+
+
+def _circuit_unitary(matrices, tags):
+    U = np.identity(4, dtype=complex)
+    for matrix, tag in zip(matrices, tags):
+        U = (matrix if tag == 2 else statevector.embed(matrix, [tag], 2)) @ U
+    return U
+
+
+def _step_gates(codes, tags, angles):
+    # (N, 4, 4) two-qubit matrices of RZ/RY steps in one batch, the entries for ENTANGLE steps
+    # are meaningless
+    local = np.where((codes == 0)[:, None, None], zyz.rz_matrix(angles), zyz.ry_matrix(angles))
+    on_q0 = np.einsum('ab,ncd->nacbd', np.identity(2), local).reshape(-1, 4, 4)
+    on_q1 = np.einsum('nab,cd->nacbd', local, np.identity(2)).reshape(-1, 4, 4)
+    return np.where((tags == 0)[:, None, None], on_q0, on_q1)
+
+
+def _steps_unitary(steps, gates, entangling):
+    # the circuit a step sequence runs, its ENTANGLE steps are the decomposition's entangling
+    # gates in order
+    entangling = iter(entangling)
+    U = np.identity(4, dtype=complex)
+    for (code, _, _), gate in zip(steps, gates):
+        U = (next(entangling) if code == "ENTANGLE" else gate) @ U
+    return U
+
+
+def _engine():
+    # the engine library decompositions come from, 'check' builds the same circuits as 'native'
+    return 'qiskit' if config.DECOMPOSITION_ENGINE == 'qiskit' else 'native'
+
+
+def _phase_distance(A, B):
+    # Frobenius distance between A and B once the best global phase is taken out
+    return np.sqrt(max(2 * len(A) - 2 * abs(np.trace(A.conj().T @ B)), 0.0))
+
+
+def build(modes):
+    # the arrays of a library file, decomposing every gate in every basis with decompose_gate
+    from decomposition import decompose_gate, gate_steps
+
+    gates = library_unitaries()
+    arrays = {
+        'version': np.array(FORMAT_VERSION),
+        'engine': np.array(_engine()),
+        'names': np.array(list(gates)),
+        'unitaries': np.array(list(gates.values())),
+        'modes': np.array(list(modes))
+    }
+    for mode in modes:
+        tags, local, entangling, offsets = [], [], [], [0]
+        step_codes, step_tags, step_angles, step_offsets = [], [], [], [0]
+        for U in gates.values():
+            RM, gate_tags, _ = decompose_gate(U, mode)
+            for matrix, tag in zip(RM, gate_tags):
+                (entangling if tag == 2 else local).append(np.asarray(matrix, dtype=complex))
+            tags.extend(gate_tags)
+            offsets.append(len(tags))
+            for code, tag, angle in gate_steps(RM, gate_tags):
+                step_codes.append(STEP_CODES.index(code))
+                step_tags.append(tag)
+                step_angles.append(0.0 if angle is None else angle)
+            step_offsets.append(len(step_codes))
+        arrays.update({
+            f'{mode}_tags': np.array(tags, dtype=np.int8),
+            f'{mode}_offsets': np.array(offsets, dtype=np.int32),
+            f'{mode}_local': np.array(local, dtype=complex).reshape(-1, 2, 2),
+            f'{mode}_entangling': np.array(entangling, dtype=complex).reshape(-1, 4, 4),
+            f'{mode}_step_codes': np.array(step_codes, dtype=np.int8),
+            f'{mode}_step_tags': np.array(step_tags, dtype=np.int8),
+            f'{mode}_step_angles': np.array(step_angles),
+            f'{mode}_step_offsets': np.array(step_offsets, dtype=np.int32)
+        })
+    return arrays
+
+
+class GateLibrary:
+    def __init__(self, arrays, atol=config.GATE_LIBRARY_ATOL):
+        self.names = [str(name) for name in arrays['names']]
+        self.index = {name: k for k, name in enumerate(self.names)}
+        self.unitaries = np.asarray(arrays['unitaries'], dtype=complex)
+        self.atol = atol
+        # {mode: [(RM, tags, library_gate) or None per gate]}, None for entries that failed the check
+        self.decompositions = {}
+        for mode in (str(m) for m in arrays['modes']):
+            self.decompositions[mode] = self._unpack(arrays, mode)
+
+    def _unpack(self, arrays, mode):
+        tags = arrays[f'{mode}_tags'].tolist()
+        offsets = arrays[f'{mode}_offsets']
+        local = iter(arrays[f'{mode}_local'])
+        entangling = iter(arrays[f'{mode}_entangling'])
+        matrices = [next(entangling) if tag == 2 else next(local) for tag in tags]
+        codes, step_tags = arrays[f'{mode}_step_codes'], arrays[f'{mode}_step_tags']
+        angles, step_offsets = arrays[f'{mode}_step_angles'], arrays[f'{mode}_step_offsets']
+        step_gates = _step_gates(codes, step_tags, angles)
+        codes, step_tags, angles = codes.tolist(), step_tags.tolist(), angles.tolist()
+        entries = []
+        for k, name in enumerate(self.names):
+            RM, gate_tags = matrices[offsets[k]:offsets[k + 1]], tags[offsets[k]:offsets[k + 1]]
+            steps = [(STEP_CODES[codes[j]], step_tags[j], None if codes[j] == 2 else angles[j])
+                     for j in range(step_offsets[k], step_offsets[k + 1])]
+            gates = step_gates[step_offsets[k]:step_offsets[k + 1]]
+            if not self._reproduces(self.unitaries[k], RM, gate_tags, steps, gates):
+                logger.warning("dropping %s (%s) from the gate library, its decomposition is wrong", name, mode)
+                entries.append(None)
+                continue
+            entries.append((RM, gate_tags, library_gate(name, steps)))
+        return entries
+
+    def _reproduces(self, U, RM, tags, steps, step_gates):
+        # both what the decomposition's matrices multiply to and what its steps run have to be U
+        if _phase_distance(U, _circuit_unitary(RM, tags)) > self.atol:
+            return False
+        entangling = [matrix for matrix, tag in zip(RM, tags) if tag == 2]
+        if sum(code == "ENTANGLE" for code, _, _ in steps) != len(entangling):
+            return False
+        if any(code != "ENTANGLE" and tag not in (0, 1) for code, tag, _ in steps):
+            return False
+        return _phase_distance(U, _steps_unitary(steps, step_gates, entangling)) <= self.atol
+
+    def unitary(self, name):
+        if name not in self.index:
+            raise ValueError(f"Unknown gate: {name}")
+        return self.unitaries[self.index[name]]
+
+    def find(self, U):
+        # index of the library gate equal to U up to global phase, None when there isn't one
+        U = np.asarray(U, dtype=complex)
+        if U.shape != (4, 4):
+            return None
+        overlaps = np.abs(np.einsum('gij,ij->g', self.unitaries.conj(), U))
+        k = int(np.argmax(overlaps))
+        return k if np.sqrt(max(8 - 2 * overlaps[k], 0.0)) <= self.atol else None
+
+    def decomposition(self, U, mode):
+        # (RM, tags, library_gate) like decompose_gate returns, or None
+        entries = self.decompositions.get(mode)
+        if entries is None:
+            return None
+        k = self.find(U)
+        return None if k is None else entries[k]
+
+
+_library = None
+
+
+def load(path=None):
+    # the library from path (GATE_LIBRARY_PATH by default), built in memory for the native bases
+    # when there's no usable file
+    from decomposition import NATIVE_BASES
+
+    path = config.GATE_LIBRARY_PATH if path is None else path
+    if os.path.isfile(path):
+        with np.load(path, allow_pickle=False) as f:
+            arrays = dict(f)
+        if int(arrays['version']) != FORMAT_VERSION:
+            logger.warning("%s is gate library format %s, expected %s. rebuild it with `python gate_library.py build`",
+                           path, int(arrays['version']), FORMAT_VERSION)
+        elif str(arrays['engine']) != _engine():
+            logger.warning("%s was built with the %s engine, DECOMPOSITION_ENGINE is %s. rebuild it with "
+                           "`python gate_library.py build`", path, str(arrays['engine']), config.DECOMPOSITION_ENGINE)
+        else:
+            return GateLibrary(arrays)
+    return GateLibrary(build(NATIVE_BASES))
+
+
+def get():
+    # the process-wide library, None when GATE_LIBRARY_PATH is empty
+    global _library
+    if _library is None and config.GATE_LIBRARY_PATH:
+        _library = load()
+    return _library
+
+
+def lookup(U, mode):
+    # 'check' mode is for validating the engine, so it synthesizes everything
+    if config.DECOMPOSITION_ENGINE == 'check':
+        return None
+    library = get()
+    return None if library is None else library.decomposition(U, mode)
+
+
+def named_unitary(name):
+    library = get()
+    if library is None:
+        raise ValueError("The gate library is disabled")
+    return library.unitary(name)
+
+
+def main():
+    from decomposition import BASIS_GATES
+
+    parser = argparse.ArgumentParser(description="build or inspect the named-gate library")
+    parser.add_argument('command', choices=('build', 'list'))
+    parser.add_argument('--output', default=config.GATE_LIBRARY_PATH, help="library file to write")
+    parser.add_argument('--modes', default=','.join(BASIS_GATES), help="comma separated bases to decompose into")
+    args = parser.parse_args()
+    if args.command == 'list':
+        for name in library_unitaries():
+            print(name)
+        return
+    arrays = build([mode.strip() for mode in args.modes.split(',') if mode.strip()])
+    np.savez_compressed(args.output, **arrays)
+    # check it loads the way a worker would load it
+    library = GateLibrary(dict(np.load(args.output, allow_pickle=False)))
+    print(f"wrote {len(library.names)} gates in {', '.join(library.decompositions)} to {args.output} "
+          f"({os.path.getsize(args.output)} bytes)")
+
+
+if __name__ == '__main__':
+    main()
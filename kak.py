@@ -0,0 +1,387 @@
+from dataclasses import dataclass
+from typing import Any
+import numpy as np
+
+# analytic KAK (Cartan) decomposition of two-qubit unitaries, vectorized over a batch:
+#   U = e^{i phase} (K1l x K1r) exp(i(a XX + b YY + c ZZ)) (K2l x K2r)
+# with (a, b, c) folded into the Weyl chamber pi/4 >= a >= b >= |c| (c >= 0 when a = pi/4),
+# and exact synthesis of U into the minimal number of iSwaps. same qubit order as the rest
+# of the workbench: kron(left, right) puts left on qubit 1 and right on qubit 0
+
+PAULI_I = np.eye(2, dtype=complex)
+PAULI_X = np.array([[0, 1], [1, 0]], dtype=complex)
+PAULI_Y = np.array([[0, -1j], [1j, 0]], dtype=complex)
+PAULI_Z = np.array([[1, 0], [0, -1]], dtype=complex)
+
+ISWAP = np.array([[1, 0, 0, 0], [0, 0, 1j, 0], [0, 1j, 0, 0], [0, 0, 0, 1]], dtype=complex)
+
+# local gates are real orthogonal and canonical gates are diagonal in the magic basis
+MAGIC = np.array([[1, 0, 0, 1j], [0, 1j, 1, 0], [0, 1j, -1, 0], [1, 0, 0, -1j]], dtype=complex) / np.sqrt(2)
+MAGIC_DAG = MAGIC.conj().T
+
+# diagonal of XX, YY, ZZ in the magic basis, one column each. the columns are orthogonal
+# and sum to zero, so the canonical phases and (a, b, c) map onto each other exactly
+WEYL_SIGNS = np.stack([np.diag(MAGIC_DAG @ np.kron(p, p) @ MAGIC).real for p in (PAULI_X, PAULI_Y, PAULI_Z)], axis=-1)
+
+# coordinates closer than this to a gate class are synthesized as that class
+SYNTHESIS_ATOL = 1e-9
+
+_DIAGONALIZE_TRIES = 16
+_DIAGONALIZE_ATOL = 1e-10
+
+
+def _rx(angle):
+    angle = np.asarray(angle, dtype=float)
+    c = np.cos(angle / 2)
+    s = -1j * np.sin(angle / 2)
+    return np.stack([np.stack([c, s], axis=-1), np.stack([s, c], axis=-1)], axis=-2)
+
+
+def _dag(m):
+    return np.conj(np.swapaxes(m, -1, -2))
+
+
+def _single_qubit_cliffords():
+    # the 24 single-qubit Cliffords up to phase, generated from H and S
+    h = np.array([[1, 1], [1, -1]], dtype=complex) / np.sqrt(2)
+    s = np.diag([1, 1j])
+    found = [PAULI_I]
+    frontier = [PAULI_I]
+    while frontier:
+        nxt = []
+        for m in frontier:
+            for g in (h, s):
+                candidate = g @ m
+                if not any(abs(abs(np.trace(_dag(f) @ candidate)) - 2) < 1e-9 for f in found):
+                    found.append(candidate)
+                    nxt.append(candidate)
+        frontier = nxt
+    return found
+
+
+def _permutation_cliffords():
+    # for every ordering of the (XX, YY, ZZ) coordinates, a C with C P_order[i] C^dag = +-P_i,
+    # so (C x C) moves coordinate order[i] into slot i
+    paulis = (PAULI_X, PAULI_Y, PAULI_Z)
+    table = {}
+    for c in _single_qubit_cliffords():
+        images = []
+        for p in paulis:
+            q = c @ p @ _dag(c)
+            images.append(next(i for i, r in enumerate(paulis) if abs(abs(np.trace(_dag(r) @ q)) - 2) < 1e-9))
+        order = tuple(int(np.argsort(images)[i]) for i in range(3))
+        table.setdefault(order, c)
+    return table
+
+
+PERMUTATION_CLIFFORDS = _permutation_cliffords()
+
+# iSwap (Rx(2a) x Rx(2b)) iSwap = -XX C^dag Z1 Can(a, b, 0) Z1 C YY with C = Ry(pi/2) x SH, i.e. two
+# iSwaps reach every c = 0 class with the middle angles read straight off the coordinates
+T2_LEFT = np.array([[1, -1], [1, 1]], dtype=complex) / np.sqrt(2)
+T2_RIGHT = np.diag([1, 1j]) @ np.array([[1, 1], [1, -1]], dtype=complex) / np.sqrt(2)
+
+# peeling iSwap (Rx(pi/2) x I) off any Can(a, b, c) leaves a c = 0 remainder (it sits at
+# (pi/4, pi/4 - a, 0)), so three iSwaps are two-iSwap synthesis of the remainder plus one
+PEEL_LOCAL = _rx(np.pi / 2)
+PEEL_GATE = np.kron(PEEL_LOCAL, PAULI_I)
+
+
+def canonical_gate(coordinates):
+    # (N, 4, 4) exp(i(a XX + b YY + c ZZ)) for (N, 3) coordinates
+    phases = np.exp(1j * (np.asarray(coordinates, dtype=float) @ WEYL_SIGNS.T))
+    return MAGIC @ (phases[..., :, None] * MAGIC_DAG)
+
+
+def local_factors(K):
+    # split (N, 4, 4) local gates into (N, 2, 2) left and right factors with K = kron(left, right)
+    blocks = K.reshape(-1, 2, 2, 2, 2).transpose(0, 1, 3, 2, 4)
+    # one of the first column of left has |entry|^2 >= 1/2, read the right factor off that block
+    top = blocks[:, 0, 0]
+    bottom = blocks[:, 1, 0]
+    det_top = np.linalg.det(top)
+    det_bottom = np.linalg.det(bottom)
+    pivot = np.where((np.abs(det_top) >= np.abs(det_bottom))[:, None, None], top, bottom)
+    det_pivot = np.where(np.abs(det_top) >= np.abs(det_bottom), det_top, det_bottom)
+    right = pivot / np.sqrt(det_pivot)[:, None, None]
+    left = np.einsum('nijab,nab->nij', blocks, right.conj()) / 2
+    return left, right
+
+
+def _diagonalize(M2):
+    # real orthogonal P (det +1) with P^T M2 P diagonal, for complex symmetric unitary M2.
+    # Re(M2) and Im(M2) commute, so a generic real combination of them shares their eigenvectors
+    n = len(M2)
+    M2 = np.where(np.abs(M2.real) < 1e-13, 0.0, M2.real) + 1j * np.where(np.abs(M2.imag) < 1e-13, 0.0, M2.imag)
+    P = np.zeros((n, 4, 4))
+    pending = np.arange(n)
+    weights = np.random.default_rng(2020).random((_DIAGONALIZE_TRIES, 2))
+    for wa, wb in weights:
+        _, candidate = np.linalg.eigh(wa * M2[pending].real + wb * M2[pending].imag)
+        D = np.einsum('nji,njk,nkl->nil', candidate, M2[pending], candidate)
+        off = np.abs(D - D * np.eye(4)).max(axis=(-2, -1))
+        done = off < _DIAGONALIZE_ATOL
+        P[pending[done]] = candidate[done]
+        pending = pending[~done]
+        if not len(pending):
+            break
+    else:
+        raise ValueError("KAK decomposition failed to diagonalize the magic-basis gram matrix")
+    P[:, :, -1] *= np.sign(np.linalg.det(P))[:, None]
+    D = np.einsum('nji,njk,nki->ni', P, M2, P)
+    return P, D
+
+
+@dataclass
+class weyl_decomposition:
+    global_phase: Any
+    coordinates: Any
+    k1l: Any
+    k1r: Any
+    k2l: Any
+    k2r: Any
+
+    def reconstruct(self):
+        K1 = np.einsum('nij,nkl->nikjl', self.k1l, self.k1r).reshape(-1, 4, 4)
+        K2 = np.einsum('nij,nkl->nikjl', self.k2l, self.k2r).reshape(-1, 4, 4)
+        return np.exp(1j * self.global_phase)[:, None, None] * K1 @ canonical_gate(self.coordinates) @ K2
+
+
+def weyl_decompose(U):
+    U = np.asarray(U, dtype=complex).reshape(-1, 4, 4)
+    det = np.linalg.det(U)
+    global_phase = np.angle(det) / 4
+    Up = MAGIC_DAG @ (U * np.exp(-1j * global_phase)[:, None, None]) @ MAGIC
+    P, D = _diagonalize(np.swapaxes(Up, -1, -2) @ Up)
+
+    # square roots of the eigenvalues, the last one fixed so the product is exactly 1
+    half = np.angle(D) / 2
+    half[:, 3] = -half[:, :3].sum(axis=-1)
+    coordinates = half @ WEYL_SIGNS / 4
+
+    O1 = (Up @ P * np.exp(-1j * half)[:, None, :]).real
+    k1l, k1r = local_factors(MAGIC @ O1 @ MAGIC_DAG)
+    k2l, k2r = local_factors(MAGIC @ np.swapaxes(P, -1, -2) @ MAGIC_DAG)
+    return _to_weyl_chamber(weyl_decomposition(global_phase, coordinates, k1l, k1r, k2l, k2r))
+
+
+def _to_weyl_chamber(w):
+    # fold (a, b, c) into the chamber, moving the local Cliffords this takes into K1 / K2
+    coordinates = w.coordinates.copy()
+    k1l, k1r, k2l, k2r = w.k1l.copy(), w.k1r.copy(), w.k2l.copy(), w.k2r.copy()
+    phase = w.global_phase.copy()
+    paulis = (PAULI_X, PAULI_Y, PAULI_Z)
+
+    # shift every coordinate into [-pi/4, pi/4]: Can(v) = Can(v - n pi/2 e_j) (i P_j P_j)^n
+    shifts = np.round(coordinates / (np.pi / 2))
+    coordinates -= shifts * (np.pi / 2)
+    phase += shifts.sum(axis=-1) * (np.pi / 2)
+    for j, p in enumerate(paulis):
+        odd = (shifts[:, j] % 2 == 1)[:, None, None]
+        k2l = np.where(odd, p @ k2l, k2l)
+        k2r = np.where(odd, p @ k2r, k2r)
+
+    # sort by magnitude: Can(v) = (C x C)^dag Can(v[order]) (C x C)
+    orders = np.argsort(-np.abs(coordinates), axis=-1, kind='stable')
+    for order, c in PERMUTATION_CLIFFORDS.items():
+        match = np.all(orders == np.array(order), axis=-1)
+        if not match.any():
+            continue
+        m = match[:, None, None]
+        k1l = np.where(m, k1l @ _dag(c), k1l)
+        k1r = np.where(m, k1r @ _dag(c), k1r)
+        k2l = np.where(m, c @ k2l, k2l)
+        k2r = np.where(m, c @ k2r, k2r)
+        coordinates[match] = coordinates[match][:, list(order)]
+
+    # make a, b >= 0 by flipping pairs: (P x I) Can(v) (P x I) negates the two coordinates P anticommutes with
+    a_neg = coordinates[:, 0] < 0
+    b_neg = coordinates[:, 1] < 0
+    for mask, p, flipped in ((a_neg & b_neg, PAULI_Z, (0, 1)), (a_neg & ~b_neg, PAULI_Y, (0, 2)), (~a_neg & b_neg, PAULI_X, (1, 2))):
+        m = mask[:, None, None]
+        k1l = np.where(m, k1l @ p, k1l)
+        k2l = np.where(m, p @ k2l, k2l)
+        for j in flipped:
+            coordinates[mask, j] *= -1
+
+    # on the a = pi/4 face (pi/4, b, c) and (pi/4, b, -c) are the same class, keep c >= 0
+    face = (coordinates[:, 0] > np.pi / 4 - SYNTHESIS_ATOL) & (coordinates[:, 2] < 0)
+    m = face[:, None, None]
+    phase = np.where(face, phase + np.pi / 2, phase)
+    k2l = np.where(m, PAULI_Y @ PAULI_X @ k2l, k2l)
+    k2r = np.where(m, PAULI_X @ k2r, k2r)
+    k1l = np.where(m, k1l @ PAULI_Y, k1l)
+    coordinates[face, 0] = np.pi / 2 - coordinates[face, 0]
+    coordinates[face, 2] *= -1
+
+    return weyl_decomposition(phase, coordinates, k1l, k1r, k2l, k2r)
+
+
+def weyl_coordinates(U):
+    return weyl_decompose(U).coordinates
+
+
+def num_basis_gates(coordinates, atol=SYNTHESIS_ATOL):
+    # minimal number of iSwaps: 0 for local gates, 1 for the iSwap class, 2 on the c = 0 plane, else 3
+    a, b, c = np.asarray(coordinates, dtype=float).reshape(-1, 3).T
+    counts = np.full(len(a), 3)
+    counts = np.where(np.abs(c) < atol, 2, counts)
+    counts = np.where((np.abs(a - np.pi / 4) < atol) & (np.abs(b - np.pi / 4) < atol) & (np.abs(c) < atol), 1, counts)
+    return np.where((np.abs(a) < atol) & (np.abs(b) < atol) & (np.abs(c) < atol), 0, counts)
+
+
+def trace_fidelity(trace):
+    # average gate fidelity between two 4x4 unitaries from |Tr(U^dag V)|
+    return (4 + np.abs(trace)**2) / 20
+
+
+def basis_traces(coordinates):
+    # (N, 4) Tr(Can(v)^dag Can(v')) for v' the nearest class reachable with 0, 1, 2 and 3 iSwaps:
+    # the identity, the iSwap class, the c = 0 plane and v itself
+    a, b, c = np.asarray(coordinates, dtype=float).reshape(-1, 3).T
+    return 4 * np.stack([
+        np.cos(a) * np.cos(b) * np.cos(c) + 1j * np.sin(a) * np.sin(b) * np.sin(c),
+        np.cos(np.pi / 4 - a) * np.cos(np.pi / 4 - b) * np.cos(c) + 1j * np.sin(np.pi / 4 - a) * np.sin(np.pi / 4 - b) * np.sin(c),
+        np.cos(c) + 0j,
+        np.ones_like(a) + 0j
+    ], axis=-1)
+
+
+def choose_basis_counts(coordinates, basis_fidelity=1.0, target_fidelity=None):
+    # iSwap count per unitary and the (N, 4) expected fidelity of every count, the synthesis error
+    # times basis_fidelity per iSwap. with a target, the fewest iSwaps that reach it (the best
+    # count when none does), without one the best count, ties going to fewer iSwaps
+    expected = trace_fidelity(basis_traces(coordinates)) * basis_fidelity ** np.arange(4)
+    best = np.argmax(expected, axis=-1)
+    if target_fidelity is None:
+        return best, expected
+    meets = expected >= target_fidelity
+    return np.where(meets.any(axis=-1), np.argmax(meets, axis=-1), best), expected
+
+
+@dataclass
+class two_qubit_synthesis:
+    # gates in circuit order: (2, 2) matrices tagged 0 / 1 for qubit 0 / 1, ISWAP tagged 2
+    matrices: list
+    tags: list
+    global_phase: float
+    coordinates: Any
+    num_basis_gates: int
+    # for approximate synthesis: the count an exact circuit needs and the fidelity to the target
+    exact_basis_gates: int = None
+    fidelity: float = 1.0
+
+    def unitary(self):
+        U = np.identity(4, dtype=complex)
+        for matrix, tag in zip(self.matrices, self.tags):
+            if tag == 0:
+                matrix = np.kron(PAULI_I, matrix)
+            elif tag == 1:
+                matrix = np.kron(matrix, PAULI_I)
+            U = matrix @ U
+        return np.exp(1j * self.global_phase) * U
+
+
+def _two_iswap_layers(w, idx):
+    # local layers around iSwap (Rx(2a) x Rx(2b)) iSwap for the c = 0 classes in w[idx]
+    a, b = w.coordinates[idx, 0], w.coordinates[idx, 1]
+    first = (PAULI_Y @ _dag(T2_LEFT) @ PAULI_Z @ w.k2l[idx], PAULI_Y @ _dag(T2_RIGHT) @ w.k2r[idx])
+    middle = (_rx(2 * a), _rx(2 * b))
+    last = (w.k1l[idx] @ PAULI_Z @ T2_LEFT @ PAULI_X, w.k1r[idx] @ T2_RIGHT @ PAULI_X)
+    return [first, middle, last], w.global_phase[idx] + np.pi
+
+
+def synthesize(U, atol=SYNTHESIS_ATOL, basis_fidelity=None, target_fidelity=None):
+    # iSwap-basis circuits for a batch of (4, 4) unitaries, one two_qubit_synthesis each. exact
+    # unless basis_fidelity or target_fidelity is given, then each unitary gets the iSwap count
+    # choose_basis_counts picks and its class is projected onto what that count reaches
+    U = np.asarray(U, dtype=complex).reshape(-1, 4, 4)
+    w = weyl_decompose(U)
+    exact_counts = num_basis_gates(w.coordinates, atol)
+    counts = exact_counts
+    fidelities = np.ones(len(U))
+    if basis_fidelity is not None or target_fidelity is not None:
+        chosen, _ = choose_basis_counts(w.coordinates, 1.0 if basis_fidelity is None else basis_fidelity, target_fidelity)
+        counts = np.minimum(chosen, exact_counts)
+        fidelities = trace_fidelity(basis_traces(w.coordinates)[np.arange(len(U)), counts])
+        fidelities = np.where(counts == exact_counts, 1.0, fidelities)
+    layers = [None] * len(U)
+    phases = w.global_phase.copy()
+
+    idx = np.flatnonzero(counts == 0)
+    for n, (l, r) in zip(idx, zip(w.k1l[idx] @ w.k2l[idx], w.k1r[idx] @ w.k2r[idx])):
+        layers[n] = [(l, r)]
+
+    idx = np.flatnonzero(counts == 1)
+    for n in idx:
+        layers[n] = [(w.k2l[n], w.k2r[n]), (w.k1l[n], w.k1r[n])]
+
+    idx = np.flatnonzero(counts == 2)
+    if len(idx):
+        (first, middle, last), phase = _two_iswap_layers(w, idx)
+        phases[idx] = phase
+        for j, n in enumerate(idx):
+            layers[n] = [(first[0][j], first[1][j]), (middle[0][j], middle[1][j]), (last[0][j], last[1][j])]
+
+    idx = np.flatnonzero(counts == 3)
+    if len(idx):
+        # Can = W iSwap (Rx(pi/2) x I) with W on the c = 0 plane
+        remainder = canonical_gate(w.coordinates[idx]) @ _dag(PEEL_GATE) @ _dag(ISWAP)
+        r = weyl_decompose(remainder)
+        r.coordinates[:, 2] = 0.0
+        r.k1l = w.k1l[idx] @ r.k1l
+        r.k1r = w.k1r[idx] @ r.k1r
+        (first, middle, last), phase = _two_iswap_layers(r, np.arange(len(idx)))
+        phases[idx] = w.global_phase[idx] + phase
+        for j, n in enumerate(idx):
+            layers[n] = [(PEEL_LOCAL @ w.k2l[n], w.k2r[n]), (first[0][j], first[1][j]),
+                         (middle[0][j], middle[1][j]), (last[0][j], last[1][j])]
+
+    results = []
+    for n in range(len(U)):
+        matrices, tags = [], []
+        for k, (left, right) in enumerate(layers[n]):
+            if k:
+                matrices.append(ISWAP)
+                tags.append(2)
+            matrices.extend([right, left])
+            tags.extend([0, 1])
+        results.append(two_qubit_synthesis(matrices, tags, float(phases[n]), w.coordinates[n], int(counts[n]),
+                                           int(exact_counts[n]), float(fidelities[n])))
+    return results
+
+
+def circuit_unitaries(results):
+    # (N, 4, 4) unitaries of a batch of two_qubit_synthesis results, built with a few batched
+    # products per iSwap count. layer k sits at matrices[3k] (right) and [3k + 1] (left) with the
+    # iSwap before it at [3k - 1]
+    out = np.empty((len(results), 4, 4), dtype=complex)
+    counts = np.array([result.num_basis_gates for result in results], dtype=int)
+    for count in np.unique(counts):
+        idx = np.flatnonzero(counts == count)
+        U = None
+        for k in range(count + 1):
+            right = np.array([results[n].matrices[3 * k] for n in idx])
+            left = np.array([results[n].matrices[3 * k + 1] for n in idx])
+            layer = np.einsum('nab,ncd->nacbd', left, right).reshape(-1, 4, 4)
+            U = layer if U is None else layer @ ISWAP @ U
+        out[idx] = np.exp(1j * np.array([results[n].global_phase for n in idx]))[:, None, None] * U
+    return out
+
+
+def cross_check(U, results, atol=1e-8):
+    # compare against qiskit by what the circuits do rather than their structure or iSwap count,
+    # qiskit specializes near-local and other special classes its own way (and near-local ones only
+    # approximately). ours has to reproduce the unitary, qiskit's error is reported next to it
+    from qiskit.synthesis import TwoQubitBasisDecomposer
+    from qiskit.circuit.library import iSwapGate
+    from qiskit.quantum_info import Operator
+
+    decomposer = TwoQubitBasisDecomposer(iSwapGate())
+    U = np.asarray(U, dtype=complex).reshape(-1, 4, 4)
+    errors = np.abs(circuit_unitaries(results) - U).max(axis=(-2, -1))
+    problems = []
+    for n in np.flatnonzero(errors > atol):
+        reference = np.abs(Operator(decomposer(Operator(U[n]))).data - U[n]).max()
+        problems.append(f"{n}: synthesized circuit is off by {errors[n]:.3g}, qiskit's by {reference:.3g}")
+    return problems
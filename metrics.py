@@ -0,0 +1,167 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+
+# per-route request latency and per-stage breakdown (parse, decompose, serialize, ...), kept as
+# histograms and served by /metrics in the Prometheus text format. stages can nest, e.g.
+# sympy inside parse, so stage times don't have to add up to the request time. every process
+# keeps its own numbers
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger('workbench.metrics')
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # the last slot counts everything above the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+
+_lock = threading.Lock()
+_requests = {}
+_request_counts = {}
+_stages = {}
+_stage_calls = {}
+_collectors = []
+_local = threading.local()
+
+
+def begin_request(route):
+    _local.request = {'route': route, 'start': time.perf_counter(), 'stages': {}}
+
+
+def active():
+    return getattr(_local, 'request', None) is not None
+
+
+@contextmanager
+def stage(name):
+    # time a block of the current request, a no-op outside of one
+    current = getattr(_local, 'request', None)
+    if current is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds, calls = current['stages'].get(name, (0.0, 0))
+        current['stages'][name] = (seconds + time.perf_counter() - start, calls + 1)
+
+
+@contextmanager
+def collect_stages():
+    # stage timings of work done outside a request, e.g. in a pool worker, for merge_stages
+    _local.request = {'route': None, 'start': time.perf_counter(), 'stages': {}}
+    try:
+        yield _local.request['stages']
+    finally:
+        _local.request = None
+
+
+def merge_stages(stages):
+    # fold stages timed elsewhere into the current request
+    current = getattr(_local, 'request', None)
+    if current is None:
+        return
+    for name, (seconds, calls) in stages.items():
+        total, count = current['stages'].get(name, (0.0, 0))
+        current['stages'][name] = (total + seconds, count + calls)
+
+
+def current_stages():
+    # {stage: (seconds, calls)} of the current request so far
+    current = getattr(_local, 'request', None)
+    return dict(current['stages']) if current is not None else {}
+
+
+def register_collector(collect):
+    # collect() returns (name, type, help, [(labels, value), ...]) tuples, rendered after the built-in metrics
+    _collectors.append(collect)
+
+
+def end_request(status):
+    current = getattr(_local, 'request', None)
+    if current is None:
+        return
+    _local.request = None
+    total = time.perf_counter() - current['start']
+    route = current['route']
+    with _lock:
+        _requests.setdefault(route, Histogram()).observe(total)
+        _request_counts[(route, str(status))] = _request_counts.get((route, str(status)), 0) + 1
+        for name, (seconds, calls) in current['stages'].items():
+            _stages.setdefault((route, name), Histogram()).observe(seconds)
+            _stage_calls[(route, name)] = _stage_calls.get((route, name), 0) + calls
+    if config.SLOW_REQUEST_SECONDS is not None and total >= config.SLOW_REQUEST_SECONDS:
+        breakdown = ', '.join(f"{name}={seconds * 1e3:.1f}ms" + (f" x{calls}" if calls > 1 else '')
+                              for name, (seconds, calls) in current['stages'].items())
+        logger.warning("slow request %s (status %s): %.1fms [%s]", route, status, total * 1e3, breakdown or 'no stages')
+
+
+def _labels(**labels):
+    return ','.join(f'{key}="{value}"' for key, value in labels.items())
+
+
+def _render_histogram(lines, name, entries):
+    for labels, histogram in entries:
+        labels = _labels(**labels)
+        for bound, count in histogram.cumulative():
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{name}_bucket{{{labels},le="{le}"}} {count}')
+        lines.append(f'{name}_sum{{{labels}}} {histogram.sum!r}')
+        lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+
+
+def render():
+    lines = []
+    with _lock:
+        lines += [
+            '# HELP workbench_request_duration_seconds Wall time of each request by route.',
+            '# TYPE workbench_request_duration_seconds histogram'
+        ]
+        _render_histogram(lines, 'workbench_request_duration_seconds',
+                          [({'route': route}, h) for route, h in sorted(_requests.items())])
+        lines += [
+            '# HELP workbench_requests_total Requests by route and response status.',
+            '# TYPE workbench_requests_total counter'
+        ]
+        for (route, status), count in sorted(_request_counts.items()):
+            lines.append(f'workbench_requests_total{{{_labels(route=route, status=status)}}} {count}')
+        lines += [
+            '# HELP workbench_stage_duration_seconds Time spent in each stage of a request, per request.',
+            '# TYPE workbench_stage_duration_seconds histogram'
+        ]
+        _render_histogram(lines, 'workbench_stage_duration_seconds',
+                          [({'route': route, 'stage': name}, h) for (route, name), h in sorted(_stages.items())])
+        lines += [
+            '# HELP workbench_stage_calls_total Times each stage ran.',
+            '# TYPE workbench_stage_calls_total counter'
+        ]
+        for (route, name), count in sorted(_stage_calls.items()):
+            lines.append(f'workbench_stage_calls_total{{{_labels(route=route, stage=name)}}} {count}')
+    for collect in _collectors:
+        for name, kind, help_text, samples in collect():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for labels, value in samples:
+                lines.append(f'{name}{{{_labels(**labels)}}} {value}' if labels else f'{name} {value}')
+    return '\n'.join(lines) + '\n'
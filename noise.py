@@ -0,0 +1,104 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+import statevector
+
+# T1/T2 decoherence on the physical instruction stream. every step is its ideal gate followed by
+# amplitude and phase damping on every qubit for the step's duration, so virtual Z rotations add
+# no noise. quantum trajectories evolve thousands of stochastic pure states together as one
+# (T, 2**n) array; the density-matrix path is exact and cheap for two qubits.
+# steps are (gate, targets, duration) with targets as in statevector.py
+
+PAULIS = (
+    np.array([[0, 1], [1, 0]], dtype=complex),
+    np.array([[0, -1j], [1j, 0]], dtype=complex),
+    np.array([[1, 0], [0, -1]], dtype=complex)
+)
+
+
+@dataclass
+class noise_model:
+    # seconds per qubit, q0 first. t1 = inf switches amplitude damping off, t2 = 2*t1 leaves
+    # only the dephasing that amplitude damping brings with it
+    t1: list
+    t2: list
+
+    def __post_init__(self):
+        for t1, t2 in zip(self.t1, self.t2):
+            if t1 <= 0 or t2 <= 0:
+                raise ValueError("T1 and T2 must be positive")
+            if t2 > 2 * t1:
+                raise ValueError("T2 can't be longer than 2*T1")
+
+    def channels(self, qubit, duration):
+        # kraus sets acting on one qubit over duration seconds. amplitude damping alone already
+        # dephases at 1/(2 T1), the phase damping adds the rest of 1/T2
+        t1, t2 = self.t1[qubit], self.t2[qubit]
+        gamma = 1 - np.exp(-duration / t1)
+        lam = 1 - np.exp(-2 * duration * (1 / t2 - 1 / (2 * t1)))
+        amplitude = [np.array([[1, 0], [0, np.sqrt(1 - gamma)]], dtype=complex),
+                     np.array([[0, np.sqrt(gamma)], [0, 0]], dtype=complex)]
+        phase = [np.array([[1, 0], [0, np.sqrt(1 - lam)]], dtype=complex),
+                 np.array([[0, 0], [0, np.sqrt(lam)]], dtype=complex)]
+        return [amplitude, phase]
+
+
+def _unravel(states, kraus, qubit, rng):
+    # one stochastic kraus branch per trajectory, picked with its born probability
+    branches = np.stack([statevector.apply_gate(states, K, [qubit]) for K in kraus], axis=1)
+    cumulative = np.cumsum(np.sum(np.abs(branches)**2, axis=-1), axis=-1)
+    draws = rng.random(len(states)) * cumulative[:, -1]
+    choice = np.minimum(np.sum(draws[:, None] >= cumulative, axis=-1), len(kraus) - 1)
+    return statevector.normalize(branches[np.arange(len(states)), choice]), choice
+
+
+def simulate_trajectories(steps, initial, model, trajectories, rng):
+    n = statevector.num_qubits(initial)
+    ideal = initial[None, :]
+    states = np.repeat(ideal, trajectories, axis=0)
+    step_fidelities = []
+    jumps = 0
+    for gate, targets, duration in steps:
+        states = statevector.apply_gate(states, gate, targets)
+        ideal = statevector.apply_gate(ideal, gate, targets)
+        if duration > 0:
+            for qubit in range(n):
+                for kraus in model.channels(qubit, duration):
+                    states, choice = _unravel(states, kraus, qubit, rng)
+                    jumps += int(np.count_nonzero(choice))
+        step_fidelities.append(float(np.mean(np.abs(states @ ideal[0].conj())**2)))
+    fidelities = np.abs(states @ ideal[0].conj())**2
+    return {
+        'trajectories': trajectories,
+        'fidelity': float(fidelities.mean()),
+        'fidelity_stderr': float(fidelities.std() / np.sqrt(trajectories)),
+        'step_fidelities': step_fidelities,
+        'jumps': jumps,
+        'bloch_vectors': [statevector.bloch_vectors(states, q).mean(axis=0).tolist() for q in range(n)]
+    }
+
+
+def simulate_density_matrix(steps, initial, model):
+    n = statevector.num_qubits(initial)
+    ideal = initial[None, :]
+    rho = np.outer(initial, initial.conj())
+    step_fidelities = []
+    for gate, targets, duration in steps:
+        U = statevector.embed(gate, targets, n)
+        rho = U @ rho @ U.conj().T
+        ideal = statevector.apply_gate(ideal, gate, targets)
+        if duration > 0:
+            for qubit in range(n):
+                for kraus in model.channels(qubit, duration):
+                    embedded = [statevector.embed(K, [qubit], n) for K in kraus]
+                    rho = sum(K @ rho @ K.conj().T for K in embedded)
+        step_fidelities.append(float((ideal[0].conj() @ rho @ ideal[0]).real))
+    bloch = [[float(np.trace(rho @ statevector.embed(P, [q], n)).real) for P in PAULIS] for q in range(n)]
+    return {
+        'fidelity': step_fidelities[-1] if step_fidelities else 1.0,
+        'step_fidelities': step_fidelities,
+        'purity': float(np.trace(rho @ rho).real),
+        'bloch_vectors': bloch,
+        'density_matrix': rho
+    }
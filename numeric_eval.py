@@ -0,0 +1,174 @@
+import cmath
+import math
+import re
+
+# direct complex evaluator for the small language the workbench inputs use
+# (numbers, I, E, pi, sqrt/exp/trig/log and arithmetic). it runs on the output of
+# expressions.normalize_expression, so it follows the same parse rules as sympy:
+# ** is right associative, binds tighter than unary minus, and juxtaposition is
+# multiplication. anything else raises UnsupportedExpression and the caller falls
+# back to sympy.
+
+
+class UnsupportedExpression(Exception):
+    pass
+
+
+CONSTANTS = {
+    'I': 1j,
+    'E': math.e,
+    'pi': math.pi,
+}
+
+FUNCTIONS = {
+    'sqrt': cmath.sqrt,
+    'exp': cmath.exp,
+    'log': cmath.log,
+    'ln': cmath.log,
+    'sin': cmath.sin,
+    'cos': cmath.cos,
+    'tan': cmath.tan,
+    'sinh': cmath.sinh,
+    'cosh': cmath.cosh,
+    'tanh': cmath.tanh,
+}
+
+TOKEN_RE = re.compile(r'\s*(?:(\d+\.?\d*(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)|([A-Za-z_]\w*)|(\*\*|[+\-*/()]))')
+
+# float noise below this (scaled by max(1, |z|)) is snapped to zero, so cos(pi/2) reads 0
+SNAP_TOL = 1e-14
+
+
+def tokenize(expr_str):
+    tokens = []
+    pos = 0
+    expr_str = expr_str.rstrip()
+    while pos < len(expr_str):
+        match = TOKEN_RE.match(expr_str, pos)
+        if not match:
+            raise UnsupportedExpression(f"Unexpected character at {pos}: {expr_str[pos]!r}")
+        number, name, op = match.groups()
+        if number is not None:
+            tokens.append(('num', float(number)))
+        elif name is not None:
+            tokens.append(('name', name))
+        else:
+            tokens.append(('op', op))
+        pos = match.end()
+    return tokens
+
+
+def _clear_signed_zero(value):
+    # -1 parses as -(1+0j) = (-1-0j), which would put sqrt/log/pow on the wrong side
+    # of the branch cut compared to sympy
+    return value + 0j
+
+
+class _Parser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def expect(self, op):
+        if self.take() != ('op', op):
+            raise UnsupportedExpression(f"Expected {op!r}")
+
+    def starts_atom(self):
+        kind, value = self.peek()
+        return kind in ('num', 'name') or (kind, value) == ('op', '(')
+
+    def parse(self):
+        if not self.tokens:
+            raise UnsupportedExpression("Empty expression")
+        value = self.expr()
+        if self.pos != len(self.tokens):
+            raise UnsupportedExpression("Trailing input")
+        return value
+
+    def expr(self):
+        value = self.term()
+        while self.peek() in (('op', '+'), ('op', '-')):
+            _, op = self.take()
+            rhs = self.term()
+            value = value + rhs if op == '+' else value - rhs
+        return value
+
+    def term(self):
+        value = self.unary()
+        while True:
+            if self.peek() == ('op', '*'):
+                self.take()
+                value = value * self.unary()
+            elif self.peek() == ('op', '/'):
+                self.take()
+                value = value / self.unary()
+            elif self.starts_atom():
+                # implicit multiplication, e.g. 2pi or (1+I)(1-I)
+                value = value * self.power()
+            else:
+                return value
+
+    def unary(self):
+        if self.peek() == ('op', '-'):
+            self.take()
+            return -self.unary()
+        if self.peek() == ('op', '+'):
+            self.take()
+            return self.unary()
+        return self.power()
+
+    def power(self):
+        base = self.atom()
+        if self.peek() == ('op', '**'):
+            self.take()
+            exponent = self.unary()
+            return _clear_signed_zero(base) ** exponent
+        return base
+
+    def atom(self):
+        kind, value = self.take()
+        if kind == 'num':
+            return complex(value)
+        if kind == 'name':
+            if value in CONSTANTS:
+                return complex(CONSTANTS[value])
+            if value in FUNCTIONS:
+                # sympy also accepts "sqrt 2", leave that to the fallback
+                if self.peek() != ('op', '('):
+                    raise UnsupportedExpression(f"Function {value} without parentheses")
+                self.take()
+                arg = self.expr()
+                self.expect(')')
+                return complex(FUNCTIONS[value](_clear_signed_zero(arg)))
+            raise UnsupportedExpression(f"Unknown name {value}")
+        if (kind, value) == ('op', '('):
+            inner = self.expr()
+            self.expect(')')
+            return inner
+        raise UnsupportedExpression(f"Unexpected token {value!r}")
+
+
+def snap(value):
+    scale = SNAP_TOL * max(1.0, abs(value))
+    real = 0.0 if abs(value.real) < scale else value.real
+    imag = 0.0 if abs(value.imag) < scale else value.imag
+    return complex(real, imag)
+
+
+def evaluate_numeric(normalized):
+    try:
+        value = _Parser(tokenize(normalized)).parse()
+    except (ZeroDivisionError, OverflowError, ValueError) as e:
+        # let sympy decide how to report these
+        raise UnsupportedExpression(str(e))
+    if not (math.isfinite(value.real) and math.isfinite(value.imag)):
+        raise UnsupportedExpression("Non-finite value")
+    return snap(value)
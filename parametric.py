@@ -0,0 +1,70 @@
+import hashlib
+import json
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+
+import config
+from cache import LRUCache
+from expressions import normalize_expression, sympy_parse, run_sympy, run_inline
+
+# compiled parametric gates, keyed by handle. the handle is a hash of the normalized
+# matrix, so resubmitting the same matrix gives back the same handle
+parametric_cache = LRUCache(config.PARAMETRIC_CACHE_SIZE)
+
+
+@dataclass
+class parametric_gate:
+    handle: str
+    parameters: list
+    func: Any
+    size: int
+
+    def evaluate(self, values):
+        # values maps parameter name -> scalar or array, arrays broadcast against each other
+        missing = [p for p in self.parameters if p not in values]
+        if missing:
+            raise ValueError(f"Missing values for parameters: {', '.join(missing)}")
+        args = [np.asarray(values[p], dtype=complex) for p in self.parameters]
+        shape = np.broadcast_shapes(*(a.shape for a in args)) if args else ()
+        points = int(np.prod(shape))
+        if points > config.PARAMETRIC_MAX_POINTS:
+            raise ValueError(f"Values broadcast to {points} points, the limit is {config.PARAMETRIC_MAX_POINTS}")
+        entries = self.func(*args)
+        stacked = np.stack([np.broadcast_to(np.asarray(e, dtype=complex), shape) for e in entries], axis=-1)
+        unitaries = stacked.reshape(shape + (self.size, self.size))
+        if not np.all(np.isfinite(unitaries)):
+            raise ValueError("Matrix is not finite for the given parameter values")
+        return unitaries
+
+
+def check_entries(normalized):
+    for row in normalized:
+        for e in row:
+            sympy_parse(e)
+
+
+def build_parametric(handle, normalized, runner):
+    from sympy import lambdify
+
+    # parsing can blow up (9^9^9^9 is evaluated), so it's tried through the sympy runner first.
+    # the lambdified function doesn't pickle, the real compile has to happen in this process
+    run_sympy(runner, check_entries, normalized)
+    entries = [sympy_parse(e) for row in normalized for e in row]
+    symbols = sorted(set().union(*(e.free_symbols for e in entries)), key=lambda s: s.name)
+    # one vectorized numpy callable returning all entries, constants come back as scalars
+    func = lambdify(symbols, entries, modules='numpy')
+    return parametric_gate(handle, [s.name for s in symbols], func, len(normalized))
+
+
+def compile_parametric(matrix_expressions, runner=run_inline):
+    if len(matrix_expressions) != 4 or any(len(row) != 4 for row in matrix_expressions):
+        raise ValueError("Parametric gates must be 4x4")
+    normalized = [[normalize_expression(e) for e in row] for row in matrix_expressions]
+    handle = hashlib.sha1(json.dumps(normalized).encode()).hexdigest()[:16]
+    return parametric_cache.get_or_compute(handle, lambda: build_parametric(handle, normalized, runner))
+
+
+def get_parametric(handle):
+    return parametric_cache.get(handle)
@@ -0,0 +1,464 @@
+import sys
+
+import numpy as np
+
+import config
+import metrics
+import profiling
+import wire
+from expressions import evaluate_expression, expression_cache
+from state_engine import states_from_json, normalize, relative_phases, state_results
+
+# request handling shared by the flask routes and the batch worker processes. decomposition
+# (and with it qiskit) is only imported by the functions that need it
+
+
+def cache_stats():
+    # this process's caches. the work pool's reporter, so /cache_stats can add the workers' up.
+    # the decomposition and parametric stacks aren't imported just to report an empty cache
+    stats = {'expression': expression_cache.stats()}
+    if 'parametric' in sys.modules:
+        from parametric import parametric_cache
+        stats['parametric'] = parametric_cache.stats()
+    if 'decomposition' in sys.modules:
+        from decomposition import decomposition_cache
+        stats['decomposition'] = decomposition_cache.stats()
+    return stats
+
+
+def merge_cache_stats(reports):
+    # cache_stats() of several processes, counts and sizes summed. maxsize and ttl are per process
+    merged = {}
+    for report in reports:
+        for name, stats in report.items():
+            total = merged.setdefault(name, {'size': 0, 'maxsize': stats['maxsize'], 'ttl': stats['ttl'], 'hits': 0,
+                                             'misses': 0, 'evictions': 0, 'expirations': 0, 'processes': 0})
+            for key in ('size', 'hits', 'misses', 'evictions', 'expirations'):
+                total[key] += stats[key]
+            total['processes'] += 1
+    return merged
+
+
+def parse_entry(entry):
+    # expression strings as typed in the UI, or {'re', 'im'} / plain numbers from scripts
+    if isinstance(entry, dict):
+        return complex(entry['re'], entry['im'])
+    if isinstance(entry, (int, float)):
+        return complex(entry)
+    return evaluate_expression(entry).value
+
+
+def parse_matrix(matrix_entries):
+    if wire.is_packed(matrix_entries):
+        return wire.unpack(matrix_entries)
+    return np.array([[parse_entry(entry) for entry in row] for row in matrix_entries], dtype=complex)
+
+
+def request_matrix(data):
+    # the body's 'matrix', or the unitary of a named library gate given as 'gate' instead
+    if data.get('matrix') is None and data.get('gate') is not None:
+        import gate_library
+        return gate_library.named_unitary(data['gate'])
+    return parse_matrix(data['matrix'])
+
+
+def is_unitary_matrix(matrix):
+    return matrix.ndim == 2 and matrix.shape[0] == matrix.shape[1] and np.allclose(matrix @ matrix.conj().T, np.identity(matrix.shape[0]), atol=1e-10)
+
+
+def rparams_from_request(data):
+    from decomposition import relevant_parameters
+
+    rabi_frequency = float(data.get('rabi_frequency', 20e6))
+    q0drive_freq = float(data.get('q0drive_freq', 5.3e9))
+    q1drive_freq = float(data.get('q1drive_freq', 5e9))
+    coupling_strength = float(data.get('coupling_strength', 10e6))
+
+    # phases, sometimes set from state
+    q0current_relative_phase = 0.0
+    q1current_relative_phase = 0.0
+    if 'state_vector' in data:
+        states = normalize(states_from_json([data['state_vector']]))
+        q0_phases, q1_phases = relative_phases(states)
+        q0current_relative_phase = float(q0_phases[0])
+        q1current_relative_phase = float(q1_phases[0])
+
+    return relevant_parameters(
+        rabi_frequency=rabi_frequency,
+        q0drive_freq=q0drive_freq,
+        q1drive_freq=q1drive_freq,
+        q0current_relative_phase=q0current_relative_phase,
+        q1current_relative_phase=q1current_relative_phase,
+        coupling_strength=coupling_strength
+    )
+
+
+def instructions_to_json(instructionset):
+    instructions_json = []
+    for instr in instructionset:
+        instructions_json.append({
+            'code': instr.code,
+            'title': instr.title,
+            'tag': instr.tag,
+            'instruction_string': instr.instruction_string,
+            'details': instr.details,
+            'angle': float(instr.angle) if instr.angle is not None else None,
+            'underlying_gate': np.asarray(instr.underlying_gate, dtype=complex)
+        })
+    return instructions_json
+
+
+def cumulative_unitaries(instructionset):
+    # (N, 4, 4) products U_k = G_k ... G_1, built once per decomposition
+    cumulative = np.empty((len(instructionset), 4, 4), dtype=complex)
+    acc = np.identity(4, dtype=complex)
+    for k, instr in enumerate(instructionset):
+        acc = np.asarray(instr.underlying_gate, dtype=complex) @ acc
+        cumulative[k] = acc
+    return cumulative
+
+
+def execute_instructions(instructionset, state_vector=None):
+    # the state after every instruction, starting from state_vector (|00> when not given)
+    if state_vector is None:
+        initial = np.array([1, 0, 0, 0], dtype=complex)
+    else:
+        initial = states_from_json([state_vector])[0]
+    if not instructionset:
+        return []
+    states = cumulative_unitaries(instructionset) @ initial
+    return state_results(states)
+
+
+def pulse_trajectories(instructionset, rparams, data):
+    # bloch trajectories sampled through every instruction, for animating the circuit in one call
+    import pulses
+
+    samples = int(data['trajectory_samples'])
+    if not 2 <= samples <= config.PULSE_MAX_SAMPLES:
+        raise ValueError(f"trajectory_samples must be between 2 and {config.PULSE_MAX_SAMPLES}")
+    if data.get('state_vector') is None:
+        initial = np.array([1, 0, 0, 0], dtype=complex)
+    else:
+        initial = normalize(states_from_json([data['state_vector']]))[0]
+    return pulses.circuit_trajectory(instructionset, rparams, initial, samples)
+
+
+def approximation_from_request(data):
+    # (basis_fidelity, target_fidelity) for approximate synthesis, None for an exact circuit
+    fidelities = []
+    for key in ('basis_fidelity', 'target_fidelity'):
+        value = data.get(key)
+        if value is not None:
+            value = float(value)
+            if not 0 < value <= 1:
+                raise ValueError(f"{key} must be in (0, 1]")
+        fidelities.append(value)
+    return None if fidelities == [None, None] else tuple(fidelities)
+
+
+def synthesis_json(qcircuit, instructionset, exact_instructionset, basis_fidelity):
+    # what approximate synthesis gave up and what it saved against the exact circuit
+    duration = sum(instr.duration for instr in instructionset)
+    exact_duration = sum(instr.duration for instr in exact_instructionset)
+    return {
+        'iswap_count': qcircuit.num_basis_gates,
+        'exact_iswap_count': qcircuit.exact_basis_gates,
+        'fidelity': qcircuit.fidelity,
+        'expected_fidelity': qcircuit.fidelity * (basis_fidelity or 1.0) ** qcircuit.num_basis_gates,
+        'duration': duration,
+        'exact_duration': exact_duration,
+        'duration_saved': exact_duration - duration
+    }
+
+
+def exact_synthesis_json(matrix, mode, data, qcircuit, instructionset, approximation):
+    # synthesis_json against the exact circuit for the same matrix and drive parameters
+    from decomposition import decompose_gate_cached, InstructionSet
+
+    exact_RM, exact_tags, exact_qcircuit = decompose_gate_cached(matrix, mode)
+    exact_instructionset, _ = InstructionSet(exact_RM, exact_tags, mode, rparams_from_request(data), exact_qcircuit)
+    return synthesis_json(qcircuit, instructionset, exact_instructionset, approximation[0])
+
+
+def schedule_json(schedule):
+    return {
+        'instructions': instructions_to_json(schedule['instructions']),
+        'starts': schedule['starts'],
+        'durations': [instr.duration for instr in schedule['instructions']],
+        'total_duration': schedule['total_duration'],
+        'sequential_duration': schedule['sequential_duration'],
+        'original_count': schedule['original_count'],
+        'unitary_error': schedule['unitary_error']
+    }
+
+
+def decompose_request(data, mode="iSwap"):
+    # the /decompose body, run in the work pool. a non-unitary matrix is reported, not raised
+    from decomposition import decompose_gate_cached, InstructionSet
+
+    # parse matrix expressions
+    with metrics.stage('parse'):
+        matrix = request_matrix(data)
+
+    profiling.trace('decompose_matrix', matrix=matrix)
+
+    with metrics.stage('unitarity_check'):
+        unitary = is_unitary_matrix(matrix)
+    if not unitary:
+        return {'success': False, 'error': 'Matrix is not unitary', 'is_unitary': False}
+
+    rparams = rparams_from_request(data)
+    approximation = approximation_from_request(data)
+
+    with metrics.stage('decompose'):
+        RM, tags, qcircuit = decompose_gate_cached(matrix, mode, approximation)
+    with metrics.stage('instruction_set'):
+        instructionset, final_rparams = InstructionSet(RM, tags, mode, rparams, qcircuit)
+
+    with metrics.stage('instructions_json'):
+        instructions_json = instructions_to_json(instructionset)
+
+    result = {
+        'success': True,
+        'message': 'Matrix is unitary',
+        'is_unitary': True,
+        'instructions': instructions_json
+    }
+
+    if approximation is not None:
+        with metrics.stage('exact_comparison'):
+            result['synthesis'] = exact_synthesis_json(matrix, mode, data, qcircuit, instructionset, approximation)
+
+    # run the whole instruction list on the current state, states[k] is the state after instruction k
+    if data.get('execute', False):
+        with metrics.stage('execute'):
+            result['states'] = execute_instructions(instructionset, data.get('state_vector'))
+    # the same circuit as a timed schedule with virtual Z's fused and parallel pulses
+    if data.get('optimize', False):
+        import scheduler
+        with metrics.stage('optimize'):
+            result['schedule'] = schedule_json(scheduler.optimize_schedule(instructionset, rparams_from_request(data), mode))
+    if data.get('trajectory_samples'):
+        with metrics.stage('pulse_trajectories'):
+            result['trajectories'] = pulse_trajectories(instructionset, final_rparams, data)
+    return result
+
+
+# hardware parameters /sweep_schedule can take a list of values for, in grid axis order
+SWEEP_PARAMETERS = ('rabi_frequency', 'q0drive_freq', 'q1drive_freq', 'q0current_relative_phase', 'q1current_relative_phase', 'coupling_strength')
+
+
+# rates that set pulse lengths, durations are 1/rate so they have to be positive
+SWEEP_POSITIVE = ('rabi_frequency', 'coupling_strength')
+
+
+def sweep_grid(data):
+    # every list-valued parameter is a grid axis, the rest are fixed at the value given or the
+    # /decompose default. returns the axes and {parameter: scalar or open-grid array}, each axis
+    # array has length 1 along the other axes
+    defaults = rparams_from_request({key: value for key, value in data.items() if key not in SWEEP_PARAMETERS})
+    axes = []
+    values = {}
+    for name in SWEEP_PARAMETERS:
+        given = data.get(name)
+        if isinstance(given, list):
+            given = np.asarray(given, dtype=float)
+            if given.ndim != 1:
+                raise ValueError(f"{name} must be a flat list of values")
+            if not len(given):
+                raise ValueError(f"{name} has no values to sweep")
+            axes.append((name, given))
+        else:
+            given = np.asarray(float(given) if given is not None else getattr(defaults, name))
+            values[name] = float(given)
+        if not np.all(np.isfinite(given)):
+            raise ValueError(f"{name} must be finite")
+        if name in SWEEP_POSITIVE and not np.all(given > 0):
+            raise ValueError(f"{name} must be positive")
+    points = int(np.prod([len(v) for _, v in axes]))
+    if points > config.SWEEP_MAX_POINTS:
+        raise ValueError(f"Sweep has {points} grid points, the limit is {config.SWEEP_MAX_POINTS}")
+    for (name, _), grid in zip(axes, np.meshgrid(*[v for _, v in axes], indexing='ij', sparse=True)):
+        values[name] = grid
+    return axes, values
+
+
+def sweep_schedule_request(data, mode="iSwap"):
+    # /sweep_schedule, run in the work pool: one decomposition, then the schedule's timings and
+    # phases over the whole parameter grid at once
+    from decomposition import decompose_gate_cached, decomposition_steps, schedule_arrays
+
+    with metrics.stage('parse'):
+        matrix = request_matrix(data)
+        axes, values = sweep_grid(data)
+    if not is_unitary_matrix(matrix):
+        return {'success': False, 'error': 'Matrix is not unitary', 'is_unitary': False}
+
+    with metrics.stage('decompose'):
+        RM, tags, qcircuit = decompose_gate_cached(matrix, mode)
+        steps = decomposition_steps(RM, tags, qcircuit)
+    with metrics.stage('schedule'):
+        schedule = schedule_arrays(steps, **values)
+
+    result = {
+        'success': True,
+        'is_unitary': True,
+        'codes': ["ISWAP" if code == "ENTANGLE" else code for code, tag, angle in steps],
+        'tags': [tag for code, tag, angle in steps],
+        'angles': [angle for code, tag, angle in steps],
+        'axes': [{'name': name, 'values': v} for name, v in axes],
+        'shape': [len(v) for _, v in axes]
+    }
+    # arrays have length 1 on the axes they don't depend on and broadcast against 'shape'
+    result.update({key: np.array(array) for key, array in schedule.items()})
+    return result
+
+
+def noise_model_from_request(data):
+    import noise
+
+    def per_qubit(key, default):
+        # one value for both qubits or [q0, q1]
+        values = data.get(key, default)
+        if not isinstance(values, list):
+            values = [values, values]
+        if len(values) != 2:
+            raise ValueError(f"{key} must be a number or one value per qubit")
+        return values
+
+    # null T1 is no energy decay, null T2 no dephasing beyond what T1 brings (T2 = 2*T1)
+    t1 = [float('inf') if v is None else float(v) for v in per_qubit('t1', 50e-6)]
+    t2 = [2 * t1_q if v is None else float(v) for v, t1_q in zip(per_qubit('t2', 70e-6), t1)]
+    return noise.noise_model(t1=t1, t2=t2)
+
+
+def simulate_noise_request(data, mode="iSwap"):
+    # /simulate_noise, run in the work pool: decompose like /decompose, then replay the instructions
+    # under T1/T2 damping for their durations
+    import noise
+    from decomposition import decompose_gate_cached, InstructionSet
+
+    with metrics.stage('parse'):
+        matrix = request_matrix(data)
+        model = noise_model_from_request(data)
+    if not is_unitary_matrix(matrix):
+        return {'success': False, 'error': 'Matrix is not unitary', 'is_unitary': False}
+    method = data.get('method', 'trajectories')
+    if method not in ('trajectories', 'density_matrix', 'both'):
+        raise ValueError("method must be trajectories, density_matrix or both")
+    trajectories = int(data.get('trajectories', 2000))
+    if not 1 <= trajectories <= config.NOISE_MAX_TRAJECTORIES:
+        raise ValueError(f"trajectories must be between 1 and {config.NOISE_MAX_TRAJECTORIES}")
+
+    approximation = approximation_from_request(data)
+    with metrics.stage('decompose'):
+        RM, tags, qcircuit = decompose_gate_cached(matrix, mode, approximation)
+    with metrics.stage('instruction_set'):
+        instructionset, final_rparams = InstructionSet(RM, tags, mode, rparams_from_request(data), qcircuit)
+
+    if 'state_vector' in data:
+        initial = normalize(states_from_json([data['state_vector']]))[0]
+    else:
+        initial = np.array([1, 0, 0, 0], dtype=complex)
+    if data.get('optimize', False):
+        # the optimized schedule, parallel pulses share their decoherence time
+        import scheduler
+        with metrics.stage('optimize'):
+            schedule = scheduler.optimize_schedule(instructionset, rparams_from_request(data), mode)
+        instructionset = schedule['instructions']
+        steps = scheduler.noise_steps(instructionset, schedule['starts'], schedule['total_duration'])
+        total_duration = schedule['total_duration']
+    else:
+        steps = [(np.asarray(instr.underlying_gate, dtype=complex), (1, 0), instr.duration) for instr in instructionset]
+        total_duration = float(sum(instr.duration for instr in instructionset))
+    result = {
+        'success': True,
+        'is_unitary': True,
+        'codes': [instr.code for instr in instructionset],
+        'durations': [instr.duration for instr in instructionset],
+        'total_duration': total_duration
+    }
+    if approximation is not None:
+        # the simulated fidelities are to the approximate circuit, this is how far that is from the target
+        result['synthesis_fidelity'] = qcircuit.fidelity
+    if method in ('trajectories', 'both'):
+        # hand back the seed actually used so any run can be replayed
+        seed = data['seed'] if data.get('seed') is not None else int(np.random.SeedSequence().entropy % 2**63)
+        with metrics.stage('trajectories'):
+            result['trajectories'] = noise.simulate_trajectories(steps, initial, model, trajectories, np.random.default_rng(seed))
+        result['trajectories']['seed'] = seed
+    if method in ('density_matrix', 'both'):
+        with metrics.stage('density_matrix'):
+            result['density_matrix'] = noise.simulate_density_matrix(steps, initial, model)
+    return result
+
+
+def decompose_unitaries(unitaries, is_unitary, data, mode="iSwap"):
+    # /evaluate_parametric's decompositions, run in the work pool. None for the non-unitary entries
+    from decomposition import decompose_gates_cached, InstructionSet
+
+    unitaries_only = [U for U, unitary in zip(unitaries, is_unitary) if unitary]
+    synthesized = iter(decompose_gates_cached(unitaries_only, mode) if unitaries_only else [])
+    decompositions = []
+    for unitary in is_unitary:
+        if not unitary:
+            decompositions.append(None)
+            continue
+        RM, tags, qcircuit = next(synthesized)
+        instructionset, final_rparams = InstructionSet(RM, tags, mode, rparams_from_request(data), qcircuit)
+        decompositions.append(instructions_to_json(instructionset))
+    return decompositions
+
+
+def decompose_item(index, item, mode="iSwap"):
+    # one /decompose_batch entry, errors are reported per item instead of failing the batch
+    try:
+        from decomposition import decompose_gate_cached, InstructionSet
+
+        matrix = request_matrix(item)
+        if not is_unitary_matrix(matrix):
+            return {'index': index, 'success': False, 'error': 'Matrix is not unitary', 'is_unitary': False}
+        approximation = approximation_from_request(item)
+        RM, tags, qcircuit = decompose_gate_cached(matrix, mode, approximation)
+        instructionset, final_rparams = InstructionSet(RM, tags, mode, rparams_from_request(item), qcircuit)
+        result = {'index': index, 'success': True, 'is_unitary': True, 'instructions': instructions_to_json(instructionset)}
+        if approximation is not None:
+            result['synthesis'] = exact_synthesis_json(matrix, mode, item, qcircuit, instructionset, approximation)
+        if item.get('execute', False):
+            result['states'] = execute_instructions(instructionset, item.get('state_vector'))
+        if item.get('trajectory_samples'):
+            result['trajectories'] = pulse_trajectories(instructionset, final_rparams, item)
+        return result
+    except Exception as e:
+        return {'index': index, 'success': False, 'error': str(e)}
+
+
+def prefetch_decompositions(items, mode="iSwap"):
+    # synthesize every valid matrix of a chunk in one batch per approximation so decompose_item only
+    # hits the cache. approximate items need their exact circuit too, for the synthesis report.
+    # bad items are skipped here and reported by decompose_item
+    from decomposition import decompose_gates_cached
+
+    groups = {}
+    for item in items:
+        try:
+            matrix = request_matrix(item)
+            approximation = approximation_from_request(item)
+        except Exception:
+            continue
+        if is_unitary_matrix(matrix) and matrix.shape == (4, 4):
+            groups.setdefault(approximation, []).append(matrix)
+            if approximation is not None:
+                groups.setdefault(None, []).append(matrix)
+    for approximation, matrices in groups.items():
+        decompose_gates_cached(matrices, mode, approximation)
+
+
+def decompose_chunk(start, items):
+    try:
+        prefetch_decompositions(items)
+    except Exception:
+        # fall back to decomposing item by item, which reports the error against the right index
+        pass
+    return [decompose_item(start + offset, item) for offset, item in enumerate(items)]
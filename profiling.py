@@ -0,0 +1,197 @@
+import cProfile
+import io
+import ipaddress
+import json
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+import uuid
+
+import config
+
+# opt-in profiling of single requests, and the debug tracing that used to be print() calls.
+# a client on PROFILE_ALLOWLIST sends `X-Profile: 1` (or ?profile=1) and that one request runs
+# under cProfile, including whatever it hands to the work pool. the profile goes to
+# PROFILE_DIR as <request id>.prof (pstats format, for snakeviz & co) with a <request id>.json
+# next to it holding the route, status, timings and the request's trace events. only the newest
+# PROFILE_KEEP requests are kept.
+#
+# trace() events are logged on 'workbench.trace' at DEBUG, and kept with the profile when the
+# request is being profiled
+
+logger = logging.getLogger('workbench.trace')
+
+REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+_local = threading.local()
+_ring_lock = threading.Lock()
+
+
+def _allowlist():
+    entries = []
+    for entry in config.PROFILE_ALLOWLIST:
+        entries.append(entry if entry == '*' else ipaddress.ip_network(entry, strict=False))
+    return entries
+
+
+def allowed(remote_addr):
+    # the address flask sees, behind a proxy that's the proxy unless ProxyFix is set up
+    if not config.PROFILE_ALLOWLIST or remote_addr is None:
+        return False
+    try:
+        address = ipaddress.ip_address(remote_addr)
+    except ValueError:
+        return False
+    return any(entry == '*' or address in entry for entry in _allowlist())
+
+
+def request_id(given):
+    # the client's X-Request-ID when it's safe to use as a file name, a fresh one otherwise
+    if given and REQUEST_ID_RE.match(given) and given not in ('.', '..'):
+        return given
+    return uuid.uuid4().hex
+
+
+def tracing():
+    # whether trace() output goes anywhere, for callers whose fields are expensive to build
+    return getattr(_local, 'traces', None) is not None or logger.isEnabledFor(logging.DEBUG)
+
+
+def trace(event, **fields):
+    traces = getattr(_local, 'traces', None)
+    if traces is not None:
+        traces.append({'event': event, 'at_ms': (time.perf_counter() - _local.start) * 1e3,
+                       **{key: str(value) for key, value in fields.items()}})
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%s %s", event, ' '.join(f"{key}={value}" for key, value in fields.items()))
+
+
+def active():
+    return getattr(_local, 'profiler', None) is not None
+
+
+def begin(rid):
+    _local.rid = rid
+    _local.start = time.perf_counter()
+    _local.traces = []
+    _local.worker_stats = []
+    _local.profiler = cProfile.Profile()
+    _local.profiler.enable()
+
+
+class _Stats:
+    # pstats.Stats takes anything with create_stats() and a stats dict, so raw stats from a
+    # pool worker can be added without a round trip through a file
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def run_profiled(fn, *args):
+    # runs in a pool worker: fn(*args) under its own profiler. returns (result, raw stats, traces)
+    _local.start = time.perf_counter()
+    _local.traces = []
+    profiler = cProfile.Profile()
+    try:
+        result = profiler.runcall(fn, *args)
+    finally:
+        traces = _local.traces
+        _local.traces = None
+    profiler.create_stats()
+    return result, profiler.stats, traces
+
+
+def merge_worker(stats, traces):
+    # fold a pool worker's profile into the current request's
+    if not active():
+        return
+    _local.worker_stats.append(stats)
+    _local.traces.extend(dict(t, worker=True) for t in traces)
+
+
+def end(route, status, stages):
+    # stop profiling the current request and write it to the ring, returns its id
+    profiler = getattr(_local, 'profiler', None)
+    if profiler is None:
+        return None
+    profiler.disable()
+    _local.profiler = None
+    duration = time.perf_counter() - _local.start
+    rid, traces, worker_stats = _local.rid, _local.traces, _local.worker_stats
+    _local.traces = None
+
+    stats = pstats.Stats(profiler)
+    for worker in worker_stats:
+        stats.add(_Stats(worker))
+    summary = {
+        'request_id': rid,
+        'route': route,
+        'status': status,
+        'created': time.time(),
+        'duration_ms': duration * 1e3,
+        'stages_ms': {name: seconds * 1e3 for name, (seconds, calls) in stages.items()},
+        'traces': traces
+    }
+    with _ring_lock:
+        os.makedirs(config.PROFILE_DIR, exist_ok=True)
+        stats.dump_stats(os.path.join(config.PROFILE_DIR, rid + '.prof'))
+        with open(os.path.join(config.PROFILE_DIR, rid + '.json'), 'w') as f:
+            json.dump(summary, f)
+        _prune()
+    return rid
+
+
+def _prune():
+    profiles = sorted((entry for entry in os.scandir(config.PROFILE_DIR) if entry.name.endswith('.prof')),
+                      key=lambda entry: entry.stat().st_mtime)
+    for entry in profiles[:max(len(profiles) - config.PROFILE_KEEP, 0)]:
+        for path in (entry.path, entry.path[:-len('.prof')] + '.json'):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles():
+    # newest first, without the traces
+    summaries = []
+    if not os.path.isdir(config.PROFILE_DIR):
+        return summaries
+    for entry in os.scandir(config.PROFILE_DIR):
+        if not entry.name.endswith('.json'):
+            continue
+        try:
+            with open(entry.path) as f:
+                summary = json.load(f)
+        except (OSError, ValueError):
+            continue
+        summary.pop('traces', None)
+        summaries.append(summary)
+    return sorted(summaries, key=lambda s: s['created'], reverse=True)
+
+
+def profile_path(rid, suffix='.prof'):
+    # None for unknown or malformed ids
+    if not REQUEST_ID_RE.match(rid) or rid in ('.', '..'):
+        return None
+    path = os.path.join(config.PROFILE_DIR, rid + suffix)
+    return path if os.path.isfile(path) else None
+
+
+def summary(rid, top=40):
+    # the .json next to a profile plus its most expensive functions by cumulative time, as text
+    path = profile_path(rid, '.json')
+    stats_path = profile_path(rid)
+    if path is None or stats_path is None:
+        return None
+    with open(path) as f:
+        result = json.load(f)
+    stream = io.StringIO()
+    pstats.Stats(stats_path, stream=stream).sort_stats('cumulative').print_stats(top)
+    result['top_functions'] = stream.getvalue()
+    return result
@@ -0,0 +1,64 @@
+from functools import lru_cache
+
+import numpy as np
+
+import statevector
+
+# pulse-level time evolution of an instruction stream, for animating what the hardware does
+# rather than jumping between end-point unitaries. everything is in the frame the instructions'
+# underlying gates are written in: each qubit's rotating frame at its drive frequency with the
+# virtual Z phases already applied, so a drive is a constant Y Hamiltonian and the evolution over
+# an instruction ends exactly on its underlying gate. T sample times are evaluated together as a
+# (T, 4) array from closed-form exponentials, never by stepping
+
+PAULI_Y = np.array([[0, -1j], [1j, 0]], dtype=complex)
+PAULI_Z = np.array([[1, 0], [0, -1]], dtype=complex)
+
+
+@lru_cache(maxsize=None)
+def _coupling_eigensystem():
+    # H / g of the resonant exchange interaction, -(XX + YY), so exp(-iHt) is the iSwap at t = pi/(4g)
+    XX = np.kron([[0, 1], [1, 0]], [[0, 1], [1, 0]])
+    YY = np.kron(PAULI_Y, PAULI_Y)
+    energies, vectors = np.linalg.eigh(-(XX + YY).real)
+    return energies, vectors.astype(complex)
+
+
+def _rotate(state, pauli, tag, angles):
+    # exp(-i a P/2) on one qubit for every angle a: cos(a/2) psi - i sin(a/2) P psi
+    flipped = statevector.apply_gate(state[None, :], pauli, [tag])[0]
+    return np.cos(angles / 2)[:, None] * state - 1j * np.sin(angles / 2)[:, None] * flipped
+
+
+def propagate(instruction, rparams, state, samples):
+    # (times, states): the state at `samples` evenly spaced times over the instruction, both ends
+    # included. virtual Z rotations take no time, they're sampled along their rotation (every time
+    # 0) so the frame change can still be animated
+    fractions = np.linspace(0, 1, samples)
+    times = fractions * instruction.duration
+    if instruction.code == "RZ":
+        return times, _rotate(state, PAULI_Z, instruction.tag, fractions * instruction.angle)
+    if instruction.code == "RY":
+        # constant drive at the rabi frequency, the drive phase flips for negative angles
+        angles = np.sign(instruction.angle) * rparams.rabi_frequency * times
+        return times, _rotate(state, PAULI_Y, instruction.tag, angles)
+    if instruction.code == "ISWAP":
+        energies, vectors = _coupling_eigensystem()
+        phases = np.exp(-1j * rparams.coupling_strength * np.outer(times, energies))
+        return times, (phases * (vectors.conj().T @ state)) @ vectors.T
+    raise ValueError(f"No pulse model for {instruction.code} instructions")
+
+
+def circuit_trajectory(instructionset, rparams, initial, samples):
+    # times (N, T) in seconds from the start of the circuit and Bloch vectors (N, T, 2, 3), q0 first
+    times = np.empty((len(instructionset), samples))
+    bloch = np.empty((len(instructionset), samples, 2, 3))
+    state = initial
+    start = 0.0
+    for k, instr in enumerate(instructionset):
+        local_times, states = propagate(instr, rparams, state, samples)
+        times[k] = start + local_times
+        bloch[k] = np.stack([statevector.bloch_vectors(states, q) for q in (0, 1)], axis=1)
+        state = states[-1]
+        start += instr.duration
+    return {'times': times, 'bloch_vectors': bloch}
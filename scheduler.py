@@ -0,0 +1,116 @@
+import numpy as np
+
+# InstructionSet emits one instruction at a time. this pass turns its output into a timed
+# schedule for the hardware:
+#   - virtual Z rotations are pushed to the right and fused. through an iSwap a Z rotation
+#     moves to the other qubit, iSwap (Rz(a) x Rz(b)) = (Rz(b) x Rz(a)) iSwap
+#   - angles are wrapped into (-pi, pi] and rotations that are left doing nothing are dropped
+#   - Y rotations that end up next to each other on a qubit are merged
+#   - every instruction starts as soon as its qubits are free, so Y pulses on the two drive
+#     lines run in parallel
+# the rewritten circuit equals the original up to a global phase, which is checked
+
+TOL = 1e-9
+
+
+class ScheduleError(RuntimeError):
+    # an optimized schedule that doesn't do what the original instructions did
+    pass
+
+
+def _wrap(angle):
+    # into (-pi, pi], a full turn of a single-qubit rotation is only a sign
+    return angle - 2 * np.pi * np.ceil((angle - np.pi) / (2 * np.pi))
+
+
+def instruction_steps(instructionset):
+    # back to the (code, tag, angle) steps of decomposition.gate_steps
+    return [("ENTANGLE", 2, None) if instr.code == "ISWAP" else (instr.code, instr.tag, instr.angle) for instr in instructionset]
+
+
+def rewrite_steps(steps):
+    out = []
+    pending = [0.0, 0.0]
+
+    def flush(q):
+        angle = _wrap(pending[q])
+        pending[q] = 0.0
+        if abs(angle) > TOL:
+            out.append(("RZ", q, angle))
+
+    for code, tag, angle in steps:
+        if code == "RZ":
+            pending[tag] += angle
+        elif code == "ENTANGLE":
+            pending.reverse()
+            out.append((code, tag, angle))
+        else:
+            flush(tag)
+            # merge into the last instruction on this qubit when that's a Y rotation too
+            last = next((k for k in range(len(out) - 1, -1, -1) if out[k][1] in (tag, 2)), None)
+            if last is not None and out[last][0] == "RY":
+                angle += out.pop(last)[2]
+            angle = _wrap(angle)
+            if abs(angle) > TOL:
+                out.append((code, tag, angle))
+    flush(0)
+    flush(1)
+    return out
+
+
+def _qubits(instr):
+    return (0, 1) if instr.code == "ISWAP" else (instr.tag,)
+
+
+def timed_schedule(instructionset):
+    # as-soon-as-possible start time of every instruction, each qubit runs one thing at a time
+    free = [0.0, 0.0]
+    starts = []
+    for instr in instructionset:
+        qubits = _qubits(instr)
+        start = max(free[q] for q in qubits)
+        for q in qubits:
+            free[q] = start + instr.duration
+        starts.append(start)
+    return starts, max(free)
+
+
+def circuit_unitary(instructionset):
+    U = np.identity(4, dtype=complex)
+    for instr in instructionset:
+        U = np.asarray(instr.underlying_gate, dtype=complex) @ U
+    return U
+
+
+def phase_distance(A, B):
+    # 0 when A and B are the same unitary up to a global phase
+    return 1 - abs(np.trace(A.conj().T @ B)) / len(A)
+
+
+def optimize_schedule(instructionset, rparams, mode="iSwap"):
+    # rparams are the parameters the original list was built from, before InstructionSet advanced
+    # their phases. returns the new instruction list and its timing
+    from decomposition import instructions_from_steps
+
+    optimized, final_rparams = instructions_from_steps(rewrite_steps(instruction_steps(instructionset)), mode, rparams)
+    error = phase_distance(circuit_unitary(instructionset), circuit_unitary(optimized))
+    if not error < TOL:
+        raise ScheduleError(f"Optimized schedule differs from the original by {error}")
+    starts, total = timed_schedule(optimized)
+    return {
+        'instructions': optimized,
+        'starts': starts,
+        'total_duration': total,
+        'sequential_duration': float(sum(instr.duration for instr in instructionset)),
+        'original_count': len(instructionset),
+        'unitary_error': float(error)
+    }
+
+
+def noise_steps(instructionset, starts, total):
+    # noise.py steps for a timed schedule: every gate at its start time, then damping until the next
+    # instruction starts, so idle time and parallel pulses both cost what they should
+    order = sorted(range(len(instructionset)), key=lambda k: starts[k])
+    times = [starts[k] for k in order] + [total]
+    return [(np.asarray(instructionset[k].underlying_gate, dtype=complex), (1, 0), times[i + 1] - times[i])
+            for i, k in enumerate(order)]
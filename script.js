@@ -193,10 +193,11 @@ function createBlochSphere(containerId, phiSliderId, thetaSliderId) {
     // Public updater
     container.updateBloch = function(vec3, isSeparable = true) {
         if (isSeparable && vec3) {
-            // Show arrow, hide sphere
+            // Show arrow, hide sphere. Mixed (entangled) qubits get a shorter arrow
             arrow.visible = true;
             nonSeparableSphere.visible = false;
         arrow.setDirection(vec3.clone().normalize());
+        arrow.scale.setScalar(Math.min(vec3.length(), 1));
         } else {
             // Hide arrow, show sphere
             arrow.visible = false;
@@ -1741,8 +1742,8 @@ function updateQuantumState(data) {
     
     // Update Bloch spheres (handles both separable and non-separable)
     updateBlochSpheres(
-        data.is_separable && data.bloch_qubit1 ? data.bloch_qubit1 : null,
-        data.is_separable && data.bloch_qubit0 ? data.bloch_qubit0 : null,
+        data.bloch_qubit1 ? data.bloch_qubit1 : null,
+        data.bloch_qubit0 ? data.bloch_qubit0 : null,
         data.is_separable && data.qubit1_state ? data.qubit1_state : null,
         data.is_separable && data.qubit0_state ? data.qubit0_state : null,
         data.is_separable
@@ -1852,12 +1853,12 @@ function updateBlochSpheres(bloch1, bloch0, qubit1State, qubit0State, isSeparabl
     // Update Bloch sphere for qubit 1
     const container1 = document.getElementById('bloch-sphere-1');
     if (container1 && container1.updateBloch) {
-        if (isSeparable && bloch1) {
+        if (bloch1 && Math.hypot(...bloch1) > 1e-6) {
             // Transform from quantum convention [x, y, z] to THREE.js convention [x, z, -y]
             const vec1 = new THREE.Vector3(bloch1[0], bloch1[2], -bloch1[1]);
             container1.updateBloch(vec1, true);
         } else {
-            // Non-separable: show sphere, hide arrow
+            // Maximally entangled: show sphere, hide arrow
             container1.updateBloch(null, false);
         }
     }
@@ -1865,11 +1866,11 @@ function updateBlochSpheres(bloch1, bloch0, qubit1State, qubit0State, isSeparabl
     // Update Bloch sphere for qubit 0
     const container0 = document.getElementById('bloch-sphere-0');
     if (container0 && container0.updateBloch) {
-        if (isSeparable && bloch0) {
+        if (bloch0 && Math.hypot(...bloch0) > 1e-6) {
             const vec0 = new THREE.Vector3(bloch0[0], bloch0[2], -bloch0[1]);
             container0.updateBloch(vec0, true);
         } else {
-            // Non-separable: show sphere, hide arrow
+            // Maximally entangled: show sphere, hide arrow
             container0.updateBloch(null, false);
         }
     }
@@ -0,0 +1,144 @@
+import importlib
+import importlib.abc
+import json
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+import config
+
+# startup accounting: how long the heavy dependencies took to import, when they were
+# imported (at startup or lazily by a request) and the RSS afterwards. app.py installs
+# the import timer before anything else so the report covers flask/numpy too
+
+PROCESS_START = time.perf_counter()
+
+TIMED_MODULES = ('flask', 'numpy', 'scipy', 'sympy', 'qiskit', 'decomposition', 'parametric')
+
+_imports = {}
+_phases = {}
+_import_stack = []
+_ready_at = None
+
+
+def rss_bytes():
+    # current resident set size, falls back to the peak where /proc is missing
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class _TimedLoader(importlib.abc.Loader):
+    def __init__(self, loader, name):
+        self.loader = loader
+        self.name = name
+        self.start = None
+
+    def create_module(self, spec):
+        self.start = time.perf_counter()
+        _import_stack.append(self.name)
+        try:
+            return self.loader.create_module(spec)
+        except BaseException:
+            _import_stack.pop()
+            raise
+
+    def exec_module(self, module):
+        # the module body only ever sees its real loader
+        module.__spec__.loader = self.loader
+        module.__loader__ = self.loader
+        try:
+            self.loader.exec_module(module)
+        finally:
+            _import_stack.pop()
+            _imports[self.name] = {
+                'seconds': time.perf_counter() - self.start,
+                'started_at': self.start - PROCESS_START,
+                'phase': 'startup' if _ready_at is None else 'request',
+                'nested_in': _import_stack[-1] if _import_stack else None,
+                'rss_after_bytes': rss_bytes()
+            }
+
+
+class _ImportTimer(importlib.abc.MetaPathFinder):
+    def __init__(self, names):
+        self.names = set(names)
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname not in self.names or fullname in _imports:
+            return None
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if spec.loader is not None:
+            spec.loader = _TimedLoader(spec.loader, fullname)
+        return spec
+
+
+def install_import_timer(names=TIMED_MODULES):
+    if not any(isinstance(finder, _ImportTimer) for finder in sys.meta_path):
+        sys.meta_path.insert(0, _ImportTimer(names))
+
+
+@contextmanager
+def phase(name):
+    # time a named startup step, e.g. decomposer warm-up
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases[name] = time.perf_counter() - start
+
+
+def warm_up():
+    # the preloads a process does before it serves anything: heavy modules, decomposers (and the
+    # qiskit import, for bases it handles) and the gate library. every work pool worker runs it
+    # before its first task, since that's where requests run, and app.py runs it at import when
+    # there's no pool
+    for module_name in config.PRELOAD_MODULES:
+        importlib.import_module(module_name)
+    if config.PRELOAD_BASES:
+        with phase('warm_decomposers'):
+            from decomposition import warm_decomposers
+            warm_decomposers(config.PRELOAD_BASES)
+        if config.GATE_LIBRARY_PATH:
+            with phase('gate_library'):
+                import gate_library
+                gate_library.get()
+
+
+def mark_ready():
+    global _ready_at
+    _ready_at = time.perf_counter()
+
+
+def report():
+    return {
+        'pid': os.getpid(),
+        'ready': _ready_at is not None,
+        'startup_seconds': (_ready_at - PROCESS_START) if _ready_at is not None else None,
+        'rss_bytes': rss_bytes(),
+        'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024),
+        'phases': dict(_phases),
+        'imports': dict(_imports),
+        'loaded': {name: name in sys.modules for name in TIMED_MODULES}
+    }
+
+
+if __name__ == '__main__':
+    # python startup.py: import the app the way a worker would and print the report as json.
+    # go through sys.modules so app.py and this block share one copy of the module
+    startup = importlib.import_module('startup')
+    startup.install_import_timer()
+    importlib.import_module('app')
+    print(json.dumps(startup.report(), indent=2))
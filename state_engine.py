@@ -0,0 +1,155 @@
+import numpy as np
+
+import wire
+from analytics import concurrence, qubit_analytics
+from statevector import TOL, apply_gate, measure, num_qubits, norms, normalize, probabilities
+
+# batched two-qubit state math for the endpoints, the n=2 case of statevector.py. states are
+# (B, 4) complex arrays in the |q1 q0> basis (index = 2*q1 + q0), the single-state endpoints
+# are the B=1 case
+
+
+def states_from_json(state_vectors):
+    # a list of {'re', 'im'} lists or packed vectors, or one packed (B, 4) array (see wire.py)
+    if wire.is_packed(state_vectors):
+        states = wire.unpack(state_vectors)
+    else:
+        states = np.array([wire.unpack(sv) if wire.is_packed(sv) else [complex(c['re'], c['im']) for c in sv]
+                           for sv in state_vectors], dtype=complex)
+    # a packed (8,) vector would otherwise pass as two states
+    if states.shape[-1:] != (4,):
+        raise ValueError("State vectors must have 4 amplitudes")
+    return states.reshape(-1, 4)
+
+
+def gates_from_json(gate_matrices):
+    if wire.is_packed(gate_matrices):
+        gates = wire.unpack(gate_matrices)
+    else:
+        gates = np.array([wire.unpack(gm) if wire.is_packed(gm) else [[complex(e['re'], e['im']) for e in row] for row in gm]
+                          for gm in gate_matrices], dtype=complex)
+    if gates.shape[-2:] != (4, 4):
+        raise ValueError("Gate matrices must be 4x4")
+    return gates.reshape(-1, 4, 4)
+
+
+def apply_gates(states, gates):
+    # gates is (4, 4) for one gate on every state, or (B, 4, 4)
+    return apply_gate(states, gates, (1, 0))
+
+
+def outcome_labels(qubits, n=2):
+    # label of every basis state for a measurement sequence, one bit per measurement in order.
+    # measuring a qubit again repeats its first result, so [0, 0] only ever gives '00' or '11'
+    return [''.join(str((i >> q) & 1) for q in qubits) for i in range(2**n)]
+
+
+def outcome_distribution(states, qubits):
+    # sorted outcome labels and the (B, K) probability of each, states are normalized first
+    labels = outcome_labels(qubits, num_qubits(states))
+    unique = sorted(set(labels))
+    mapping = np.array([[label == u for u in unique] for label in labels], dtype=float)
+    probs = probabilities(normalize(states)) @ mapping
+    return unique, probs / probs.sum(axis=-1, keepdims=True)
+
+
+def sample_shots(states, qubits, shots, rng):
+    # (B, K) counts over the outcome labels, one multinomial draw per state
+    labels, probs = outcome_distribution(states, qubits)
+    return labels, probs, rng.multinomial(shots, probs)
+
+
+def post_measurement_states(states, qubits, labels):
+    # (B, K, 4) renormalized state left behind by each outcome label
+    basis_labels = np.array(outcome_labels(qubits, num_qubits(states)))
+    keep = basis_labels[None, :] == np.array(labels)[:, None]
+    projected = np.where(keep[None, :, :], states[:, None, :], 0.0)
+    n = np.sqrt(np.sum(np.abs(projected)**2, axis=-1, keepdims=True))
+    return projected / np.where(n > TOL, n, 1.0)
+
+
+def is_separable(states):
+    return np.abs(states[:, 0] * states[:, 3] - states[:, 1] * states[:, 2]) < TOL
+
+
+def _unit_phase(primary, fallback):
+    # phase of primary when it is non-negligible, else of fallback, else 1
+    mag_p = np.abs(primary)
+    mag_f = np.abs(fallback)
+    phase = np.ones_like(primary)
+    phase = np.where(mag_f > TOL, fallback / np.where(mag_f > TOL, mag_f, 1.0), phase)
+    return np.where(mag_p > TOL, primary / np.where(mag_p > TOL, mag_p, 1.0), phase)
+
+
+def _qubit_amplitudes(zero_a, zero_b, one_a, one_b):
+    # single-qubit amplitudes of a product state, from the components with the qubit in |0> / |1>.
+    # each amplitude keeps the phase of its first non-negligible component, so i|00> has alpha = i
+    zero_mag = np.sqrt(np.abs(zero_a)**2 + np.abs(zero_b)**2)
+    one_mag = np.sqrt(np.abs(one_a)**2 + np.abs(one_b)**2)
+    norm = np.sqrt(zero_mag**2 + one_mag**2)
+    ok = norm > TOL
+    safe = np.where(ok, norm, 1.0)
+    zero_norm = np.where(ok, zero_mag / safe, 1.0)
+    one_norm = np.where(ok, one_mag / safe, 0.0)
+    zero = zero_norm * _unit_phase(zero_a, zero_b)
+    one = one_norm * _unit_phase(one_a, one_b)
+    both = (np.abs(zero) > TOL) & (np.abs(one) > TOL)
+    relative_phase = np.where(both, np.angle(one / np.where(both, zero, 1.0)), 0.0)
+    return zero, one, relative_phase
+
+
+def separable_info(states):
+    # the per-qubit amplitudes and relative phases of product states, meaningless for entangled ones
+    c1, c2, c3, c4 = np.asarray(states, dtype=complex).reshape(-1, 4).T
+    alpha, beta, q1_phase = _qubit_amplitudes(c1, c2, c3, c4)
+    gamma, delta, q0_phase = _qubit_amplitudes(c1, c3, c2, c4)
+    return {
+        'alpha': alpha,
+        'beta': beta,
+        'gamma': gamma,
+        'delta': delta,
+        'q0current_relative_phase': q0_phase,
+        'q1current_relative_phase': q1_phase
+    }
+
+
+def relative_phases(states):
+    # (q0, q1) relative phases, zero for entangled states, their qubits have no phase of their own
+    # to drive from
+    info = separable_info(states)
+    separable = is_separable(states)
+    return (np.where(separable, info['q0current_relative_phase'], 0.0),
+            np.where(separable, info['q1current_relative_phase'], 0.0))
+
+
+def state_results(states):
+    # the per-state part of the /apply_gate, /measure_qubit and /decompose_state responses. complex
+    # values stay numpy, the response encoder writes them as {'re', 'im'} or packed buffers.
+    # single-qubit amplitudes only exist for product states, everything else is always there
+    probs = probabilities(states)
+    unit = normalize(states)
+    separable = is_separable(states)
+    tangle = concurrence(unit)
+    q0, q1 = qubit_analytics(unit)
+    info = separable_info(states)
+    results = []
+    for b in range(len(states)):
+        result = {
+            'coefficients': states[b],
+            'probabilities': probs[b].tolist(),
+            'is_separable': bool(separable[b]),
+            'bloch_qubit1': q1['bloch'][b].tolist(),
+            'bloch_qubit0': q0['bloch'][b].tolist(),
+            'purity_qubit1': float(q1['purity'][b]),
+            'purity_qubit0': float(q0['purity'][b]),
+            'entropy_qubit1': float(q1['entropy'][b]),
+            'entropy_qubit0': float(q0['entropy'][b]),
+            'concurrence': float(tangle[b]),
+            'q0current_relative_phase': float(info['q0current_relative_phase'][b]) if separable[b] else 0.0,
+            'q1current_relative_phase': float(info['q1current_relative_phase'][b]) if separable[b] else 0.0
+        }
+        if separable[b]:
+            result['qubit1_state'] = {'alpha': info['alpha'][b], 'beta': info['beta'][b]}
+            result['qubit0_state'] = {'gamma': info['gamma'][b], 'delta': info['delta'][b]}
+        results.append(result)
+    return results
@@ -0,0 +1,105 @@
+import numpy as np
+
+# n-qubit state vectors, batched as (B, 2**n) complex arrays. qubit q is bit q of the basis index
+# (index = sum of q_k 2**k), so state_engine's |q1 q0> states are the n=2 case. gates act on a
+# list of target qubits given most significant first, the order their kron factors would be
+# written in: kron(A, B) on targets (1, 0) puts A on q1 and B on q0. a gate is applied by viewing
+# the state as a rank-n tensor and contracting only the target axes, nothing 2**n x 2**n is built
+
+TOL = 1e-10
+
+
+def num_qubits(states):
+    dim = states.shape[-1]
+    n = dim.bit_length() - 1
+    if dim != 1 << n:
+        raise ValueError(f"State length {dim} is not a power of two")
+    return n
+
+
+def zero_states(n, batch=1):
+    states = np.zeros((batch, 2**n), dtype=complex)
+    states[:, 0] = 1
+    return states
+
+
+def _axis(n, qubit):
+    # axis of a qubit in the (B, 2, ..., 2) tensor view, q_{n-1} comes first
+    return n - qubit
+
+
+def _targets_last(states, targets):
+    # (B, rest, 2**k) view with the target qubits as the last axis, plus what's needed to undo it
+    n = num_qubits(states)
+    k = len(targets)
+    if len(set(targets)) != k or any(not 0 <= t < n for t in targets):
+        raise ValueError(f"Invalid target qubits {list(targets)} for {n} qubits")
+    axes = [_axis(n, t) for t in targets]
+    tensor = np.moveaxis(states.reshape((len(states),) + (2,) * n), axes, range(n + 1 - k, n + 1))
+    return tensor.reshape(len(states), -1, 2**k), tensor.shape, axes
+
+
+def apply_gate(states, gate, targets):
+    # gate is (2**k, 2**k) for one gate on every state, or (B, 2**k, 2**k)
+    flat, shape, axes = _targets_last(states, targets)
+    k = len(targets)
+    out = (flat @ np.swapaxes(gate, -1, -2)).reshape(shape)
+    return np.moveaxis(out, range(len(shape) - k, len(shape)), axes).reshape(states.shape)
+
+
+def embed(gate, targets, n):
+    # the full 2**n x 2**n matrix of a gate on some of the qubits, for display at small n
+    return apply_gate(np.identity(2**n, dtype=complex), gate, targets).T
+
+
+def probabilities(states):
+    return np.abs(states)**2
+
+
+def norms(states):
+    return np.sqrt(np.sum(probabilities(states), axis=-1))
+
+
+def normalize(states):
+    # zero states are left as they are, callers check norms() first
+    n = norms(states)
+    return states / np.where(n > TOL, n, 1.0)[:, None]
+
+
+def marginal_probabilities(states, qubits):
+    # (B, 2**k) distribution over the listed qubits (most significant first), not renormalized
+    n = num_qubits(states)
+    keep = [_axis(n, q) for q in qubits]
+    probs = probabilities(states).reshape((len(states),) + (2,) * n)
+    marginal = probs.sum(axis=tuple(a for a in range(1, n + 1) if a not in keep))
+    remaining = sorted(keep)
+    marginal = np.transpose(marginal, [0] + [1 + remaining.index(a) for a in keep])
+    return marginal.reshape(len(states), -1)
+
+
+def collapse(states, qubit, outcomes):
+    # project each state onto its measured outcome of one qubit, not renormalized
+    bits = (np.arange(states.shape[-1]) >> qubit) & 1
+    keep = bits[None, :] == np.asarray(outcomes)[:, None]
+    return np.where(keep, states, 0.0)
+
+
+def measure(states, qubit, rng):
+    # returns outcomes, normalized [p0, p1], the pre-normalization totals and the collapsed states
+    probs = marginal_probabilities(states, [qubit])
+    total = probs.sum(axis=-1)
+    probs = probs / np.where(total > TOL, total, 1.0)[:, None]
+    outcomes = (rng.random(len(states)) >= probs[:, 0]).astype(int)
+    return outcomes, probs, total, collapse(states, qubit, outcomes)
+
+
+def reduced_density_matrices(states, qubits):
+    # (B, 2**k, 2**k) state of the listed qubits (most significant first) with the rest traced out
+    flat, _, _ = _targets_last(states, qubits)
+    return np.einsum('bri,brj->bij', flat, flat.conj())
+
+
+def bloch_vectors(states, qubit):
+    # (B, 3) reduced Bloch vector of one qubit, shorter than 1 when it's entangled with the others
+    rho = reduced_density_matrices(states, [qubit])
+    return np.stack([2 * rho[:, 1, 0].real, 2 * rho[:, 1, 0].imag, (rho[:, 0, 0] - rho[:, 1, 1]).real], axis=-1)
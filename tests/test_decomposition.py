@@ -0,0 +1,89 @@
+import time
+
+import numpy as np
+import pytest
+
+import decomposition
+import kak
+from cache import LRUCache
+from test_kak import haar_unitaries
+
+
+def test_native_decompositions_are_verified(monkeypatch):
+    synthesize = kak.synthesize
+
+    def broken(U, **kwargs):
+        results = synthesize(U, **kwargs)
+        results[-1].matrices[0] = results[-1].matrices[0] @ np.diag([1, 1j])
+        return results
+
+    monkeypatch.setattr(kak, 'synthesize', broken)
+    with pytest.raises(decomposition.DecompositionError):
+        decomposition.decompose_gates(haar_unitaries(4), "iSwap")
+
+
+def test_check_fidelities_takes_one_requirement_per_unitary():
+    U = haar_unitaries(3)
+    decomposition.check_fidelities(U, U, [1.0, 1.0, 1.0])
+    with pytest.raises(decomposition.DecompositionError):
+        decomposition.check_fidelities(U, U[[0, 2, 1]], [1.0, 0.0, 1.0])
+
+
+def test_global_phase_and_rounding_share_a_cache_key():
+    U = haar_unitaries(1, seed=21)[0]
+    key = decomposition.unitary_key(U, "iSwap")
+    for phase in (0.3, np.pi / 2, np.pi, -2.5):
+        assert decomposition.unitary_key(np.exp(1j * phase) * U, "iSwap") == key
+    noise = np.random.default_rng(0).normal(size=(4, 4)) * 1e-13
+    assert decomposition.unitary_key(U + noise, "iSwap") == key
+    # -0.0 and 0.0 entries hash the same
+    cz = np.diag([1, 1, 1, -1]).astype(complex)
+    assert decomposition.unitary_key(-cz, "iSwap") == decomposition.unitary_key(cz, "iSwap")
+
+    assert decomposition.unitary_key(U, "CZ") != key
+    assert decomposition.unitary_key(U, "iSwap", (None, 0.99)) != key
+    assert decomposition.unitary_key(haar_unitaries(1, seed=22)[0], "iSwap") != key
+
+
+def test_phase_shifted_repeats_hit_the_decomposition_cache(monkeypatch):
+    monkeypatch.setattr(decomposition, 'decomposition_cache', LRUCache(4))
+    U = haar_unitaries(1, seed=23)[0]
+    first = decomposition.decompose_gate_cached(U, "iSwap")
+    again = decomposition.decompose_gate_cached(1j * U, "iSwap")
+    assert again is first
+    assert decomposition.decomposition_cache.stats()['hits'] == 1
+
+
+def test_lru_evicts_the_least_recently_used():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert 'b' not in cache
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.get_or_compute('b', lambda: 4) == 4
+    assert 'a' not in cache
+    assert cache.stats() == {'size': 2, 'maxsize': 2, 'ttl': None, 'hits': 3, 'misses': 1,
+                             'evictions': 2, 'expirations': 0}
+
+
+def test_entries_expire_after_their_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    cache = LRUCache(4, ttl=10)
+    cache.put('a', 1)
+    now[0] += 9
+    assert cache.get('a') == 1
+    now[0] += 2
+    assert cache.get('a') is None
+    assert cache.stats()['expirations'] == 1
+
+
+@pytest.mark.parametrize('shape', [(2, 2), (2, 8), (16,), (8, 8)])
+def test_only_4x4_matrices_are_decomposed(shape):
+    U = np.zeros(shape, dtype=complex)
+    with pytest.raises(ValueError, match="Matrix must be 4x4"):
+        decomposition.decompose_gate(U, "iSwap")
+    with pytest.raises(ValueError, match="Matrix must be 4x4"):
+        decomposition.decompose_gates([U], "iSwap")
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+import config
+import decomposition
+import gate_library
+
+
+@pytest.fixture(scope='module')
+def arrays():
+    return gate_library.build(["iSwap"])
+
+
+def test_every_entry_reproduces_its_unitary(arrays):
+    library = gate_library.GateLibrary(arrays)
+    assert all(entry is not None for entry in library.decompositions["iSwap"])
+    for name in ('cnot', 'swap', 'iswap', 'crz(pi/4)', 'h_q1,t_q0'):
+        U = library.unitary(name)
+        RM, tags, qcircuit = library.decomposition(U, "iSwap")
+        assert qcircuit.name == name
+        assert qcircuit.steps == decomposition.gate_steps(RM, tags)
+
+
+def test_entries_with_wrong_steps_are_dropped(arrays):
+    broken = dict(arrays)
+    library = gate_library.GateLibrary(arrays)
+    k = library.index['cnot']
+    start, stop = arrays['iSwap_step_offsets'][k:k + 2]
+    angles = arrays['iSwap_step_angles'].copy()
+    rotation = next(j for j in range(start, stop) if arrays['iSwap_step_codes'][j] != 2)
+    angles[rotation] += 0.1
+    broken['iSwap_step_angles'] = angles
+    entries = gate_library.GateLibrary(broken).decompositions["iSwap"]
+    assert entries[k] is None
+    assert sum(entry is None for entry in entries) == 1
+
+
+def test_entries_missing_an_entangling_step_are_dropped(arrays):
+    broken = dict(arrays)
+    codes = arrays['iSwap_step_codes'].copy()
+    codes[np.flatnonzero(codes == 2)[0]] = 1
+    broken['iSwap_step_codes'] = codes
+    entries = gate_library.GateLibrary(broken).decompositions["iSwap"]
+    assert sum(entry is None for entry in entries) == 1
+
+
+def test_a_file_from_another_engine_is_ignored(arrays, tmp_path, monkeypatch):
+    path = tmp_path / 'library.npz'
+    np.savez_compressed(path, **{**arrays, 'engine': np.array('qiskit')})
+    rebuilt = []
+    monkeypatch.setattr(gate_library, 'build', lambda modes: rebuilt.append(modes) or arrays)
+    gate_library.load(str(path))
+    assert rebuilt == [decomposition.NATIVE_BASES]
+    monkeypatch.setattr(config, 'DECOMPOSITION_ENGINE', 'qiskit')
+    gate_library.load(str(path))
+    assert len(rebuilt) == 1
+
+
+def test_check_mode_skips_the_library(arrays, monkeypatch):
+    monkeypatch.setattr(gate_library, '_library', gate_library.GateLibrary(arrays))
+    cnot = gate_library.named_unitary('cnot')
+    assert gate_library.lookup(cnot, "iSwap") is not None
+    monkeypatch.setattr(config, 'DECOMPOSITION_ENGINE', 'check')
+    assert gate_library.lookup(cnot, "iSwap") is None
@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+import kak
+
+X = np.array([[0, 1], [1, 0]], dtype=complex)
+SQ2 = 1 / np.sqrt(2)
+
+EDGE_GATES = {
+    'identity': (np.identity(4, dtype=complex), (0, 0, 0), 0),
+    'cnot': (np.array([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 1], [0, 0, 1, 0]], dtype=complex), (np.pi / 4, 0, 0), 2),
+    'swap': (np.identity(4, dtype=complex)[[0, 2, 1, 3]], (np.pi / 4, np.pi / 4, np.pi / 4), 3),
+    'iswap': (kak.ISWAP, (np.pi / 4, np.pi / 4, 0), 1),
+    'sqrt_iswap': (np.array([[1, 0, 0, 0], [0, SQ2, 1j * SQ2, 0], [0, 1j * SQ2, SQ2, 0], [0, 0, 0, 1]]), (np.pi / 8, np.pi / 8, 0), 2),
+}
+
+
+def haar_unitaries(count, seed=7):
+    rng = np.random.default_rng(seed)
+    Z = rng.normal(size=(count, 4, 4)) + 1j * rng.normal(size=(count, 4, 4))
+    Q, R = np.linalg.qr(Z)
+    d = np.diagonal(R, axis1=-2, axis2=-1)
+    return Q * (d / np.abs(d))[:, None, :]
+
+
+def near_local(epsilon):
+    # controlled Rx(epsilon), a hair away from the identity class
+    U = np.identity(4, dtype=complex)
+    U[2:, 2:] = np.cos(epsilon / 2) * np.identity(2) - 1j * np.sin(epsilon / 2) * X
+    return U
+
+
+def assert_in_chamber(coordinates):
+    a, b, c = np.asarray(coordinates).T
+    tol = 1e-9
+    assert np.all(a <= np.pi / 4 + tol)
+    assert np.all(a >= b - tol)
+    assert np.all(b >= np.abs(c) - tol)
+
+
+def test_weyl_decompose_reconstructs_haar_unitaries():
+    U = haar_unitaries(200)
+    w = kak.weyl_decompose(U)
+    assert np.allclose(w.reconstruct(), U, atol=1e-9)
+    assert_in_chamber(w.coordinates)
+
+
+def test_synthesize_reproduces_haar_unitaries():
+    U = haar_unitaries(200)
+    results = kak.synthesize(U)
+    assert np.allclose(kak.circuit_unitaries(results), U, atol=1e-9)
+    assert np.allclose(np.array([r.unitary() for r in results]), U, atol=1e-9)
+    assert all(r.num_basis_gates == 3 for r in results)
+
+
+@pytest.mark.parametrize('name', list(EDGE_GATES))
+def test_chamber_edges(name):
+    U, coordinates, count = EDGE_GATES[name]
+    w = kak.weyl_decompose(U)
+    assert np.allclose(w.coordinates[0], coordinates, atol=1e-9)
+    assert np.allclose(w.reconstruct()[0], U, atol=1e-9)
+    result, = kak.synthesize(U)
+    assert result.num_basis_gates == count
+    assert result.tags.count(2) == count
+    assert np.allclose(result.unitary(), U, atol=1e-9)
+
+
+@pytest.mark.parametrize('epsilon', [1e-3, 1e-6, 1e-9])
+def test_near_local_gates(epsilon):
+    U = near_local(epsilon)
+    w = kak.weyl_decompose(U)
+    assert_in_chamber(w.coordinates)
+    assert np.allclose(w.reconstruct()[0], U, atol=1e-9)
+    result, = kak.synthesize(U)
+    assert np.allclose(result.unitary(), U, atol=1e-9)
+
+
+def test_local_gates_need_no_iswap():
+    U = haar_unitaries(20)[:, :2, :2]
+    V = haar_unitaries(20, seed=8)[:, :2, :2]
+    # QR of a 4x4 block isn't unitary on its own, use the Q factors of 2x2 blocks instead
+    U, _ = np.linalg.qr(U)
+    V, _ = np.linalg.qr(V)
+    local = np.einsum('nab,ncd->nacbd', U, V).reshape(-1, 4, 4)
+    results = kak.synthesize(local)
+    assert [r.num_basis_gates for r in results] == [0] * 20
+    assert np.allclose(kak.circuit_unitaries(results), local, atol=1e-9)
+
+
+def test_basis_count_agrees_with_qiskit():
+    pytest.importorskip('qiskit')
+    from qiskit.circuit.library import iSwapGate
+    from qiskit.synthesis import TwoQubitBasisDecomposer
+
+    decomposer = TwoQubitBasisDecomposer(iSwapGate())
+    U = np.concatenate([haar_unitaries(50), np.array([u for u, _, _ in EDGE_GATES.values()])])
+    for target, result in zip(U, kak.synthesize(U)):
+        assert result.num_basis_gates == decomposer.num_basis_gates(target)
+
+
+def test_cross_check_compares_unitaries():
+    pytest.importorskip('qiskit')
+    # qiskit specializes near-identity gates into a different circuit, that isn't a disagreement
+    U = np.concatenate([haar_unitaries(10), near_local(1e-6)[None]])
+    assert kak.cross_check(U, kak.synthesize(U)) == []
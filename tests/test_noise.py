@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+import noise
+import statevector
+import zyz
+from test_kak import haar_unitaries
+
+TRAJECTORIES = 20000
+
+
+def circuit():
+    # strong enough noise that the fidelity ends up well away from 1
+    model = noise.noise_model(t1=[5e-6, 4e-6], t2=[6e-6, 3e-6])
+    steps = [(U, (1, 0), 1e-6) for U in haar_unitaries(3, seed=2)]
+    steps.append((zyz.ry_matrix(0.7) @ zyz.rz_matrix(0.3), (0,), 2e-6))
+    initial = statevector.normalize(np.array([[1, 1j, -1, 0.5]]))[0]
+    return steps, initial, model
+
+
+def test_trajectories_agree_with_the_density_matrix():
+    steps, initial, model = circuit()
+    exact = noise.simulate_density_matrix(steps, initial, model)
+    sampled = noise.simulate_trajectories(steps, initial, model, TRAJECTORIES, np.random.default_rng(4))
+    assert exact['fidelity'] < 0.8
+    assert abs(sampled['fidelity'] - exact['fidelity']) < 5 * sampled['fidelity_stderr']
+    # every fidelity and Bloch component is an average of values in [-1, 1]
+    tolerance = 5 / np.sqrt(TRAJECTORIES)
+    assert np.allclose(sampled['step_fidelities'], exact['step_fidelities'], atol=tolerance)
+    assert np.allclose(sampled['bloch_vectors'], exact['bloch_vectors'], atol=tolerance)
+    assert sampled['jumps'] > 0
+
+
+def test_trajectories_are_fixed_by_the_seed():
+    steps, initial, model = circuit()
+    first = noise.simulate_trajectories(steps, initial, model, 500, np.random.default_rng(9))
+    second = noise.simulate_trajectories(steps, initial, model, 500, np.random.default_rng(9))
+    other = noise.simulate_trajectories(steps, initial, model, 500, np.random.default_rng(10))
+    assert first == second
+    assert first['fidelity'] != other['fidelity']
+
+
+def test_without_decoherence_nothing_happens():
+    steps, initial, _ = circuit()
+    model = noise.noise_model(t1=[np.inf, np.inf], t2=[np.inf, np.inf])
+    sampled = noise.simulate_trajectories(steps, initial, model, 100, np.random.default_rng(1))
+    exact = noise.simulate_density_matrix(steps, initial, model)
+    assert sampled['fidelity'] == pytest.approx(1.0)
+    assert exact['fidelity'] == pytest.approx(1.0)
+    assert sampled['jumps'] == 0
+
+
+def test_t2_longer_than_twice_t1_is_rejected():
+    with pytest.raises(ValueError):
+        noise.noise_model(t1=[1e-6], t2=[3e-6])
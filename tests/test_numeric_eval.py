@@ -0,0 +1,47 @@
+import pytest
+
+from expressions import normalize_expression, sympy_parse
+from numeric_eval import UnsupportedExpression, evaluate_numeric
+
+# raw inputs as typed into the workbench, each evaluated by both parsers after normalize_expression
+TABLE = [
+    # precedence and associativity
+    '1+2*3', '(1+2)*3', '1-2-3', '8/4/2', '2*3**2', '2**3**2', '2^3^2', '1/2*4',
+    # unary minus against **
+    '-2**2', '(-2)**2', '2**-1', '-2**-2', '--3', '+4', '-(3+1)', '2*-3', '(-1)**0.5', '-1**0.5',
+    # implicit i, pi and multiplication
+    'i', '3i', '2.5i', 'i*pi', 'ipi', '2pi', 'pi/2', '(1+i)(1-i)', '2(3+i)', 'i sin(pi/3)',
+    'e^(i*pi)', 'e^(ipi/4)', '1/sqrt(2)', 'sqrt(-1)', 'exp(i*pi/2)', 'cos(pi/3) + i*sin(pi/3)',
+    # numbers and functions
+    '1e-3', '.5', '2.', '3.5e2', 'log(-1)', 'ln(E)', 'tanh(1)+i*sinh(1)', 'sqrt(2)/2', '(1+i)**(1/2)',
+]
+
+MALFORMED = ['', '1+', '(1', '1)', '2**', '*3', '1 $ 2', '(1+2', '3 +* 4']
+
+
+@pytest.mark.parametrize('expression', TABLE)
+def test_agrees_with_sympy(expression):
+    normalized = normalize_expression(expression)
+    expected = complex(sympy_parse(normalized).evalf())
+    assert evaluate_numeric(normalized) == pytest.approx(expected, abs=1e-12)
+
+
+@pytest.mark.parametrize('expression', MALFORMED)
+def test_rejects_malformed_input(expression):
+    normalized = normalize_expression(expression)
+    with pytest.raises(UnsupportedExpression):
+        evaluate_numeric(normalized)
+    # the sympy fallback refuses it too, so the request fails instead of guessing
+    with pytest.raises(Exception):
+        sympy_parse(normalized)
+
+
+@pytest.mark.parametrize('expression', ['x', 'theta', 'sqrt 2', 'foo(1)', '1/0'])
+def test_leaves_the_rest_to_sympy(expression):
+    with pytest.raises(UnsupportedExpression):
+        evaluate_numeric(normalize_expression(expression))
+
+
+def test_float_noise_is_snapped_to_zero():
+    assert evaluate_numeric('cos(pi/2)') == 0
+    assert evaluate_numeric('E**(I*pi)') == -1
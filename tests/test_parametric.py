@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+import config
+import parametric
+
+XX_ROTATION = [['cos(t)', '0', '0', '-i*sin(t)'], ['0', '1', '0', '0'],
+               ['0', '0', '1', '0'], ['-i*sin(t)', '0', '0', 'cos(u)']]
+
+
+def test_values_broadcast_against_each_other():
+    gate = parametric.compile_parametric(XX_ROTATION)
+    assert gate.parameters == ['t', 'u']
+    unitaries = gate.evaluate({'t': [[0.0], [0.5]], 'u': [0.0, 0.1, 0.2]})
+    assert unitaries.shape == (2, 3, 4, 4)
+    assert unitaries[1, 2, 0, 0] == pytest.approx(np.cos(0.5))
+    assert unitaries[1, 2, 3, 3] == pytest.approx(np.cos(0.2))
+
+
+def test_too_many_points_are_refused_before_evaluating(monkeypatch):
+    gate = parametric.compile_parametric(XX_ROTATION)
+    monkeypatch.setattr(config, 'PARAMETRIC_MAX_POINTS', 100)
+    assert gate.evaluate({'t': np.zeros(100), 'u': 0.0}).shape == (100, 4, 4)
+    monkeypatch.setattr(gate, 'func', lambda *args: pytest.fail("evaluated past the limit"))
+    # 20 x 20 broadcasts to 400 points even though neither list is long
+    with pytest.raises(ValueError, match="400 points"):
+        gate.evaluate({'t': np.zeros((20, 1)), 'u': np.zeros(20)})
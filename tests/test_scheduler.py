@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+import decomposition
+import scheduler
+
+
+def rparams():
+    return decomposition.relevant_parameters(rabi_frequency=50e6, q0drive_freq=5e9, q1drive_freq=5.2e9,
+                                             q0current_relative_phase=0.0, q1current_relative_phase=0.0)
+
+
+def unitary(steps):
+    instructions, _ = decomposition.instructions_from_steps(steps, "iSwap", rparams())
+    return scheduler.circuit_unitary(instructions)
+
+
+def assert_same_circuit(steps, rewritten):
+    assert scheduler.phase_distance(unitary(steps), unitary(rewritten)) < 1e-12
+
+
+@pytest.mark.parametrize('qubit', [0, 1])
+def test_z_moves_to_the_other_qubit_through_iswap(qubit):
+    steps = [("RZ", qubit, 0.7), ("ENTANGLE", 2, None)]
+    rewritten = scheduler.rewrite_steps(steps)
+    assert rewritten[0] == ("ENTANGLE", 2, None)
+    assert [(code, tag) for code, tag, _ in rewritten[1:]] == [("RZ", 1 - qubit)]
+    assert rewritten[1][2] == pytest.approx(0.7)
+    assert_same_circuit(steps, rewritten)
+
+
+def test_z_rotations_fuse_across_iswap():
+    # q0's rotation crosses to q1 and meets the one already there
+    steps = [("RZ", 0, 0.4), ("ENTANGLE", 2, None), ("RZ", 1, -0.4), ("RY", 0, 0.3)]
+    rewritten = scheduler.rewrite_steps(steps)
+    assert rewritten == [("ENTANGLE", 2, None), ("RY", 0, 0.3)]
+    assert_same_circuit(steps, rewritten)
+
+
+def test_y_rotations_merge_and_wrap_around():
+    steps = [("RY", 0, 2.0), ("RZ", 1, 0.1), ("RY", 0, 2.5)]
+    rewritten = scheduler.rewrite_steps(steps)
+    ys = [step for step in rewritten if step[0] == "RY"]
+    assert len(ys) == 1
+    assert ys[0][2] == pytest.approx(4.5 - 2 * np.pi)
+    assert -np.pi < ys[0][2] <= np.pi
+    assert_same_circuit(steps, rewritten)
+
+
+def test_y_rotations_that_cancel_are_dropped():
+    # a full turn is only a sign, so this comes out as nothing at all
+    steps = [("RY", 1, 3.0), ("RY", 1, 2 * np.pi - 3.0)]
+    assert scheduler.rewrite_steps(steps) == []
+    assert_same_circuit(steps, [])
+
+
+def test_y_rotations_do_not_merge_across_iswap():
+    steps = [("RY", 0, 0.5), ("ENTANGLE", 2, None), ("RY", 0, 0.5)]
+    assert scheduler.rewrite_steps(steps) == steps
+
+
+def test_noise_steps_follow_the_schedule():
+    instructions, _ = decomposition.instructions_from_steps(
+        [("RY", 0, 1.0), ("RY", 1, 0.5), ("ENTANGLE", 2, None), ("RZ", 0, 0.2), ("RY", 0, 2.0)], "iSwap", rparams())
+    y0, y1, iswap, _, last = (instr.duration for instr in instructions)
+    starts, total = scheduler.timed_schedule(instructions)
+    # the two Y pulses run side by side, the iSwap waits for the longer one
+    assert starts == pytest.approx([0.0, 0.0, y0, y0 + iswap, y0 + iswap])
+    assert total == pytest.approx(y0 + iswap + last)
+    assert y1 < y0
+
+    steps = scheduler.noise_steps(instructions, starts, total)
+    assert len(steps) == len(instructions)
+    durations = [duration for _, _, duration in steps]
+    # each gate is followed by damping until the next one starts, the last one until the end
+    assert durations == pytest.approx([0.0, y0, iswap, 0.0, last])
+    assert sum(durations) == pytest.approx(total)
+    for (gate, qubits, _), instr in zip(steps, instructions):
+        assert qubits == (1, 0)
+        assert np.allclose(gate, instr.underlying_gate)
+
+
+def test_optimize_schedule_raises_when_the_rewrite_is_wrong(monkeypatch):
+    instructions, _ = decomposition.instructions_from_steps([("RY", 0, 1.0), ("ENTANGLE", 2, None)], "iSwap", rparams())
+    monkeypatch.setattr(scheduler, 'rewrite_steps', lambda steps: steps[:-1])
+    with pytest.raises(scheduler.ScheduleError):
+        scheduler.optimize_schedule(instructions, rparams())
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+import state_engine
+
+
+def random_qubit(rng):
+    v = rng.normal(size=2) + 1j * rng.normal(size=2)
+    return v / np.linalg.norm(v)
+
+
+def test_global_phase_stays_on_the_qubit_amplitudes():
+    # the frontend writes these back into its alpha/gamma boxes, a typed phase has to survive
+    result = state_engine.state_results(np.array([[1j, 0, 0, 0]]))[0]
+    assert result['qubit1_state']['alpha'] == pytest.approx(1j)
+    assert result['qubit1_state']['beta'] == pytest.approx(0)
+    assert result['qubit0_state']['gamma'] == pytest.approx(1j)
+    assert result['qubit0_state']['delta'] == pytest.approx(0)
+
+
+def test_product_states_give_back_their_factors():
+    rng = np.random.default_rng(3)
+    for _ in range(20):
+        q1, q0 = random_qubit(rng), random_qubit(rng)
+        result = state_engine.state_results(np.kron(q1, q0)[None])[0]
+        assert result['is_separable']
+        alpha, beta = result['qubit1_state']['alpha'], result['qubit1_state']['beta']
+        gamma, delta = result['qubit0_state']['gamma'], result['qubit0_state']['delta']
+        # the same state up to a global phase, each qubit's |0> amplitude has the phase of |00>
+        assert abs(np.vdot(np.kron([alpha, beta], [gamma, delta]), np.kron(q1, q0))) == pytest.approx(1.0)
+        phase = np.exp(1j * np.angle(q1[0] * q0[0]))
+        assert alpha == pytest.approx(abs(q1[0]) * phase)
+        assert gamma == pytest.approx(abs(q0[0]) * phase)
+        assert result['q1current_relative_phase'] == pytest.approx(np.angle(q1[1] / q1[0]))
+        assert result['q0current_relative_phase'] == pytest.approx(np.angle(q0[1] / q0[0]))
+
+
+def test_entangled_states_have_no_qubit_amplitudes():
+    bell = np.array([[1, 0, 0, 1]]) / np.sqrt(2)
+    result = state_engine.state_results(bell)[0]
+    assert not result['is_separable']
+    assert 'qubit1_state' not in result and 'qubit0_state' not in result
+    assert result['q0current_relative_phase'] == result['q1current_relative_phase'] == 0.0
+    assert result['concurrence'] == pytest.approx(1.0)
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+import statevector
+
+I2 = np.identity(2, dtype=complex)
+SWAP = np.identity(4, dtype=complex)[[0, 2, 1, 3]]
+
+
+def random_unitary(dim, rng):
+    Q, R = np.linalg.qr(rng.normal(size=(dim, dim)) + 1j * rng.normal(size=(dim, dim)))
+    return Q * (np.diag(R) / np.abs(np.diag(R)))
+
+
+def random_states(batch, n, rng):
+    states = rng.normal(size=(batch, 2**n)) + 1j * rng.normal(size=(batch, 2**n))
+    return states / np.linalg.norm(states, axis=-1, keepdims=True)
+
+
+def kron(*factors):
+    out = np.identity(1, dtype=complex)
+    for factor in factors:
+        out = np.kron(out, factor)
+    return out
+
+
+def reference(gate, targets, n):
+    # the full matrix from krons, qubit n-1 is the leftmost factor. the non-adjacent n=3 cases are
+    # the adjacent ones with q1 and q0 swapped around them
+    swap_low = kron(I2, SWAP)
+    reversed_gate = SWAP @ gate @ SWAP if len(gate) == 4 else gate
+    cases = {
+        (2, (0,)): lambda: kron(I2, gate),
+        (2, (1,)): lambda: kron(gate, I2),
+        (2, (1, 0)): lambda: gate,
+        (2, (0, 1)): lambda: reversed_gate,
+        (3, (0,)): lambda: kron(I2, I2, gate),
+        (3, (1,)): lambda: kron(I2, gate, I2),
+        (3, (2,)): lambda: kron(gate, I2, I2),
+        (3, (2, 1)): lambda: kron(gate, I2),
+        (3, (1, 0)): lambda: kron(I2, gate),
+        (3, (0, 1)): lambda: kron(I2, reversed_gate),
+        (3, (2, 0)): lambda: swap_low @ kron(gate, I2) @ swap_low,
+        (3, (0, 2)): lambda: swap_low @ kron(reversed_gate, I2) @ swap_low,
+    }
+    return cases[(n, tuple(targets))]()
+
+
+CASES = [(2, (0,)), (2, (1,)), (2, (1, 0)), (2, (0, 1)),
+         (3, (0,)), (3, (1,)), (3, (2,)), (3, (2, 1)), (3, (1, 0)), (3, (0, 1)), (3, (2, 0)), (3, (0, 2))]
+
+
+@pytest.mark.parametrize('n, targets', CASES)
+def test_embed_matches_kron(n, targets):
+    gate = random_unitary(2**len(targets), np.random.default_rng(5))
+    assert np.allclose(statevector.embed(gate, list(targets), n), reference(gate, targets, n))
+
+
+@pytest.mark.parametrize('n, targets', CASES)
+def test_apply_gate_matches_kron(n, targets):
+    rng = np.random.default_rng(6)
+    states = random_states(5, n, rng)
+    gate = random_unitary(2**len(targets), rng)
+    expected = states @ reference(gate, targets, n).T
+    assert np.allclose(statevector.apply_gate(states, gate, list(targets)), expected)
+    # one gate per state
+    gates = np.array([random_unitary(2**len(targets), rng) for _ in states])
+    expected = np.einsum('bij,bj->bi', np.array([reference(g, targets, n) for g in gates]), states)
+    assert np.allclose(statevector.apply_gate(states, gates, list(targets)), expected)
+
+
+@pytest.mark.parametrize('n, qubits', [(2, (0,)), (2, (1,)), (2, (0, 1)), (3, (1,)), (3, (2, 0)), (3, (0, 2)), (3, (0, 1, 2))])
+def test_marginal_probabilities_sum_the_other_qubits(n, qubits):
+    states = random_states(4, n, np.random.default_rng(7))
+    expected = np.zeros((len(states), 2**len(qubits)))
+    for index in range(2**n):
+        # the listed qubits' bits, most significant first
+        outcome = sum(((index >> q) & 1) << (len(qubits) - 1 - m) for m, q in enumerate(qubits))
+        expected[:, outcome] += np.abs(states[:, index])**2
+    assert np.allclose(statevector.marginal_probabilities(states, list(qubits)), expected)
+
+
+def test_invalid_targets_are_rejected():
+    states = statevector.zero_states(3)
+    with pytest.raises(ValueError):
+        statevector.apply_gate(states, SWAP, [1, 1])
+    with pytest.raises(ValueError):
+        statevector.apply_gate(states, I2, [3])
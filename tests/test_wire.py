@@ -0,0 +1,91 @@
+import json
+
+import numpy as np
+import pytest
+
+import state_engine
+import wire
+
+
+def random_complex(shape, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.normal(size=shape) + 1j * rng.normal(size=shape)
+
+
+@pytest.mark.parametrize('shape', [(4,), (3, 4), (2, 4, 4), (0, 4)])
+def test_pack_round_trips_exactly(shape):
+    array = random_complex(shape)
+    for binary in (False, True):
+        unpacked = wire.unpack(wire.pack(array, binary))
+        assert unpacked.shape == shape
+        assert np.array_equal(unpacked, array)
+
+
+def test_packed_json_response_round_trips():
+    response = {
+        'success': True,
+        'states': random_complex((3, 4), seed=1),
+        'nested': [{'gate': random_complex((4, 4), seed=2), 'probabilities': np.array([0.25, 0.75])}],
+        'phase': np.float64(0.5),
+        'scalar': 1 + 2j
+    }
+    decoded = wire.unpack_arrays(wire.loads(wire.dumps(response, wire.PACKED_JSON), wire.PACKED_JSON))
+    assert np.array_equal(decoded['states'], response['states'])
+    assert np.array_equal(decoded['nested'][0]['gate'], response['nested'][0]['gate'])
+    assert decoded['nested'][0]['probabilities'] == [0.25, 0.75]
+    assert decoded['phase'] == 0.5
+    assert decoded['scalar'] == {'re': 1.0, 'im': 2.0}
+
+
+def test_plain_and_packed_requests_parse_alike():
+    states = random_complex((2, 4), seed=3)
+    plain = json.loads(wire.dumps({'states': states}))['states']
+    packed = json.loads(wire.dumps({'states': states}, wire.PACKED_JSON))['states']
+    assert np.array_equal(state_engine.states_from_json(plain), states)
+    assert np.array_equal(state_engine.states_from_json(packed), states)
+    assert np.array_equal(state_engine.states_from_json([wire.pack(s) for s in states]), states)
+
+
+@pytest.mark.parametrize('shape, message', [
+    ([4, 4], "has 4 values"),
+    ([5], "has 4 values"),
+    ('4', "list of non-negative integers"),
+    ([-4], "list of non-negative integers"),
+    ([4.0], "list of non-negative integers"),
+    ([True, 4], "list of non-negative integers"),
+])
+def test_bad_shapes_are_rejected(shape, message):
+    packed = {**wire.pack(random_complex(4)), 'shape': shape}
+    with pytest.raises(ValueError, match=message):
+        wire.unpack(packed)
+
+
+def test_truncated_buffers_are_rejected():
+    packed = wire.pack(random_complex(4), binary=True)
+    with pytest.raises(ValueError, match="whole number"):
+        wire.unpack({**packed, 'data': packed['data'][:-3]})
+
+
+def test_packed_states_and_gates_must_be_two_qubit():
+    # (8,) would otherwise reshape into two states, (2, 8) into one gate
+    with pytest.raises(ValueError, match="4 amplitudes"):
+        state_engine.states_from_json(wire.pack(random_complex(8)))
+    with pytest.raises(ValueError, match="4x4"):
+        state_engine.gates_from_json(wire.pack(random_complex((2, 8))))
+    assert state_engine.gates_from_json(wire.pack(random_complex((4, 4)))).shape == (1, 4, 4)
+
+
+@pytest.mark.skipif(wire.msgpack is None, reason="msgpack is not installed")
+def test_msgpack_round_trips():
+    response = {'states': random_complex((3, 4), seed=4), 'success': True}
+    decoded = wire.unpack_arrays(wire.loads(wire.dumps(response, wire.MSGPACK), wire.MSGPACK))
+    assert np.array_equal(decoded['states'], response['states'])
+
+
+def test_msgpack_is_only_offered_when_installed(monkeypatch):
+    monkeypatch.setattr(wire, 'msgpack', None)
+    assert wire.MSGPACK not in wire.formats()
+    with pytest.raises(ValueError, match="optional msgpack package"):
+        wire.dumps({}, wire.MSGPACK)
+    with pytest.raises(ValueError, match="optional msgpack package"):
+        wire.loads(b'', wire.MSGPACK)
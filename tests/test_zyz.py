@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+import zyz
+
+EDGE_GATES = {
+    'identity': np.identity(2, dtype=complex),
+    'z': zyz.rz_matrix(0.7),
+    's': np.diag([1, 1j]),
+    'y_pi': zyz.ry_matrix(np.pi),
+    'y_pi_phase': np.exp(0.3j) * zyz.ry_matrix(np.pi),
+    'x': np.array([[0, 1], [1, 0]], dtype=complex),
+    'y_minus_pi_half': zyz.ry_matrix(-np.pi / 2),
+    'hadamard': np.array([[1, 1], [1, -1]], dtype=complex) / np.sqrt(2),
+}
+
+
+def haar_qubits(count, seed=11):
+    rng = np.random.default_rng(seed)
+    Z = rng.normal(size=(count, 2, 2)) + 1j * rng.normal(size=(count, 2, 2))
+    Q, R = np.linalg.qr(Z)
+    d = np.diagonal(R, axis1=-2, axis2=-1)
+    return Q * (d / np.abs(d))[:, None, :]
+
+
+def ours(angles, k):
+    lam, theta, phi, gphase, on = (np.asarray(a)[k] for a in angles)
+    gates = [(name, float(angle)) for name, angle, kept in zip(("rz", "ry", "rz"), (lam, theta, phi), on) if kept]
+    return gates, float(gphase)
+
+
+def qiskits(U):
+    from qiskit.synthesis import OneQubitEulerDecomposer
+
+    circuit = OneQubitEulerDecomposer(basis='ZYZ')(U)
+    return [(instr.operation.name, float(instr.operation.params[0])) for instr in circuit.data], float(circuit.global_phase)
+
+
+def rebuild(gates, gphase):
+    U = np.exp(1j * gphase) * np.identity(2, dtype=complex)
+    for name, angle in gates:
+        U = (zyz.rz_matrix(angle) if name == "rz" else zyz.ry_matrix(angle)) @ U
+    return U
+
+
+def assert_same_phase(a, b):
+    assert abs(np.exp(1j * a) - np.exp(1j * b)) < 1e-9
+
+
+def check_against_qiskit(Us):
+    angles = zyz.zyz_angles(Us)
+    for k, U in enumerate(Us):
+        gates, gphase = ours(angles, k)
+        expected, expected_phase = qiskits(U)
+        # same rotations skipped, in the same order, at the same angles
+        assert [name for name, _ in gates] == [name for name, _ in expected]
+        assert [angle for _, angle in gates] == pytest.approx([angle for _, angle in expected], abs=1e-9)
+        assert_same_phase(gphase, expected_phase)
+        assert np.allclose(rebuild(gates, gphase), U, atol=1e-9)
+
+
+def test_haar_random_matches_qiskit():
+    check_against_qiskit(haar_qubits(200))
+
+
+@pytest.mark.parametrize('name', EDGE_GATES)
+def test_edge_cases_match_qiskit(name):
+    check_against_qiskit(EDGE_GATES[name][None])
+
+
+def test_skip_flags_on_edge_cases():
+    names = list(EDGE_GATES)
+    *_, on = zyz.zyz_angles(np.array([EDGE_GATES[name] for name in names]))
+    flags = dict(zip(names, on.tolist()))
+    assert flags['identity'] == [False, False, False]
+    assert flags['z'] == [True, False, False]
+    assert flags['y_pi'] == [False, True, False]
+    assert flags['y_pi_phase'] == [False, True, False]
+
+
+def test_batch_shape_is_kept():
+    Us = haar_qubits(6).reshape(2, 3, 2, 2)
+    lam, theta, phi, gphase, on = zyz.zyz_angles(Us)
+    assert lam.shape == theta.shape == phi.shape == gphase.shape == (2, 3)
+    assert on.shape == (2, 3, 3)
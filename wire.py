@@ -0,0 +1,125 @@
+import base64
+import json
+
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# wire formats for complex arrays. plain json spells out every complex number as {'re', 'im'},
+# the packed formats send a whole array as one little-endian complex128 buffer:
+#   {'dtype': 'complex128', 'shape': [4, 4], 'data': <buffer>}
+# with the buffer base64 encoded in a json body, or raw bytes in a msgpack body (needs the
+# optional msgpack package). requests can send a packed array anywhere a state vector or matrix
+# is expected, responses are packed when the client asks for it in Accept
+
+JSON = 'application/json'
+PACKED_JSON = 'application/vnd.workbench.packed+json'
+MSGPACK = 'application/msgpack'
+
+WIRE_DTYPE = np.dtype('<c16')
+
+
+def formats():
+    # response formats this process can produce, plain json first so it wins */* ties
+    return [JSON, PACKED_JSON] + ([MSGPACK] if msgpack is not None else [])
+
+
+def is_packed(value):
+    return isinstance(value, dict) and value.get('dtype') == 'complex128' and 'data' in value
+
+
+def pack(array, binary=False):
+    data = np.ascontiguousarray(array, dtype=WIRE_DTYPE).tobytes()
+    return {
+        'dtype': 'complex128',
+        'shape': list(np.shape(array)),
+        'data': data if binary else base64.b64encode(data).decode('ascii')
+    }
+
+
+def unpack(value):
+    data = value['data']
+    if isinstance(data, str):
+        data = base64.b64decode(data)
+    if len(data) % WIRE_DTYPE.itemsize:
+        raise ValueError(f"Packed array has {len(data)} bytes, not a whole number of complex128 values")
+    # a read-only view of the decoded buffer, nothing is copied
+    array = np.frombuffer(data, dtype=WIRE_DTYPE)
+    shape = value.get('shape', list(array.shape))
+    if not isinstance(shape, list) or not all(isinstance(n, int) and not isinstance(n, bool) and n >= 0 for n in shape):
+        raise ValueError("Packed array shape must be a list of non-negative integers")
+    if int(np.prod(shape)) != array.size:
+        raise ValueError(f"Packed array has {array.size} values, shape {shape} needs {int(np.prod(shape))}")
+    return array.reshape(shape)
+
+
+def complex_json(c):
+    return {'re': float(c.real), 'im': float(c.imag)}
+
+
+def _nest(flat, shape):
+    for size in reversed(shape[1:]):
+        flat = [flat[i:i + size] for i in range(0, len(flat), size)]
+    return flat
+
+
+def plain_json(value):
+    # json `default` hook for the plain format: numpy values as builtins, complex ones as {'re', 'im'}
+    if isinstance(value, np.ndarray):
+        if not np.iscomplexobj(value):
+            return value.tolist()
+        if value.ndim == 0:
+            return complex_json(value.item())
+        flat = [{'re': re, 'im': im} for re, im in zip(value.real.ravel().tolist(), value.imag.ravel().tolist())]
+        return _nest(flat, value.shape)
+    if isinstance(value, complex):
+        return complex_json(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def pack_arrays(value, binary=False):
+    # copy of a response with every complex array packed and other numpy values made builtin
+    if isinstance(value, dict):
+        return {key: pack_arrays(item, binary) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [pack_arrays(item, binary) for item in value]
+    if isinstance(value, np.ndarray) and value.ndim and np.iscomplexobj(value):
+        return pack(value, binary)
+    if isinstance(value, (np.ndarray, np.generic, complex)):
+        return plain_json(value)
+    return value
+
+
+def unpack_arrays(value):
+    # inverse of pack_arrays, for python clients reading a packed response
+    if is_packed(value):
+        return unpack(value)
+    if isinstance(value, dict):
+        return {key: unpack_arrays(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [unpack_arrays(item) for item in value]
+    return value
+
+
+def dumps(value, fmt=JSON):
+    if fmt == MSGPACK:
+        if msgpack is None:
+            raise ValueError(f"{MSGPACK} needs the optional msgpack package, which is not installed")
+        return msgpack.packb(pack_arrays(value, binary=True), use_bin_type=True)
+    if fmt == PACKED_JSON:
+        return json.dumps(pack_arrays(value), separators=(',', ':')).encode()
+    return json.dumps(value, default=plain_json).encode()
+
+
+def loads(data, fmt=JSON):
+    # packed arrays are left packed, the parsers unpack them where a vector or matrix is expected
+    if fmt == MSGPACK:
+        if msgpack is None:
+            raise ValueError(f"{MSGPACK} needs the optional msgpack package, which is not installed")
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data)
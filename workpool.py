@@ -0,0 +1,199 @@
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+
+import metrics
+
+# a fixed set of worker processes for the CPU-heavy parts of a request (sympy, two-qubit
+# synthesis, instruction sets). a worker runs one task at a time, so a task that runs past its
+# request's budget, or whose client has gone away, is stopped by killing the worker and starting
+# a fresh one. requests wait for a free worker in a bounded queue, past that they get a 429
+
+POLL_SECONDS = 0.05
+
+logger = logging.getLogger('workbench.pool')
+
+
+class PoolError(Exception):
+    status = 503
+
+
+class Overloaded(PoolError):
+    def __init__(self, message, status=503):
+        super().__init__(message)
+        self.status = status
+
+
+class BudgetExceeded(PoolError):
+    status = 503
+
+
+class Cancelled(PoolError):
+    # nginx's "client closed request", nobody is left to read it
+    status = 499
+
+
+def _worker_main(conn, initializer, reporter):
+    # ctrl-c is the parent's to handle, it kills the workers on its way out
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if initializer is not None:
+        # a worker that fails to warm up still serves, it just pays on its first tasks
+        try:
+            initializer()
+        except Exception:
+            logger.exception("work pool worker initializer failed")
+    while True:
+        try:
+            fn, args = conn.recv()
+        except EOFError:
+            return
+        with metrics.collect_stages() as stages:
+            try:
+                outcome = (True, fn(*args))
+            except Exception as e:
+                outcome = (False, e)
+        report = reporter() if reporter is not None else None
+        try:
+            conn.send(outcome + (stages, report))
+        except Exception as e:
+            # the result or the exception didn't pickle
+            conn.send((False, RuntimeError(str(e)), stages, report))
+
+
+class _Worker:
+    def __init__(self, ctx, initializer, reporter):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, initializer, reporter), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join(1)
+        self.conn.close()
+
+
+class WorkPool:
+    def __init__(self, workers, queue_size, queue_timeout, initializer=None, reporter=None):
+        # forkserver rather than fork, forking a threaded server can copy held locks. every worker,
+        # replacements included, runs initializer() before taking work, and sends reporter()'s
+        # result back with each task's
+        self._ctx = multiprocessing.get_context('forkserver')
+        self._initializer = initializer
+        self._reporter = reporter
+        # the latest report of every live worker, by pid
+        self._reports = {}
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.busy = 0
+        self.events = {event: 0 for event in ('completed', 'failed', 'rejected', 'queue_timeout', 'budget_exceeded', 'cancelled', 'restarted')}
+        for _ in range(workers):
+            self._idle.put(_Worker(self._ctx, initializer, reporter))
+
+    def _count(self, event):
+        with self._lock:
+            self.events[event] += 1
+
+    def _replace(self, worker):
+        worker.kill()
+        self._count('restarted')
+        with self._lock:
+            self._reports.pop(worker.process.pid, None)
+        self._idle.put(_Worker(self._ctx, self._initializer, self._reporter))
+
+    def _acquire(self, deadline, cancelled):
+        with self._lock:
+            if self.waiting >= self.queue_size and self._idle.empty():
+                self.events['rejected'] += 1
+                raise Overloaded("Server is busy, try again shortly", status=429)
+            self.waiting += 1
+        try:
+            give_up = time.monotonic() + self.queue_timeout
+            if deadline is not None:
+                give_up = min(give_up, deadline)
+            while True:
+                try:
+                    worker = self._idle.get(timeout=POLL_SECONDS)
+                except queue.Empty:
+                    worker = None
+                if worker is not None:
+                    if worker.process.is_alive():
+                        return worker
+                    # died while idle (oom killer, ...), start another and keep waiting
+                    self._replace(worker)
+                    continue
+                if cancelled is not None and cancelled():
+                    self._count('cancelled')
+                    raise Cancelled("Client disconnected")
+                if time.monotonic() >= give_up:
+                    if deadline is not None and give_up == deadline:
+                        self._count('budget_exceeded')
+                        raise BudgetExceeded("Request ran out of time waiting for a worker")
+                    self._count('queue_timeout')
+                    raise Overloaded("No worker became free in time, try again shortly")
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+    def run(self, fn, *args, deadline=None, cancelled=None):
+        # runs fn(*args) in a worker and returns its result or raises its exception. deadline is a
+        # time.monotonic() value, cancelled a callable polled while waiting
+        with metrics.stage('queue_wait'):
+            worker = self._acquire(deadline, cancelled)
+        with self._lock:
+            self.busy += 1
+        try:
+            worker.conn.send((fn, args))
+            while not worker.conn.poll(POLL_SECONDS):
+                if deadline is not None and time.monotonic() >= deadline:
+                    self._replace(worker)
+                    worker = None
+                    self._count('budget_exceeded')
+                    raise BudgetExceeded("Request ran past its time budget and was stopped")
+                if cancelled is not None and cancelled():
+                    self._replace(worker)
+                    worker = None
+                    self._count('cancelled')
+                    raise Cancelled("Client disconnected")
+            ok, value, stages, report = worker.conn.recv()
+            if report is not None:
+                with self._lock:
+                    self._reports[worker.process.pid] = report
+        except (EOFError, OSError):
+            if worker is not None:
+                self._replace(worker)
+                worker = None
+            self._count('failed')
+            raise RuntimeError("Worker process exited unexpectedly")
+        finally:
+            with self._lock:
+                self.busy -= 1
+            if worker is not None:
+                self._idle.put(worker)
+        metrics.merge_stages(stages)
+        self._count('completed' if ok else 'failed')
+        if not ok:
+            raise value
+        return value
+
+    def reports(self):
+        # reporter() results of the live workers, from the last task each one ran
+        with self._lock:
+            return list(self._reports.values())
+
+    def collect(self):
+        with self._lock:
+            return [
+                ('workbench_work_queue_depth', 'gauge', 'Requests waiting for a pool worker.', [({}, self.waiting)]),
+                ('workbench_work_pool_busy', 'gauge', 'Pool workers running a task.', [({}, self.busy)]),
+                ('workbench_work_pool_workers', 'gauge', 'Size of the worker pool.', [({}, self.workers)]),
+                ('workbench_work_pool_events_total', 'counter', 'Pool tasks by outcome, and worker restarts.',
+                 [({'event': event}, count) for event, count in self.events.items()])
+            ]
@@ -0,0 +1,73 @@
+import numpy as np
+
+# closed-form ZYZ Euler angles for a batch of single-qubit unitaries, U = e^{i phase} RZ(phi) RY(theta) RZ(lam).
+# mirrors the simplification qiskit's OneQubitEulerDecomposer(basis='ZYZ') applies, so the same
+# rotations are skipped: RZ(lam) is applied first, then RY(theta), then RZ(phi)
+
+DEFAULT_ATOL = 1e-12
+
+
+def mod_2pi(angle, atol=0.0):
+    # wrap into [-pi, pi), with values within atol of pi mapped to -pi
+    wrapped = np.mod(angle + np.pi, 2 * np.pi) - np.pi
+    return np.where(np.abs(wrapped - np.pi) < atol, -np.pi, wrapped)
+
+
+def zyz_params(U):
+    # raw (theta, phi, lam, phase) of the OpenQASM SU(2) parameterization
+    U = np.asarray(U, dtype=complex)
+    det = U[..., 0, 0] * U[..., 1, 1] - U[..., 0, 1] * U[..., 1, 0]
+    coeff = 1 / np.sqrt(det)
+    phase = -np.angle(coeff)
+    su = U * coeff[..., None, None]
+    theta = 2 * np.arctan2(np.abs(su[..., 1, 0]), np.abs(su[..., 0, 0]))
+    phiplambda2 = np.angle(su[..., 1, 1])
+    phimlambda2 = np.angle(su[..., 1, 0])
+    return theta, phiplambda2 + phimlambda2, phiplambda2 - phimlambda2, phase
+
+
+def zyz_angles(U, atol=DEFAULT_ATOL):
+    # returns (lam, theta, phi, global_phase, on) where on is a (..., 3) bool array saying which of
+    # RZ(lam), RY(theta), RZ(phi) survive simplification
+    theta, phi, lam, phase = zyz_params(U)
+    gphase = phase - (phi + lam) / 2
+
+    # no Y rotation: the two Z rotations merge into one
+    no_y = np.abs(theta) < atol
+
+    # Y rotation by pi: move phi into lam and the global phase
+    flip = ~no_y & (np.abs(theta - np.pi) < atol)
+    gphase = np.where(flip, gphase + phi, gphase)
+    lam = np.where(flip, lam - phi, lam)
+    phi = np.where(flip, 0.0, phi)
+
+    # prefer RY(-theta) over a pair of pi Z rotations
+    non_canonical = ~no_y & ((np.abs(mod_2pi(lam + np.pi, atol)) < atol) | (np.abs(mod_2pi(phi + np.pi, atol)) < atol))
+    lam = np.where(non_canonical, lam + np.pi, lam)
+    theta = np.where(non_canonical, -theta, theta)
+    phi = np.where(non_canonical, phi + np.pi, phi)
+
+    lam = mod_2pi(np.where(no_y, lam + phi, lam), atol)
+    phi = np.where(no_y, 0.0, mod_2pi(phi, atol))
+    theta = np.where(no_y, 0.0, theta)
+
+    lam_on = np.abs(lam) > atol
+    phi_on = ~no_y & (np.abs(phi) > atol)
+    gphase = gphase + np.where(lam_on, lam / 2, 0.0) + np.where(phi_on, phi / 2, 0.0)
+    on = np.stack([lam_on, ~no_y, phi_on], axis=-1)
+    return lam, theta, phi, gphase, on
+
+
+def rz_matrix(angle):
+    angle = np.asarray(angle, dtype=float)
+    out = np.zeros(angle.shape + (2, 2), dtype=complex)
+    out[..., 0, 0] = np.exp(-0.5j * angle)
+    out[..., 1, 1] = np.exp(0.5j * angle)
+    return out
+
+
+def ry_matrix(angle):
+    angle = np.asarray(angle, dtype=float)
+    c = np.cos(angle / 2)
+    s = np.sin(angle / 2)
+    return np.stack([np.stack([c, -s], axis=-1), np.stack([s, c], axis=-1)], axis=-2).astype(complex)